@@ -0,0 +1,80 @@
+"""
+Compare matching context paths with fnmatch against the compiled GlobMatcher.
+
+Usage::
+
+    python benchmarks/glob_matcher.py [number_of_paths] [number_of_globs]
+
+Defaults to 100000 paths and 50 globs.
+"""
+
+import fnmatch
+import random
+import sys
+import time
+
+from harpoon.ship.matcher import GlobMatcher
+
+
+def make_paths(count, rnd):
+    folders = ["src", "lib", "docs", "tests", "node_modules", "build", "assets", "vendor"]
+    extensions = ["py", "js", "rst", "txt", "png", "json", "pyc"]
+    paths = []
+    for i in range(count):
+        depth = rnd.randint(1, 5)
+        parts = [rnd.choice(folders) for _ in range(depth)]
+        parts.append("file{0}.{1}".format(i, rnd.choice(extensions)))
+        paths.append("/".join(parts))
+    return paths
+
+
+def make_globs(count, rnd):
+    folders = ["src", "lib", "docs", "tests", "node_modules", "build", "assets", "vendor"]
+    extensions = ["py", "js", "rst", "txt", "png", "json", "pyc"]
+    globs = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            globs.append("{0}/{1}/**".format(rnd.choice(folders), rnd.choice(folders)))
+        elif kind == 1:
+            globs.append("*.{0}{1}".format(rnd.choice(extensions), i))
+        elif kind == 2:
+            globs.append("{0}/*.{1}".format(rnd.choice(folders), rnd.choice(extensions)))
+        else:
+            globs.append("{0}/file{1}.*".format(rnd.choice(folders), rnd.randint(0, 1000)))
+    return globs
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main(argv):
+    number_of_paths = int(argv[0]) if len(argv) > 0 else 100000
+    number_of_globs = int(argv[1]) if len(argv) > 1 else 50
+
+    rnd = random.Random(0)
+    paths = make_paths(number_of_paths, rnd)
+    globs = make_globs(number_of_globs, rnd)
+
+    def with_fnmatch():
+        return [path for path in paths if any(fnmatch.fnmatch(path, glob) for glob in globs)]
+
+    def with_matcher():
+        matcher = GlobMatcher(globs)
+        return [path for path in paths if matcher.matches(path)]
+
+    fnmatch_took, expected = timed(with_fnmatch)
+    matcher_took, found = timed(with_matcher)
+    assert found == expected, "GlobMatcher disagreed with fnmatch"
+
+    print("{0} paths x {1} globs, {2} matched".format(len(paths), len(globs), len(found)))
+    print("fnmatch:     {0:.3f}s".format(fnmatch_took))
+    print("GlobMatcher: {0:.3f}s".format(matcher_took))
+    print("speedup:     {0:.1f}x".format(fnmatch_took / matcher_took))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
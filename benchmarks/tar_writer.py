@@ -0,0 +1,83 @@
+"""
+Compare the throughput of tarfile.TarFile.add against the TarWriter fast path.
+
+Usage::
+
+    python benchmarks/tar_writer.py [number_of_files] [file_size_in_kb]
+
+Defaults to 2000 files of 256KB each. Both writers make the same tar in a
+temporary folder from the same files, using the lstat we would already have
+from walking the context.
+"""
+
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+from harpoon.ship.tar_writer import TarWriter
+
+
+def make_files(directory, count, size):
+    paths = []
+    data = os.urandom(size)
+    for i in range(count):
+        folder = os.path.join(directory, "folder{0}".format(i % 20))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, "file{0}".format(i))
+        with open(path, "wb") as fle:
+            fle.write(data)
+        paths.append((path, "./{0}".format(os.path.relpath(path, directory))))
+    return paths
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(argv):
+    number_of_files = int(argv[0]) if len(argv) > 0 else 2000
+    file_size = (int(argv[1]) if len(argv) > 1 else 256) * 1024
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = make_files(os.path.join(directory, "files"), number_of_files, file_size)
+        stats = {path: os.lstat(path) for path, _ in paths}
+        total = number_of_files * file_size
+
+        def with_tarfile():
+            with tarfile.open(os.path.join(directory, "tarfile.tar"), "w") as t:
+                for path, arcname in paths:
+                    t.add(path, arcname=arcname)
+
+        def with_writer():
+            with tarfile.open(os.path.join(directory, "writer.tar"), "w") as t:
+                writer = TarWriter(t)
+                for path, arcname in paths:
+                    writer.add(path, arcname, stats[path])
+
+        # Make sure the files are in the page cache before either is timed
+        with_tarfile()
+
+        tarfile_took = timed(with_tarfile)
+        writer_took = timed(with_writer)
+
+        with open(os.path.join(directory, "tarfile.tar"), "rb") as one:
+            with open(os.path.join(directory, "writer.tar"), "rb") as two:
+                assert one.read() == two.read(), "TarWriter made a different tar"
+
+        mb = total / 1024 / 1024
+        print("{0} files of {1}KB ({2:.0f}MB)".format(number_of_files, file_size // 1024, mb))
+        print("tarfile:   {0:.3f}s {1:.0f}MB/s".format(tarfile_took, mb / tarfile_took))
+        print("TarWriter: {0:.3f}s {1:.0f}MB/s".format(writer_took, mb / writer_took))
+        print("speedup:   {0:.1f}x".format(tarfile_took / writer_took))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -25,12 +25,18 @@ import requests
 from delfick_project.norms import Meta, sb
 from docker.errors import APIError as DockerAPIError
 
+from harpoon import helpers as hp
 from harpoon.container_manager import Manager, make_server, wait_for_server
 from harpoon.errors import BadOption, HarpoonError
 from harpoon.option_spec.harpoon_specs import HarpoonSpec
-from harpoon.ship.builder import Builder
+from harpoon.ship.builder import UNCHANGED, Builder
+from harpoon.ship.changes import ChangedImages
 from harpoon.ship.context import ContextBuilder
+from harpoon.ship.context_report import ContextReport
+from harpoon.ship.parallel import pushing_in_background
+from harpoon.ship.scheduler import in_dependency_order
 from harpoon.ship.syncer import Syncer
+from harpoon.ship.watcher import ContextWatcher
 
 log = logging.getLogger("harpoon.actions")
 
@@ -147,13 +153,21 @@ def pull_parent(collector, image, **kwargs):
 @an_action()
 def pull_all(collector, image, **kwargs):
     """Pull all the images"""
+    harpoon = collector.configuration["harpoon"]
     images = collector.configuration["images"]
+    to_pull = dict(
+        (name, image)
+        for layer in Builder().layered(images, only_pushable=True)
+        for name, image in layer
+    )
 
-    for layer in Builder().layered(images, only_pushable=True):
-        for image_name, image in layer:
-            log.info("Pulling %s", image_name)
+    def pull_one(image):
+        log.info("Pulling %s", image.name)
+        with harpoon.build_times.timed("pull", image.name):
             pull(collector, image, **kwargs)
 
+    in_dependency_order(harpoon, "pull", to_pull, images, pull_one)
+
 
 @an_action()
 def pull_all_external(collector, **kwargs):
@@ -189,12 +203,12 @@ def make(collector, image, **kwargs):
         image.tag = tag
 
     Builder().make_image(image, collector.configuration["images"])
-    print("Created image {0}".format(image.image_name))
+    hp.write_to(image.harpoon.stdout, "Created image {0}\n".format(image.image_name))
 
 
 @an_action()
 def make_all(collector, **kwargs):
-    """Creates all the images in layered order"""
+    """Creates all the images, each one after the images it depends on"""
     configuration = collector.configuration
     push = configuration["harpoon"].do_push
     only_pushable = configuration["harpoon"].only_pushable
@@ -205,15 +219,85 @@ def make_all(collector, **kwargs):
     if tag is sb.NotSpecified:
         tag = configuration["harpoon"].tag
 
+    harpoon = configuration["harpoon"]
     images = configuration["images"]
-    for layer in Builder().layered(images, only_pushable=only_pushable):
-        for _, image in layer:
-            if tag is not sb.NotSpecified:
-                image.tag = tag
-            Builder().make_image(image, images, ignore_deps=True, ignore_parent=True)
+    to_make = dict(
+        (name, image)
+        for layer in Builder().layered(images, only_pushable=only_pushable)
+        for name, image in layer
+    )
+
+    if harpoon.changed_since is not sb.NotSpecified:
+        changed = ChangedImages(images, collector.configuration_files)
+        affected = changed.since(harpoon.changed_since)
+        log.info(
+            "Found images affected by changes\tsince=%s\taffected=%s",
+            harpoon.changed_since,
+            ",".join(sorted(affected & set(to_make))),
+        )
+        to_make = dict((name, image) for name, image in to_make.items() if name in affected)
+
+    harpoon.context_scans.share(image.context for image in to_make.values())
+
+    def make(image, pusher=None):
+        if tag is not sb.NotSpecified:
+            image.tag = tag
+        with harpoon.build_times.timed("make", image.name) as timing:
+            made = Builder().make_image(image, images, ignore_deps=True, ignore_parent=True)
+            timing["skipped"] = made is UNCHANGED
+            hp.write_to(harpoon.stdout, "Created image {0}\n".format(image.image_name))
+        if pusher is not None and image.image_index:
+            pusher.push(image)
+
+    if not push:
+        in_dependency_order(harpoon, "make", to_make, images, make)
+        return
+
+    # Push each image while we make the ones after it
+    with pushing_in_background(harpoon, Syncer().push, workers=harpoon.push_jobs) as pusher:
+        in_dependency_order(harpoon, "make", to_make, images, partial(make, pusher=pusher))
+
+
+@an_action(needs_image=True)
+def watch(collector, image, **kwargs):
+    """
+    Make this image and make it again whenever the files in its context change
+
+    The files are kept track of as they change, so each build starts without
+    needing to find all the files in the context again.
+    """
+    configuration = collector.configuration
+    harpoon = configuration["harpoon"]
+    images = configuration["images"]
+
+    if not image.context.enabled:
+        raise BadOption("This image has no context to watch", image=image.name)
+
+    watcher = ContextWatcher(image.context)
+    watcher.start()
+
+    def make(changed=None):
+        if changed is not None:
+            log.info("Files changed in the context\tchanged=%s", len(changed))
+
+            # The first build also makes dependencies, which may share this
+            # parent_dir without pruning the same folders. And find_options
+            # means the files are found with find rather than the walker.
+            if not image.context.find_options:
+                harpoon.context_scans.update(image.context, watcher.scan(harpoon.silent_build))
+
+        try:
+            Builder().make_image(
+                image, images, ignore_deps=changed is not None, ignore_parent=changed is not None
+            )
+        except HarpoonError as error:
+            log.error("Failed to make the image\terror=%s", error)
+        else:
             print("Created image {0}".format(image.image_name))
-            if push and image.image_index:
-                Syncer().push(image)
+        print("Watching {0} for changes".format(image.context.parent_dir))
+
+    make()
+    watcher.watch(make)
 
 
 @an_action()
@@ -308,8 +392,33 @@ def print_dockerfile(collector, image, **kwargs):
 def get_docker_context(collector, image, **kwargs):
     """Output the context that would be sent to docker if we made this image"""
     with image.make_context() as ctx:
+        ctx.save(os.environ.get("FILENAME", f"./context_{image.name}.tar"))
+
+
+@an_action(needs_image=True)
+def context_report(collector, image, artifact, **kwargs):
+    """
+    Print what is in the context for this image and how long it took to make
+
+    Use ``--artifact`` to say how many of the largest files and folders to show
+    """
+    top = 10
+    if artifact not in (None, "", sb.NotSpecified):
+        try:
+            top = int(artifact)
+        except ValueError:
+            raise BadOption("The artifact option must be a number of files to show", got=artifact)
+
+    builder = ContextBuilder()
+    with image.make_context(builder=builder) as ctx:
         ctx.close()
-        shutil.copyfile(ctx.name, os.environ.get("FILENAME", f"./context_{image.name}.tar"))
+        if ctx.size is None:
+            # Streamed contexts are only made when something reads them
+            with builder.timed("tar"):
+                ctx.save(os.devnull)
+
+        for line in ContextReport(image.context, builder, ctx.size, top=top).lines():
+            print(line)
 
 
 @an_action()
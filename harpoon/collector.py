@@ -46,6 +46,7 @@ class Collector(Collector):
 
     def setup(self):
         self.task_overrides = {}
+        self.configuration_files = []
 
     def alter_clone_args_dict(self, new_collector, new_args_dict, options=None):
         return MergedOptions.using(
@@ -167,6 +168,7 @@ class Collector(Collector):
 
     def read_file(self, location):
         """Read in a yaml file and return as a python object"""
+        self.configuration_files.append(location)
         with open(location) as fle:
             try:
                 return yaml.YAML(typ="safe").load(fle)
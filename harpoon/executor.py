@@ -145,6 +145,13 @@ class App(App):
             action="store_true",
         )
 
+        parser.add_argument(
+            "--always-build",
+            help="Build images even if nothing that goes into them has changed",
+            dest="harpoon_always_build",
+            action="store_true",
+        )
+
         parser.add_argument(
             "--no-intervention",
             help="Don't ask to intervene broken builds",
@@ -191,6 +198,37 @@ class App(App):
             action="store_true",
         )
 
+        parser.add_argument(
+            "--compress-context",
+            help="Whether to gzip contexts before sending them to docker",
+            dest="harpoon_compress_context",
+            choices=["auto", "always", "never"],
+            default=argparse.SUPPRESS,
+        )
+
+        parser.add_argument(
+            "--jobs",
+            help="How many images to make or pull at the same time with make_all, make_pushable, push_all and pull_all",
+            dest="harpoon_jobs",
+            type=int,
+            default=argparse.SUPPRESS,
+        )
+
+        parser.add_argument(
+            "--push-jobs",
+            help="How many images to push at the same time while make_all makes the rest",
+            dest="harpoon_push_jobs",
+            type=int,
+            default=argparse.SUPPRESS,
+        )
+
+        parser.add_argument(
+            "--changed-since",
+            help="Only make the images affected by changes in git since this ref with make_all, make_pushable and push_all",
+            dest="harpoon_changed_since",
+            default=argparse.SUPPRESS,
+        )
+
         parser.add_argument(
             "--docker-output",
             help="The file we print docker output to",
@@ -1,3 +1,5 @@
+import json
+
 from delfick_project.norms import dictobj, sb
 
 
@@ -32,6 +34,51 @@ class Command(dictobj):
                 if getattr(options, "image", sb.NotSpecified) is not sb.NotSpecified:
                     return options.image
 
+    @property
+    def context_sources(self):
+        """
+        Return the paths in the context used by this ADD or COPY instruction
+
+        Other instructions and those that get content from elsewhere use no paths
+        and we return None if we can't tell what paths are used. Docker doesn't
+        care about the case of instructions, so neither do we.
+        """
+        action = self.action.upper()
+        if action not in ("ADD", "COPY") or self.extra_context is not sb.NotSpecified:
+            return []
+
+        if not isinstance(self.command, str):
+            return None
+
+        command = self.command.strip()
+        while command.startswith("--"):
+            flag, _, command = command.partition(" ")
+            if flag.startswith("--from="):
+                return []
+            command = command.strip()
+
+        if command.startswith("["):
+            try:
+                args = json.loads(command)
+            except ValueError:
+                return None
+        else:
+            args = command.split()
+
+        if len(args) < 2:
+            return None
+
+        sources = []
+        for source in args[:-1]:
+            if "$" in source:
+                return None
+            if source.startswith("<<"):
+                continue
+            if action == "ADD" and "://" in source:
+                continue
+            sources.append(source)
+        return sources
+
     @property
     def instruction(self):
         return self._instruction
@@ -125,6 +172,21 @@ class Commands(dictobj):
         """Return the commands as a list of strings"""
         return [command.as_string for command in self.commands]
 
+    @property
+    def context_sources(self):
+        """
+        Return the paths in the context used by all the ADD and COPY instructions
+
+        Return None if we can't tell what paths any of those instructions use
+        """
+        sources = []
+        for command in self.commands:
+            found = command.context_sources
+            if found is None:
+                return None
+            sources.extend(found)
+        return sources
+
     @property
     def extra_context(self):
         for command in self.commands:
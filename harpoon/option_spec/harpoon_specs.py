@@ -5,17 +5,30 @@ options.
 The specifications are responsible for sanitation, validation and normalisation.
 """
 
+import os
 import sys
 
 from delfick_project.norms import dictobj, sb, va
 
 from harpoon import helpers as hp
+from harpoon.errors import BadSpecValue
 from harpoon.formatter import MergedOptionStringFormatter
 from harpoon.helpers import memoized_property
 from harpoon.option_spec import authentication_objs, task_objs
 from harpoon.option_spec.command_objs import Commands
 from harpoon.option_spec.command_specs import command_spec
+from harpoon.ship.context_cache import ContextCache, ExtractionCache
+from harpoon.ship.context_scans import ContextScans
+from harpoon.ship.fingerprint import Fingerprinter, HashCache
+from harpoon.ship.fragments import FragmentStore
 from harpoon.ship.network import NetworkManager
+from harpoon.ship.scheduler import BuildTimes
+
+
+def default_cache_dir():
+    """Return the folder harpoon keeps caches in between runs"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "harpoon")
 
 
 class Harpoon(dictobj):
@@ -24,16 +37,22 @@ class Harpoon(dictobj):
         "flat": "Don't show images as layers when doing ``harpoon show``",
         "extra": "Sets the ``$@`` variable. Alternatively specify these after a ``--`` on the commandline",
         "debug": "Whether debug has been specified",
+        "jobs": "How many images ``make_all``, ``make_pushable``, ``push_all`` and ``pull_all`` do at the same time",
         "stdout": "The stdout to use for printing",
+        "push_jobs": "How many images ``make_all`` pushes at the same time while it makes the rest",
         "config": "The location of the configuration to use. If not set the ``HARPOON_CONFIG`` env variable is used",
         "addons": "A dictionary of namespace to list of names for addons to register",
         "do_push": "Push images after making them (automatically set by the ``push`` tasks",
         "artifact": "Extra information for actions",
+        "cache_dir": "The folder harpoon keeps caches in between runs",
         "no_cleanup": "Don't cleanup the images/containers automatically after finish",
+        "changed_since": "Only make the images affected by changes in git since this ref with ``make_all``, ``make_pushable`` and ``push_all``",
+        "always_build": "Build images even when their fingerprint says nothing that goes into them has changed",
         "tty_stdin": "The stdin to use for a tty",
         "tty_stdout": "The stdout to use for a tty",
         "tty_stderr": "The stderr to use for a tty",
         "extra_files": "Extra files to load in as configuration",
+        "compress_context": "Whether to gzip contexts before sending them to docker. One of ``auto``, ``always`` or ``never``, where ``auto`` only compresses when docker isn't on a local socket",
         "chosen_task": "The task to run",
         "interactive": "Run the container with a tty",
         "chosen_image": "The image that we want to run",
@@ -43,6 +62,9 @@ class Harpoon(dictobj):
         "ignore_missing": "Don't raise errors if we try to pull an image that doesn't exist",
         "docker_context": "The docker context object (set internally)",
         "no_intervention": "Don't create intervention images when an image breaks",
+        "context_cache_size": "The maximum size in bytes of the cache of contexts",
+        "extraction_cache_size": "The maximum size in bytes of the cache of content got from images",
+        "fragment_cache_size": "The maximum size in bytes of the cache of files in contexts",
         "intervene_afterwards": "Create an intervention image even if the image succeeds",
         "docker_context_maker": "Function that makes a new docker context object (set internally)",
     }
@@ -51,6 +73,32 @@ class Harpoon(dictobj):
     def network_manager(self):
         return NetworkManager(self.docker_api)
 
+    @hp.memoized_property
+    def context_cache(self):
+        return ContextCache(os.path.join(self.cache_dir, "contexts"), self.context_cache_size)
+
+    @hp.memoized_property
+    def extraction_cache(self):
+        return ExtractionCache(
+            os.path.join(self.cache_dir, "extractions"), self.extraction_cache_size
+        )
+
+    @hp.memoized_property
+    def fragment_store(self):
+        return FragmentStore(os.path.join(self.cache_dir, "fragments"), self.fragment_cache_size)
+
+    @hp.memoized_property
+    def context_scans(self):
+        return ContextScans()
+
+    @hp.memoized_property
+    def fingerprinter(self):
+        return Fingerprinter(HashCache(os.path.join(self.cache_dir, "hashes.sqlite")))
+
+    @hp.memoized_property
+    def build_times(self):
+        return BuildTimes(os.path.join(self.cache_dir, "build_times.json"))
+
     @property
     def docker_api(self):
         return self.docker_context.api
@@ -65,6 +113,20 @@ class other_options(dictobj):
     }
 
 
+class at_least(va.Validator):
+    """Validate that a number is at least this minimum"""
+
+    def setup(self, minimum):
+        self.minimum = minimum
+
+    def validate(self, meta, val):
+        if val < self.minimum:
+            raise BadSpecValue(
+                "Expected a number that is at least {0}".format(self.minimum), meta=meta, got=val
+            )
+        return val
+
+
 class authentication_spec(sb.Spec):
     def normalise_filled(self, meta, value):
         # Make sure the value is a dictionary with a 'use' option
@@ -185,6 +247,12 @@ class HarpoonSpec(object):
                 ),
                 use_gitignore=sb.defaulted(sb.boolean(), False),
                 ignore_find_errors=sb.defaulted(sb.boolean(), False),
+                use_cache=sb.defaulted(sb.boolean(), False),
+                stream=sb.defaulted(sb.boolean(), False),
+                compress=sb.optional_spec(sb.boolean()),
+                deterministic=sb.defaulted(sb.boolean(), False),
+                prune=sb.defaulted(sb.string_choice_spec(["never", "report", "always"]), "never"),
+                use_dockerignore=sb.defaulted(sb.boolean(), False),
             ),
         )
 
@@ -356,13 +424,18 @@ class HarpoonSpec(object):
             tag=sb.optional_spec(sb.string_spec()),
             extra=sb.defaulted(formatted_string, ""),
             debug=sb.defaulted(sb.boolean(), False),
+            jobs=sb.defaulted(sb.and_spec(sb.integer_spec(), at_least(1)), 1),
+            push_jobs=sb.defaulted(sb.and_spec(sb.integer_spec(), at_least(1)), 1),
             addons=sb.dictof(sb.string_spec(), sb.listof(sb.string_spec())),
             artifact=sb.optional_spec(formatted_string),
+            changed_since=sb.optional_spec(formatted_string),
+            cache_dir=sb.defaulted(formatted_string, default_cache_dir()),
             extra_files=sb.listof(sb.string_spec()),
             chosen_task=sb.defaulted(formatted_string, "list_tasks"),
             chosen_image=sb.defaulted(formatted_string, ""),
             flat=sb.defaulted(formatted_boolean, False),
             no_cleanup=sb.defaulted(formatted_boolean, False),
+            always_build=sb.defaulted(formatted_boolean, False),
             interactive=sb.defaulted(formatted_boolean, True),
             silent_build=sb.defaulted(formatted_boolean, False),
             keep_replaced=sb.defaulted(formatted_boolean, False),
@@ -371,6 +444,12 @@ class HarpoonSpec(object):
             intervene_afterwards=sb.defaulted(formatted_boolean, False),
             do_push=sb.defaulted(formatted_boolean, False),
             only_pushable=sb.defaulted(formatted_boolean, False),
+            context_cache_size=sb.defaulted(sb.integer_spec(), 2 * 1024 * 1024 * 1024),
+            extraction_cache_size=sb.defaulted(sb.integer_spec(), 2 * 1024 * 1024 * 1024),
+            fragment_cache_size=sb.defaulted(sb.integer_spec(), 2 * 1024 * 1024 * 1024),
+            compress_context=sb.defaulted(
+                sb.string_choice_spec(["auto", "always", "never"]), "auto"
+            ),
             docker_context=sb.any_spec(),
             docker_context_maker=sb.any_spec(),
             stdout=sb.defaulted(sb.any_spec(), sys.stdout),
@@ -8,17 +8,21 @@ use of these options.
 import logging
 import os
 import shlex
+import tarfile
 import time
 import uuid
 from contextlib import contextmanager
+from io import BytesIO
 
 from delfick_project.norms import dictobj, sb
 from docker.errors import APIError as DockerAPIError
 
-from harpoon import helpers as hp
 from harpoon.amazon import assumed_role
 from harpoon.errors import BadImage, BadOption, HarpoonError
-from harpoon.ship.context import ContextBuilder
+from harpoon.ship.compression import is_local_daemon
+from harpoon.ship.context import IN_MEMORY_CONTEXT_SIZE, ContextBuilder
+from harpoon.ship.dockerignore import DockerIgnore
+from harpoon.ship.matcher import GlobMatcher
 from harpoon.ship.runner import Runner
 
 log = logging.getLogger("harpoon.option_spec.image_objs")
@@ -217,6 +221,16 @@ class Image(dictobj):
         for image, _ in self.dependency_images():
             yield image
 
+    @property
+    def compress_context(self):
+        """Whether to gzip our context when we send it to docker"""
+        if self.context.compress is not sb.NotSpecified:
+            return self.context.compress
+
+        if self.harpoon.compress_context == "auto":
+            return not is_local_daemon(self.harpoon.docker_api)
+        return self.harpoon.compress_context == "always"
+
     @property
     def cache_from_names(self):
         """Yield the image names to do --cache-from from"""
@@ -322,23 +336,67 @@ class Image(dictobj):
 
     def add_docker_file_to_tarfile(self, docker_file, tar):
         """Add a Dockerfile to a tarfile"""
-        with hp.a_temp_file() as dockerfile:
-            log.debug("Context: ./Dockerfile")
-            dockerfile.write("\n".join(docker_file.docker_lines).encode("utf-8"))
-            dockerfile.seek(0)
-            tar.add(dockerfile.name, arcname="./Dockerfile")
+        log.debug("Context: ./Dockerfile")
+        content = "\n".join(docker_file.docker_lines).encode("utf-8")
+        tarinfo = tarfile.TarInfo("./Dockerfile")
+        tarinfo.size = len(content)
+        tarinfo.mtime = int(time.time())
+        tar.addfile(tarinfo, BytesIO(content))
+
+    def context_files(self, builder):
+        """
+        Return ``[(filename, arcname), ...]`` for the files in our context
+
+        ``builder`` is the ``harpoon.ship.context.ContextBuilder`` to find them
+        with. Passing the builder and these files to ``make_context`` means the
+        context has exactly these files and we only look for them once.
+        """
+        return list(
+            builder.find_files_for_tar(
+                self.context, self.harpoon.silent_build, **self.context_file_options()
+            )
+        )
+
+    def context_file_options(self):
+        """Return the options that say which files go into our context"""
+        options = {}
+        if self.context.prune != "never":
+            options["sources"] = self.commands.context_sources
+        if self.harpoon.context_scans.shared(self.context):
+            options["scans"] = self.harpoon.context_scans
+        return options
 
     @contextmanager
-    def make_context(self, docker_file=None):
-        """Determine the docker lines for this image"""
+    def make_context(self, docker_file=None, builder=None, files=None):
+        """
+        Determine the docker lines for this image
+
+        ``builder`` is the ``harpoon.ship.context.ContextBuilder`` to use, if we
+        want to look at what it found afterwards. ``files`` are from
+        ``context_files`` with that builder if we already found them.
+        """
         kwargs = {
             "silent_build": self.harpoon.silent_build,
             "extra_context": self.commands.extra_context,
         }
+        if self.context.use_cache:
+            kwargs["cache"] = self.harpoon.context_cache
+            kwargs["fragments"] = self.harpoon.fragment_store
+        if self.context.stream:
+            kwargs["stream"] = True
+        else:
+            kwargs["memory_limit"] = IN_MEMORY_CONTEXT_SIZE
+        if self.context.deterministic:
+            kwargs["deterministic"] = True
+        kwargs.update(self.context_file_options())
+        if files is not None:
+            kwargs["files"] = files
         if docker_file is None:
             docker_file = self.docker_file
-        with ContextBuilder().make_context(self.context, **kwargs) as ctxt:
-            self.add_docker_file_to_tarfile(docker_file, ctxt.t)
+        if builder is None:
+            builder = ContextBuilder()
+        with builder.make_context(self.context, **kwargs) as ctxt:
+            self.add_docker_file_to_tarfile(docker_file, ctxt.overlay)
             yield ctxt
 
     def login(self, image_name, is_pushing):
@@ -445,6 +503,30 @@ class Context(dictobj):
             lambda: sb.NotSpecified,
         ): "Whether we should pay attention to git ignore logic",
         ("ignore_find_errors", False): "A hack to ignore weird find errors",
+        (
+            "use_cache",
+            False,
+        ): "Whether to reuse the context from the last build if none of the files have changed",
+        (
+            "stream",
+            False,
+        ): "Whether to create the context while it's uploaded rather than writing it to disk first",
+        (
+            "compress",
+            lambda: sb.NotSpecified,
+        ): "Whether to gzip the context before sending it to docker. Defaults to ``harpoon.compress_context``",
+        (
+            "deterministic",
+            False,
+        ): "Whether to make the tar for the context the same every time the files are the same",
+        (
+            "prune",
+            "never",
+        ): "Whether to only send files used by ADD and COPY. One of ``never``, ``report`` or ``always``",
+        (
+            "use_dockerignore",
+            False,
+        ): "Whether to leave out the files matched by the .dockerignore in parent_dir",
     }
 
     @property
@@ -463,6 +545,81 @@ class Context(dictobj):
     def use_gitignore(self, val):
         self._use_gitignore = val
 
+    @property
+    def include_matcher(self):
+        """A ``harpoon.ship.matcher.GlobMatcher`` for our include globs"""
+        return self.matcher_for("include")
+
+    @property
+    def exclude_matcher(self):
+        """A ``harpoon.ship.matcher.GlobMatcher`` for our exclude globs"""
+        return self.matcher_for("exclude")
+
+    def matcher_for(self, name):
+        """Compile the globs in this option, only recompiling if they change"""
+        globs = tuple(getattr(self, name) or ())
+        matchers = getattr(self, "_matchers", None)
+        if matchers is None:
+            matchers = self._matchers = {}
+
+        if name not in matchers or matchers[name].globs != list(globs):
+            matchers[name] = GlobMatcher(globs)
+        return matchers[name]
+
+    @property
+    def dockerignore(self):
+        """
+        A ``harpoon.ship.dockerignore.DockerIgnore`` for the .dockerignore in parent_dir
+
+        This is None if we aren't using it or there is no .dockerignore
+        """
+        if not self.use_dockerignore:
+            return None
+
+        location = os.path.join(self.parent_dir, ".dockerignore")
+        if getattr(self, "_dockerignore_location", None) != location:
+            self._dockerignore = DockerIgnore.from_file(location)
+            self._dockerignore_location = location
+        return self._dockerignore
+
+    def digest(
+        self,
+        fingerprinter,
+        silent_build=True,
+        scans=None,
+        sources=sb.NotSpecified,
+        builder=None,
+        files=None,
+    ):
+        """
+        Return a sha256 hex digest of the files in this context
+
+        ``fingerprinter`` is a ``harpoon.ship.fingerprint.Fingerprinter``. The
+        digest only changes when the files that would be in the context change.
+        ``sources`` are the paths used by the Dockerfile if we're pruning.
+
+        ``files`` are from ``find_files_for_tar`` with this ``builder`` if we
+        already found them, so that we digest the same files we put in a tar.
+        """
+        if builder is None:
+            builder = ContextBuilder()
+        if files is None:
+            files = list(
+                builder.find_files_for_tar(self, silent_build, scans=scans, sources=sources)
+            )
+
+        git_dir = None
+        if self.enabled:
+            try:
+                self.git_root
+                git_dir = self.parent_dir
+            except HarpoonError:
+                pass
+
+        return fingerprinter.digest(
+            files, stats=builder.stats, git_dir=git_dir, deterministic=self.deterministic
+        )
+
     @property
     def git_root(self):
         """
@@ -12,8 +12,9 @@ import sys
 from delfick_project.layerz import Layers
 
 from harpoon.errors import BadCommand, NoSuchImage, UserQuit
-from harpoon.ship.builders.base import BuilderBase
+from harpoon.ship.builders.base import FINGERPRINT_LABEL, BuilderBase
 from harpoon.ship.builders.normal import NormalBuilder
+from harpoon.ship.context import ContextBuilder
 from harpoon.ship.progress_stream import ProgressStream
 from harpoon.ship.runner import Runner
 
@@ -31,6 +32,8 @@ class BuildProgressStream(ProgressStream):
         self.current_container = None
         self.last_created_image = None
         self.intermediate_images = []
+        self.in_fingerprint_step = False
+        self.cached_before_fingerprint = None
 
     def interpret_line(self, line_detail):
         if "stream" in line_detail:
@@ -54,6 +57,12 @@ class BuildProgressStream(ProgressStream):
         if stripped.startswith("--->") and " " in stripped:
             self.last_created_image = stripped.split(" ", 1)[1]
 
+        if line.startswith("Step ") and "LABEL" in line and FINGERPRINT_LABEL in line:
+            # Docker adds a step for our fingerprint label, which shouldn't
+            # change whether the image was cached
+            self.in_fingerprint_step = True
+            self.cached_before_fingerprint = self.cached
+
         if line.startswith("Step "):
             action = line[line.find(":") + 1 :].strip()
             self.current_action = action[: action.find(" ")].strip()
@@ -79,6 +88,9 @@ class BuildProgressStream(ProgressStream):
         elif line.strip().startswith("---> Using cache"):
             self.cached = True
 
+        if self.in_fingerprint_step:
+            self.cached = self.cached_before_fingerprint
+
         self.add_line(line)
 
     def interpret_status(self, line):
@@ -97,6 +109,9 @@ class BuildProgressStream(ProgressStream):
 ###   BUILDER
 ########################
 
+# Returned by build_image when the image already has the fingerprint we have
+UNCHANGED = object()
+
 
 class Builder(BuilderBase):
     """Build an image from Image configuration"""
@@ -112,7 +127,12 @@ class Builder(BuilderBase):
         ignore_parent=False,
         pushing=False,
     ):
-        """Make us an image"""
+        """
+        Make us an image
+
+        Return what ``build_image`` returns for this image, which is
+        ``UNCHANGED`` if it didn't need building.
+        """
         made = {} if made is None else made
         chain = [] if chain is None else chain
         parent_chain = [] if parent_chain is None else parent_chain
@@ -153,12 +173,44 @@ class Builder(BuilderBase):
         return cached
 
     def build_image(self, conf, pushing=False):
-        """Build this image"""
-        with conf.make_context() as context:
+        """
+        Build this image
+
+        The image is labelled with a fingerprint of everything that went into
+        it and we don't build it again if the image we would replace already
+        has the fingerprint we have now, in which case we return ``UNCHANGED``.
+        Otherwise we return whether the build was cached.
+
+        We find the files in the context once and use them for both the
+        fingerprint and the context, so the label describes what we built.
+        """
+        builder = ContextBuilder()
+        files = conf.context_files(builder)
+        fingerprint = self.image_fingerprint(conf, builder, files)
+        if fingerprint is not None and not conf.harpoon.always_build:
+            if self.has_fingerprint(conf, fingerprint):
+                log.info(
+                    "Image is unchanged, not building it\timage=%s\tfingerprint=%s",
+                    conf.image_name_with_tag,
+                    fingerprint,
+                )
+                return UNCHANGED
+
+        with conf.make_context(builder=builder, files=files) as context:
+            labels = None
+            if fingerprint is not None:
+                if not conf.context.stream and builder.changed_since_found(files):
+                    log.warning(
+                        "Files changed while making the context, not labelling the image\timage=%s",
+                        conf.image_name_with_tag,
+                    )
+                else:
+                    labels = {FINGERPRINT_LABEL: fingerprint}
+
             try:
                 stream = BuildProgressStream(conf.harpoon.silent_build)
                 with self.remove_replaced_images(conf) as info:
-                    cached = NormalBuilder().build(conf, context, stream)
+                    cached = NormalBuilder().build(conf, context, stream, labels=labels)
                     info["cached"] = cached
             except (KeyboardInterrupt, Exception) as error:
                 exc_info = sys.exc_info()
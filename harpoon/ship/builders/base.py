@@ -1,17 +1,30 @@
+import hashlib
+import json
 import logging
-import os
 from contextlib import contextmanager
 
 import docker.errors
 import humanize
 from delfick_project.norms import sb
 
+from harpoon.ship.context import ContextBuilder
+
 log = logging.getLogger("harpoon.ship.builders.mixin")
 
+FINGERPRINT_LABEL = "harpoon.fingerprint"
+
 
 class BuilderBase(object):
     def log_context_size(self, context, conf):
-        context_size = humanize.naturalsize(os.stat(context.name).st_size)
+        if context.size is None:
+            log.info(
+                "Building '%s' in '%s' with a streamed context",
+                conf.name,
+                conf.context.parent_dir,
+            )
+            return
+
+        context_size = humanize.naturalsize(context.size)
         log.info(
             "Building '%s' in '%s' with %s of context",
             conf.name,
@@ -19,6 +32,81 @@ class BuilderBase(object):
             context_size,
         )
 
+    def inspect_image(self, docker_api, image_name):
+        """Return what docker knows about this image, or None if we don't have it"""
+        try:
+            return docker_api.inspect_image(image_name)
+        except docker.errors.ImageNotFound:
+            return None
+        except docker.errors.APIError as error:
+            if str(error).startswith("404 Client Error") and "Not Found" in str(error):
+                return None
+            raise
+
+    def image_fingerprint(self, conf, builder=None, files=None):
+        """
+        Return a sha256 of everything that goes into building this image
+
+        That is the Dockerfile, the files in the context and any contexts added
+        to it, the IDs of the images it depends on and what it uses as a cache.
+        Return None if we can't know everything before building, like when we
+        don't have a parent image yet or something is added from a url.
+
+        ``files`` are from ``conf.context_files(builder)`` if we already found
+        them, so that the fingerprint is of the files we go on to build with.
+        """
+        harpoon = conf.harpoon
+
+        for command in conf.commands.commands:
+            if command.action.upper() == "ADD" and "://" in str(command.command):
+                return None
+
+        parents = []
+        for dep in conf.commands.dependent_images:
+            if isinstance(dep, str):
+                image_name = dep.split()[0]
+                if ":" not in image_name and "@" not in image_name:
+                    image_name = "{0}:latest".format(image_name)
+            else:
+                image_name = dep.image_name_with_tag
+
+            if image_name == "scratch:latest":
+                parents.append([image_name, "scratch"])
+                continue
+
+            info = self.inspect_image(harpoon.docker_api, image_name)
+            if info is None:
+                return None
+            parents.append([image_name, info["Id"]])
+
+        if builder is None:
+            builder = ContextBuilder()
+        if files is None:
+            files = conf.context_files(builder)
+
+        added = []
+        for content, arcname in conf.commands.extra_context:
+            if not isinstance(content, str) and "context" in content:
+                added.append([arcname, content["context"].digest(harpoon.fingerprinter)])
+
+        parts = {
+            "docker_lines": conf.docker_file.docker_lines,
+            "context": conf.context.digest(harpoon.fingerprinter, builder=builder, files=files),
+            "added_contexts": added,
+            "parents": parents,
+            "cache_from": list(conf.cache_from_names),
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def has_fingerprint(self, conf, fingerprint):
+        """Return whether the image we would tag already has this fingerprint"""
+        info = self.inspect_image(conf.harpoon.docker_api, conf.image_name_with_tag)
+        if info is None:
+            return False
+
+        labels = (info.get("Config") or {}).get("Labels") or {}
+        return labels.get(FINGERPRINT_LABEL) == fingerprint
+
     @contextmanager
     def remove_replaced_images(self, conf):
         tag = "latest" if conf.tag is sb.NotSpecified else conf.tag
@@ -4,6 +4,7 @@ from itertools import chain
 from harpoon import helpers as hp
 from harpoon.errors import FailedImage
 from harpoon.ship.builders.base import BuilderBase
+from harpoon.ship.compression import gzip_blocks
 from harpoon.ship.progress_stream import Failure, Unknown
 
 log = logging.getLogger("harpoon.ship.builders.normal")
@@ -13,7 +14,7 @@ class NormalBuilder(BuilderBase):
     def __init__(self, image_name=None):
         self.image_name = image_name
 
-    def build(self, conf, ctx, stream):
+    def build(self, conf, ctx, stream, labels=None):
         image_name = self.image_name
         if image_name is None:
             image_name = conf.image_name_with_tag
@@ -42,11 +43,19 @@ class NormalBuilder(BuilderBase):
                 "Using cache from the following images\timages={0}".format(", ".join(cache_from))
             )
 
+        fileobj = ctx.fileobj
+        encoding = None
+        if conf.compress_context:
+            fileobj = gzip_blocks(fileobj)
+            encoding = "gzip"
+
         lines = conf.harpoon.docker_api.build(
             tag=image_name,
-            fileobj=ctx.tmpfile,
+            fileobj=fileobj,
+            encoding=encoding,
             custom_context=True,
             cache_from=list(conf.cache_from_names),
+            labels=labels,
             rm=True,
             pull=False,
         )
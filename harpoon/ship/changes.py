@@ -0,0 +1,152 @@
+"""
+Working out which images are affected by changes in git.
+
+``changed_files`` asks git which files are different from a ref, including
+files git doesn't know about yet that it doesn't ignore. ``ChangedImages`` then
+says which images would have one of those files in their context, or in a
+context they add, and only counts files used by the ``ADD`` and ``COPY``
+instructions of the image when we can tell what those are. Images that
+depend on an affected image are affected as well.
+
+Changes to files that git ignores can't be found this way, so contexts that
+don't ``use_gitignore`` may miss changes to files that are in the context but
+ignored by git.
+"""
+
+import os
+
+from harpoon.errors import HarpoonError
+from harpoon.ship.context import command_output, sources_matcher
+
+
+def changed_files(directory, ref):
+    """
+    Return the absolute paths of the files that changed since this ref
+
+    This is the files that are different between the ref and the working tree
+    of the git repository directory is in, and the files that git doesn't
+    know about and doesn't ignore.
+    """
+
+    def git(args, cwd=directory):
+        output, status = command_output(["git", *args], cwd=cwd, nul_separated=True)
+        if status != 0:
+            raise HarpoonError(
+                "Failed to find what changed", ref=ref, directory=directory, output=output
+            )
+        return output
+
+    root = os.path.realpath(git(["rev-parse", "--show-toplevel"])[0].strip())
+    changed = git(["diff", "--name-only", "--no-renames", "-z", ref, "--"])
+    # ls-files only lists files under where it's run, so run it from the top
+    changed.extend(git(["ls-files", "-z", "--others", "--exclude-standard"], cwd=root))
+    return set(os.path.join(root, path) for path in changed)
+
+
+def context_uses(context, path, sources=None):
+    """
+    Return whether the file at this absolute path would be in this context
+
+    ``sources`` are the paths from ``harpoon.option_spec.command_objs.Commands.context_sources``
+    and files they don't use aren't counted.
+    """
+    if not context.enabled:
+        return False
+
+    relpath = os.path.relpath(path, os.path.realpath(context.parent_dir))
+    if relpath == "." or relpath.startswith("../"):
+        return False
+
+    if relpath == ".dockerignore" and context.use_dockerignore:
+        return True
+
+    included = context.include and context.include_matcher.matches(relpath)
+    if not included:
+        dockerignore = context.dockerignore
+        if dockerignore and dockerignore.matches(relpath):
+            return False
+        if context.exclude and context.exclude_matcher.matches(relpath):
+            return False
+
+    matcher = sources_matcher(sources)
+    return matcher is None or matcher.matches(relpath)
+
+
+class ChangedImages(object):
+    """
+    Finds the images affected by changes since a git ref
+
+    images
+        ``{name: image}`` of every image
+
+    config_files
+        The configuration files harpoon read. If any of these changed then
+        every image is affected.
+    """
+
+    def __init__(self, images, config_files=None):
+        self.images = images
+        self.config_files = set(os.path.realpath(path) for path in config_files or [])
+
+    def since(self, ref):
+        """Return the names of the images affected by changes since this ref"""
+        changed = set()
+        for directory in self.git_directories():
+            changed |= changed_files(directory, ref)
+        return self.affected_by(changed)
+
+    def git_directories(self):
+        """Return a folder from each git repository holding a context"""
+        directories = {}
+        for image in self.images.values():
+            for context in self.contexts_for(image):
+                try:
+                    directories[context.git_root] = context.parent_dir
+                except HarpoonError:
+                    pass
+        return sorted(directories.values())
+
+    def contexts_for(self, image):
+        """Yield the enabled contexts for this image and the contexts it adds"""
+        if image.context.enabled:
+            yield image.context
+
+        for content, _ in image.commands.extra_context:
+            if not isinstance(content, str) and "context" in content:
+                if content["context"].enabled:
+                    yield content["context"]
+
+    def directly_affected(self, image, changed):
+        """Return whether any of these changed files are used by this image"""
+        sources = image.commands.context_sources
+        for path in changed:
+            if image.context.enabled and context_uses(image.context, path, sources):
+                return True
+
+            for context in self.contexts_for(image):
+                if context is not image.context and context_uses(context, path):
+                    return True
+        return False
+
+    def affected_by(self, changed):
+        """Return the names of the images affected by these changed absolute paths"""
+        if changed & self.config_files:
+            return set(self.images)
+
+        affected = set(
+            name for name, image in self.images.items() if self.directly_affected(image, changed)
+        )
+
+        dependents = dict((name, set()) for name in self.images)
+        for name, image in self.images.items():
+            for dependency in image.dependencies(self.images):
+                if dependency in dependents:
+                    dependents[dependency].add(name)
+
+        found = set()
+        while affected:
+            name = affected.pop()
+            if name not in found:
+                found.add(name)
+                affected |= dependents[name]
+        return found
@@ -0,0 +1,100 @@
+"""
+Compressing the context before it's sent to docker.
+
+Sending an uncompressed context to a docker daemon on another machine can take
+a long time, so we can gzip it first and tell docker the build context has a
+``gzip`` Content-Encoding.
+
+Compressing with one core is often slower than the network, so the context is
+split into blocks that are compressed in parallel as separate gzip members.
+Concatenated gzip members are themselves a valid gzip stream and zlib releases
+the GIL while it compresses, so threads are enough to use every core.
+"""
+
+import logging
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import humanize
+
+log = logging.getLogger("harpoon.ship.compression")
+
+# The base_url docker-py uses for unix sockets and windows named pipes
+LOCAL_BASE_URLS = ("http+docker://localhost", "http+docker://localnpipe")
+
+
+def is_local_daemon(docker_api):
+    """Return whether this docker api talks to a daemon on this machine over a socket"""
+    return docker_api.base_url in LOCAL_BASE_URLS
+
+
+def compress_block(block, level):
+    """Return this block as one gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush()
+
+
+def iter_blocks(fileobj, block_size):
+    """
+    Yield blocks of ``block_size`` bytes from this file object or iterable of bytes
+
+    The last block may be smaller than ``block_size``.
+    """
+    if hasattr(fileobj, "read"):
+        while True:
+            block = fileobj.read(block_size)
+            if not block:
+                return
+            yield block
+
+    buf = bytearray()
+    for chunk in fileobj:
+        buf += chunk
+        while len(buf) >= block_size:
+            yield bytes(buf[:block_size])
+            del buf[:block_size]
+
+    if buf:
+        yield bytes(buf)
+
+
+def gzip_blocks(fileobj, level=6, block_size=1024 * 1024, workers=None):
+    """
+    Yield a gzip stream of what is in ``fileobj``
+
+    ``fileobj`` may be a file object or an iterable of bytes. Blocks of
+    ``block_size`` bytes are compressed on ``workers`` threads, defaulting to
+    the number of cpus, and at most two blocks per worker are held in memory.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    original = 0
+    compressed = 0
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for block in iter_blocks(fileobj, block_size):
+                original += len(block)
+                pending.append(executor.submit(compress_block, block, level))
+                while len(pending) >= workers * 2:
+                    member = pending.popleft().result()
+                    compressed += len(member)
+                    yield member
+
+            while pending:
+                member = pending.popleft().result()
+                compressed += len(member)
+                yield member
+        finally:
+            for future in pending:
+                future.cancel()
+
+    log.info(
+        "Compressed context from %s to %s",
+        humanize.naturalsize(original),
+        humanize.naturalsize(compressed),
+    )
@@ -9,69 +9,328 @@ sent to the server in a zip file.
 Here we define the class that builds this "context" zip file.
 """
 
-import fnmatch
 import logging
 import os
 import re
 import shlex
-import shutil
 import subprocess
 import tarfile
-import tempfile
-from contextlib import contextmanager
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import partial
 from io import BytesIO
 
 import docker
+import humanize
+from delfick_project.norms import sb
 
 from harpoon.errors import BadOption, HarpoonError
 from harpoon.helpers import a_temp_file
+from harpoon.ship.context_cache import copy_bytes, manifest_for
+from harpoon.ship.context_scans import Scan
+from harpoon.ship.matcher import GlobMatcher
+from harpoon.ship.streaming import ChunkReader, iter_written
+from harpoon.ship.tar_writer import TarWriter
+from harpoon.ship.walker import Walker
 
-regexes = {"whitespace": re.compile(r"\s+")}
+regexes = {
+    "staged_file": re.compile(r"^([0-7]{6}) [0-9a-f]+ [0-3]\t(.*)$", re.DOTALL),
+}
 
 log = logging.getLogger("harpoon.ship.context")
 
+# Contexts smaller than this are made in memory by images
+IN_MEMORY_CONTEXT_SIZE = 1024 * 1024
+
+
+def command_output(command, cwd=None, nul_separated=False):
+    """
+    Run this command and return (lines, exit_code)
+
+    If nul_separated is True then the output is split on NUL characters rather
+    than newlines and each line is decoded the same way as file names.
+    """
+    if isinstance(command, str):
+        command = shlex.split(command)
 
-def command_output(command, cwd=None):
     try:
-        output = subprocess.check_output(shlex.split(command), cwd=cwd)
+        output = subprocess.check_output(command, cwd=cwd)
         code = 0
     except subprocess.CalledProcessError as error:
         output = error.output
         code = error.returncode
 
-    lines = [line for line in output.decode().split("\n") if line.strip()]
+    if nul_separated:
+        lines = [os.fsdecode(line) for line in output.split(b"\0") if line]
+    else:
+        lines = [line for line in output.decode().split("\n") if line.strip()]
     return lines, code
 
 
+def extract_archive(chunks, fle):
+    """
+    Write what is in the archive from ``get_archive`` into ``fle``
+
+    If the archive is of a single file, we write the contents of that file.
+    Otherwise we write a tar of everything inside the folder at the start of
+    the archive.
+
+    We read the archive as it comes in, so we only hold a chunk of it in memory.
+    """
+    # In newer docker the archive is a gzipped archive
+    # But in older docker, it's a normal tar
+    with tarfile.open(fileobj=ChunkReader(chunks), mode="r|*") as tf:
+        first = tf.next()
+        if first is None:
+            return
+
+        if not first.isdir():
+            copy_bytes(tf.extractfile(first), fle)
+            return
+
+        prefix = "{0}/".format(first.name)
+        with tarfile.open(fileobj=fle, mode="w") as out:
+            for member in tf:
+                if member is first or member.isdir():
+                    continue
+
+                member.name = member.name[len(prefix) :]
+                if member.islnk() and member.linkname.startswith(prefix):
+                    member.linkname = member.linkname[len(prefix) :]
+
+                if member.isfile():
+                    out.addfile(member, fileobj=tf.extractfile(member))
+                else:
+                    out.addfile(member)
+
+
+def normalise_tarinfo(tarinfo):
+    """
+    Make this member of a tar the same regardless of who made it and when
+
+    The mtime is ``$SOURCE_DATE_EPOCH`` or 0, ownership is root and permissions
+    are 755 for folders and executables and 644 for everything else.
+    """
+    tarinfo.mtime = int(os.environ.get("SOURCE_DATE_EPOCH", 0))
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ""
+    if tarinfo.issym():
+        tarinfo.mode = 0o777
+    elif tarinfo.isdir() or tarinfo.mode & 0o111:
+        tarinfo.mode = 0o755
+    else:
+        tarinfo.mode = 0o644
+    return tarinfo
+
+
+def sources_matcher(sources):
+    """
+    Return a ``harpoon.ship.matcher.GlobMatcher`` for the files used by these sources
+
+    Sources are the paths from ADD and COPY instructions. A source that is a
+    folder uses everything under it. Docker doesn't let ``*`` match a ``/`` in
+    these but fnmatch does, which means we may keep more than we need but
+    never less. Return None if we can't tell or all the files may be used.
+    """
+    if sources is None:
+        return None
+
+    globs = []
+    for source in sources:
+        source = os.path.normpath(source.lstrip("/"))
+        if source == ".":
+            return None
+        globs.extend([source, "{0}/*".format(source)])
+    return GlobMatcher(globs)
+
+
 class ContextWrapper(object):
-    """Wraps a tarfile context, so we can continue changing it afterwards"""
+    """
+    Wraps a tarfile context, so we can continue changing it afterwards
 
-    def __init__(self, t, tmpfile):
+    The context is made of the tar in ``tmpfile`` and an ``overlay`` of extra
+    members that are put after the members in that tar when it's sent to docker.
+    This means we can make a copy with a different overlay without copying the tar.
+    """
+
+    def __init__(self, t, tmpfile, overlay=None, base_size=None):
         self.t = t
         self.tmpfile = tmpfile
+        self.overlay = DeferredTar() if overlay is None else overlay
+        self.base_size = base_size
+        self._overlay_bytes = None
 
     def close(self):
+        if self.base_size is None:
+            # The members of the tar end where the end of archive marker starts
+            self.base_size = self.t.offset
         self.t.close()
         self.tmpfile.flush()
         self.tmpfile.seek(0)
 
     @property
     def name(self):
+        """The location of our tar, or None if it was made in memory"""
+        if self.in_memory:
+            return None
         return self.tmpfile.name
 
+    @property
+    def in_memory(self):
+        return isinstance(self.tmpfile, BytesIO)
+
+    @property
+    def size(self):
+        return self.base_size + len(self.overlay_bytes())
+
+    @property
+    def fileobj(self):
+        """
+        What to give to docker as the context
+
+        The Dockerfile always goes into the overlay, so this is always the
+        members of our tar followed by the overlay.
+        """
+        return self.chunks()
+
+    def overlay_bytes(self):
+        """Return the overlay as a tar, including the end of archive marker"""
+        # We're asked for the size before the context is sent, so only make this
+        # again if something was added to the overlay in between
+        added = len(self.overlay.operations)
+        if self._overlay_bytes is None or self._overlay_bytes[0] != added:
+            buf = BytesIO()
+            self.overlay.write_to(buf)
+            self._overlay_bytes = (added, buf.getvalue())
+        return self._overlay_bytes[1]
+
+    def open_tar(self):
+        """Return a new file object for reading our tar from the start"""
+        if self.in_memory:
+            return BytesIO(self.tmpfile.getvalue())
+        return open(self.tmpfile.name, "rb")
+
+    def chunks(self):
+        """Yield the members from our tar followed by the overlay"""
+        with self.open_tar() as fle:
+            remaining = self.base_size
+            while remaining > 0:
+                chunk = fle.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    raise HarpoonError(
+                        "Context tar was smaller than expected",
+                        location=getattr(self.tmpfile, "name", "<memory>"),
+                    )
+                remaining -= len(chunk)
+                yield chunk
+        yield self.overlay_bytes()
+
+    def save(self, location):
+        """Save the context to this location"""
+        self.close()
+        with open(location, "wb") as fle:
+            for chunk in self.chunks():
+                fle.write(chunk)
+
     @contextmanager
     def clone_with_new_dockerfile(self, conf, docker_file):
-        """Clone this tarfile and add in another filename before closing the new tar and returning"""
-        log.info("Copying context to add a different dockerfile")
+        """
+        Return a copy of this wrapper with another dockerfile added to the overlay
+
+        The tar itself is shared rather than copied. The new dockerfile comes
+        after any existing one and so replaces it when docker unpacks the context.
+        """
         self.close()
-        with a_temp_file() as tmpfile:
-            old_t = os.stat(self.tmpfile.name).st_size > 0
-            if old_t:
-                shutil.copy(self.tmpfile.name, tmpfile.name)
+        clone = ContextWrapper(
+            self.t, self.tmpfile, overlay=self.overlay.copy(), base_size=self.base_size
+        )
+        conf.add_docker_file_to_tarfile(docker_file, clone.overlay)
+        yield clone
 
-            with tarfile.open(tmpfile.name, mode="a") as t:
-                conf.add_docker_file_to_tarfile(docker_file, t)
-                yield ContextWrapper(t, tmpfile)
+
+class DeferredTar(object):
+    """
+    Records what is added to it so the tar can be written later
+
+    This has the same ``add`` and ``addfile`` methods as a ``tarfile.TarFile``.
+    Anything given to ``addfile`` is read straight away. ``filter`` is applied
+    to every member like the ``filter`` option to ``tarfile.TarFile.add``.
+    """
+
+    def __init__(self, filter=None):
+        self.filter = filter
+        self.operations = []
+
+    def __bool__(self):
+        return bool(self.operations)
+
+    def copy(self):
+        """Return a new DeferredTar with the same operations"""
+        clone = DeferredTar(filter=self.filter)
+        clone.operations = list(self.operations)
+        return clone
+
+    def add(self, name, arcname=None):
+        self.operations.append(lambda t: t.add(name, arcname=arcname, filter=self.filter))
+
+    def addfile(self, tarinfo, fileobj=None):
+        if self.filter is not None:
+            tarinfo = self.filter(tarinfo)
+        data = None if fileobj is None else fileobj.read()
+        self.operations.append(
+            lambda t: t.addfile(tarinfo, None if data is None else BytesIO(data))
+        )
+
+    def defer(self, operation):
+        """Call ``operation(tar)`` when the tar is written"""
+        self.operations.append(operation)
+
+    def write_to(self, fileobj):
+        """Write the tar into this file object"""
+        t = tarfile.open(mode="w|", fileobj=fileobj)
+        for operation in self.operations:
+            operation(t)
+        t.close()
+
+
+class StreamingContext(object):
+    """
+    A context that is created as it's being uploaded
+
+    Unlike ``ContextWrapper`` this never writes the tar to disk.
+    """
+
+    def __init__(self, filter=None):
+        self.t = DeferredTar(filter=filter)
+        self.size = None
+
+    @property
+    def overlay(self):
+        """Anything added after make_context goes into the same deferred tar"""
+        return self.t
+
+    def close(self):
+        """Nothing to close until we are streamed"""
+
+    @property
+    def fileobj(self):
+        """What to give to docker as the context"""
+        return self.chunks()
+
+    def chunks(self):
+        """Yield the tar in chunks as it's created"""
+        self.size = 0
+        for chunk in iter_written(self.t.write_to):
+            self.size += len(chunk)
+            yield chunk
+        log.info("Streamed %s of context", humanize.naturalsize(self.size))
+
+    def save(self, location):
+        """Save the context to this location"""
+        with open(location, "wb") as fle:
+            for chunk in self.chunks():
+                fle.write(chunk)
 
 
 class ContextBuilder(object):
@@ -81,8 +340,39 @@ class ContextBuilder(object):
     Can take into account git to determine what to include and exclude.
     """
 
+    def __init__(self):
+        self.stats = {}
+
+        # What we found and how long it took, for the context_report action
+        self.timings = {}
+        self.pruned = []
+        self.last_scan = None
+        self.last_files = None
+
+    @contextmanager
+    def timed(self, phase):
+        """Add how long the code in this block takes to ``self.timings[phase]``"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0) + time.time() - start
+
     @contextmanager
-    def make_context(self, context, silent_build=False, extra_context=None):
+    def make_context(
+        self,
+        context,
+        silent_build=False,
+        extra_context=None,
+        cache=None,
+        stream=False,
+        scans=None,
+        deterministic=False,
+        fragments=None,
+        memory_limit=None,
+        sources=sb.NotSpecified,
+        files=None,
+    ):
         """
         Context manager for creating the context of the image
 
@@ -99,143 +389,316 @@ class ContextBuilder(object):
             or a dictionary representing what path to get from what docker image
 
             The second string represents where in the context this extra file should go
+
+        cache - ``harpoon.ship.context_cache.ContextCache``
+            If provided, we reuse the tar of our files from this cache if none
+            of those files have changed since it was stored
+
+        stream - boolean
+            If True, yield a ``StreamingContext`` that only reads the files and
+            creates the tar when it is uploaded. The cache is not used in this case.
+
+        scans - ``harpoon.ship.context_scans.ContextScans``
+            If provided, the files under parent_dir are found once for all the
+            contexts this is shared with
+
+        deterministic - boolean
+            If True, members are sorted and ``normalise_tarinfo`` is used so that
+            the same files always make the same tar
+
+        fragments - ``harpoon.ship.fragments.FragmentStore``
+            If provided, we make the tar from the fragments we have for files
+            that haven't changed since they were stored. The fragments are not
+            used for streamed contexts.
+
+        memory_limit - integer
+            If provided, a context we know will be smaller than this many bytes
+            is made in memory rather than in a temporary file. This is not used
+            with the cache or for streamed contexts.
+
+        sources - List of strings
+            The paths used by the ADD and COPY instructions in the Dockerfile,
+            or None if we couldn't tell. Used when ``context.prune`` isn't ``never``.
+
+        files - List of (filename, arcname)
+            The files from ``find_files_for_tar`` with this builder if we already
+            found them. We don't look for the files again if this is provided.
+        """
+        if files is None:
+            files = list(
+                self.find_files_for_tar(context, silent_build, scans=scans, sources=sources)
+            )
+        self.last_files = files
+        extra = [(content, arcname) for content, arcname in extra_context or [] if arcname != ""]
+
+        tar_filter = None
+        if deterministic:
+            tar_filter = normalise_tarinfo
+            files = sorted(files, key=lambda pair: pair[1])
+
+        if stream:
+            wrapper = StreamingContext(filter=tar_filter)
+            for thing, arcname in files:
+                wrapper.t.add(thing, arcname=arcname)
+            if extra:
+                wrapper.t.defer(
+                    partial(self.add_extra_context, extra, silent_build, filter=tar_filter)
+                )
+            yield wrapper
+            return
+
+        with self.context_file(files, extra, memory_limit, cache=cache) as tmpfile:
+            with self.timed("tar"):
+                restored = False
+                if cache is not None and files:
+                    key = cache.key_for(context, sources)
+                    manifest = manifest_for(files, self.stats)
+                    restored = cache.restore(key, manifest, tmpfile)
+                    if restored and not silent_build:
+                        log.info("Using cached context for %s files", len(files))
+
+                t = tarfile.open(mode="w", fileobj=tmpfile)
+                if not restored:
+                    used = []
+                    writer = TarWriter(t, filter=tar_filter)
+                    for thing, arcname in files:
+                        log.debug("Context: {0}".format(arcname))
+                        st = self.stats.get(thing) or os.lstat(thing)
+                        if fragments is None:
+                            writer.add(thing, arcname, st)
+                        else:
+                            used.append(fragments.add(writer, thing, arcname, st))
+
+                    if fragments is not None:
+                        fragments.evict(keep=used)
+
+                    if cache is not None and files:
+                        cache.store(key, manifest, tmpfile, t.offset)
+
+                if extra:
+                    self.add_extra_context(extra, silent_build, t, filter=tar_filter)
+
+            yield ContextWrapper(t, tmpfile, overlay=DeferredTar(filter=tar_filter))
+
+    @contextmanager
+    def context_file(self, files, extra, memory_limit=None, cache=None):
         """
+        Yield the file object to write the tar for this context into
+
+        If we know the tar will be smaller than ``memory_limit`` it is made in
+        memory, otherwise it is made in a temporary file. We only know how big
+        content from images and other contexts is once we have it, and the
+        cache needs a file on disk, so these always get a temporary file.
+        """
+        if memory_limit is not None and cache is None:
+            size = 0
+            for content, _ in extra:
+                if not isinstance(content, str):
+                    size = None
+                    break
+                size += tarfile.BLOCKSIZE + len(content.encode("utf-8"))
+
+            if size is not None:
+                for thing, _ in files:
+                    st = self.stats.get(thing) or os.lstat(thing)
+                    size += tarfile.BLOCKSIZE + st.st_size
+
+            if size is not None and size < memory_limit:
+                yield BytesIO()
+                return
+
         with a_temp_file() as tmpfile:
-            t = tarfile.open(mode="w", fileobj=tmpfile)
-            for thing, arcname in self.find_files_for_tar(context, silent_build):
+            yield tmpfile
+
+    def add_extra_context(self, extra, silent_build, t, filter=None):
+        """Add the content for these (content, arcname) pairs to the tar in order"""
+        deterministic = filter is not None
+        with self.resolved_extra_context(extra, silent_build, deterministic) as resolved:
+            for fle, arcname in resolved:
                 log.debug("Context: {0}".format(arcname))
-                t.add(thing, arcname=arcname)
+                tarinfo = self.tarinfo_for_content(t, fle, arcname)
+                if filter is not None:
+                    tarinfo = filter(tarinfo)
+                t.addfile(tarinfo, fle)
 
-            if extra_context:
-                extra = list(extra_context)
-                for content, arcname in extra:
-                    if arcname == "":
-                        continue
+    def tarinfo_for_content(self, t, fle, arcname):
+        """
+        Return a TarInfo for adding what is in this file object as arcname
 
-                    with self.the_context(content, silent_build=silent_build) as fle:
-                        log.debug("Context: {0}".format(arcname))
-                        t.add(fle.name, arcname=arcname)
+        These are the same as what ``t.add`` gave us when this content was in
+        temporary files, which is why the mode is 0600.
+        """
+        fle.seek(0, os.SEEK_END)
+        size = fle.tell()
+        fle.seek(0)
+
+        tarinfo = t.tarinfo(arcname)
+        tarinfo.size = size
+        tarinfo.mode = 0o600
+        tarinfo.mtime = int(time.time())
+        if hasattr(os, "getuid"):
+            tarinfo.uid = os.getuid()
+            tarinfo.gid = os.getgid()
+        return tarinfo
 
-            yield ContextWrapper(t, tmpfile)
+    @contextmanager
+    def resolved_extra_context(self, extra, silent_build, deterministic=False):
+        """
+        Yield [(fle, arcname), ...] for these (content, arcname) pairs
+
+        Getting content from images is mostly waiting for docker, so we get all
+        the content at the same time on a few threads. The files are yielded in
+        the same order as the pairs we were given.
+        """
+
+        def resolve(content):
+            manager = self.the_context(
+                content, silent_build=silent_build, deterministic=deterministic
+            )
+            return manager, manager.__enter__()
+
+        with ExitStack() as stack:
+            with ThreadPoolExecutor(max_workers=min(4, len(extra))) as executor:
+                futures = [executor.submit(resolve, content) for content, _ in extra]
+
+            error = None
+            resolved = []
+            for (_, arcname), future in zip(extra, futures):
+                try:
+                    manager, fle = future.result()
+                except Exception as err:
+                    error = error or err
+                else:
+                    stack.push(manager.__exit__)
+                    resolved.append((fle, arcname))
+
+            if error is not None:
+                raise error
+
+            yield resolved
 
     @contextmanager
-    def the_context(self, content, silent_build=False):
-        """Return either a file with the content written to it, or a whole new context tar"""
+    def the_context(self, content, silent_build=False, deterministic=False):
+        """Return either a file object with the content in it, or a whole new context tar"""
         if isinstance(content, str):
-            with a_temp_file() as fle:
-                fle.write(content.encode("utf-8"))
-                fle.seek(0)
-                yield fle
+            yield BytesIO(content.encode("utf-8"))
         elif "context" in content:
             with ContextBuilder().make_context(
-                content["context"], silent_build=silent_build
+                content["context"], silent_build=silent_build, deterministic=deterministic
             ) as wrapper:
                 wrapper.close()
                 yield wrapper.tmpfile
         elif "image" in content:
-            from harpoon.ship.runner import ContainerRunner, Runner
-
             with a_temp_file() as fle:
-                content["conf"].command = "yes"
-                with ContainerRunner(
-                    Runner(), content["conf"], content["images"], detach=True, delete_anyway=True
-                ):
-                    try:
-                        strm, stat = content["docker_api"].get_archive(
-                            content["conf"].container_id, content["path"]
-                        )
-                    except docker.errors.NotFound:
-                        raise BadOption(
-                            "Trying to get something from an image that don't exist!",
-                            path=content["path"],
-                            image=content["conf"].image_name,
-                        )
-                    else:
-                        log.debug(stat)
-
-                        fo = BytesIO(b"".join(strm))
-
-                        # In newer docker the archive is a gzipped archive
-                        # But in older docker, it's a normal tar
-                        for mode in ("r:gz", "r"):
-                            try:
-                                tf = tarfile.open(fileobj=fo, mode=mode)
-                                break
-                            except tarfile.ReadError:
-                                if mode == "r":
-                                    raise
-                                fo.seek(0)
-
-                        if tf.firstmember.isdir():
-                            tf2 = tarfile.TarFile(fileobj=fle, mode="w")
-                            name = tf.firstmember.name
-                            for member in tf.getmembers()[1:]:
-                                member.name = member.name[len(name) + 1 :]
-                                if member.issym():
-                                    with tempfile.NamedTemporaryFile() as symfle:
-                                        os.remove(symfle.name)
-                                        os.symlink(member.linkpath, symfle.name)
-                                        tf2.addfile(member, fileobj=symfle)
-                                elif not member.isdir():
-                                    tf2.addfile(member, fileobj=tf.extractfile(member.name))
-                            tf2.close()
-                        else:
-                            fle.write(tf.extractfile(tf.firstmember.name).read())
-
-                        tf.close()
-                        log.info(
-                            "Got '{0}' from {1} for context".format(
-                                content["path"], content["conf"].container_id
-                            )
-                        )
-
+                self.extract_from_image(content, fle)
                 fle.seek(0)
                 yield fle
 
-    def find_files_for_tar(self, context, silent_build):
+    def extract_from_image(self, content, fle):
+        """
+        Write what is at content["path"] in content["conf"] into fle
+
+        We get the archive from a container that is created but never started,
+        and remember what we got in ``harpoon.extraction_cache`` by the ID of
+        the image so we don't need to get it again.
+        """
+        conf = content["conf"]
+        path = content["path"]
+        docker_api = content["docker_api"]
+
+        image_name = conf.image_name
+        if conf.tag is not sb.NotSpecified:
+            image_name = conf.image_name_with_tag
+
+        try:
+            image_id = docker_api.inspect_image(image_name)["Id"]
+        except docker.errors.ImageNotFound:
+            raise BadOption("Couldn't find the image to get content from", image=image_name)
+
+        cache = conf.harpoon.extraction_cache
+        key = cache.key_for(image_id, path)
+        manifest = [image_id, path]
+        if cache.restore(key, manifest, fle):
+            log.info("Using cached '{0}' from {1} for context".format(path, image_name))
+            return
+
+        # The container only needs to exist to get files out of it
+        container_id = docker_api.create_container(image=image_name, command=["yes"])["Id"]
+        try:
+            try:
+                strm, stat = docker_api.get_archive(container_id, path)
+            except docker.errors.NotFound:
+                raise BadOption(
+                    "Trying to get something from an image that don't exist!",
+                    path=path,
+                    image=image_name,
+                )
+
+            log.debug(stat)
+            extract_archive(strm, fle)
+        finally:
+            docker_api.remove_container(container_id)
+
+        log.info("Got '{0}' from {1} for context".format(path, image_name))
+        cache.store(key, manifest, fle, fle.tell())
+
+    def changed_since_found(self, files):
+        """Return whether any of these ``[(filename, arcname), ...]`` changed after we found them"""
+        try:
+            return manifest_for(files, self.stats) != manifest_for(files)
+        except OSError:
+            return True
+
+    def find_files_for_tar(self, context, silent_build, scans=None, sources=sb.NotSpecified):
         """
         Return [(filename, arcname), ...] for all the files.
         """
         if not context.enabled:
             return
 
-        files = self.find_files(context, silent_build)
+        files = self.find_files(context, silent_build, scans=scans, sources=sources)
 
         for path in files:
             relname = os.path.relpath(path, context.parent_dir)
-            arcname = "./{0}".format(relname.encode("utf-8").decode("ascii", "ignore"))
+            arcname = "./{0}".format(relname)
             if os.path.exists(path):
                 yield path, arcname
 
-    def find_files(self, context, silent_build):
+    def find_files(self, context, silent_build, scans=None, sources=sb.NotSpecified):
         """
         Find the set of files from our parent_dir that we care about
+
+        If we have ``sources`` and ``context.prune`` isn't ``never`` then we
+        also leave out files the Dockerfile doesn't use.
         """
-        first_layer = ["'{0}'".format(thing) for thing in os.listdir(context.parent_dir)]
-        output, status = command_output(
-            "find {0} -type l -or -type f {1} -follow -print".format(
-                " ".join(first_layer), context.find_options
-            ),
-            cwd=context.parent_dir,
-        )
-        if status != 0:
-            if context.ignore_find_errors:
-                log.warning("The find command failed to run, will continue anyway")
-            else:
-                raise HarpoonError(
-                    "Couldn't find the files we care about", output=output, cwd=context.parent_dir
-                )
-        all_files = set(self.convert_nonascii(output))
-        total_files = set(all_files)
+        if scans is not None and scans.shared(context):
+            scan = scans.scan(context, partial(self.shared_scan, context, silent_build))
+            self.stats.update(scan.stats)
+        else:
+            scan = self.scan(
+                context, silent_build, self.pruner(context), context.exclude_matcher.matches
+            )
 
-        combined = set(all_files)
+        self.last_scan = scan
+
+        with self.timed("filter"):
+            return self.filter_files(context, silent_build, scan, sources=sources)
+
+    def filter_files(self, context, silent_build, scan, sources=sb.NotSpecified):
+        """
+        Return the sorted paths of the files in this scan that we want in the context
+
+        This applies gitignore, the .dockerignore, our exclude and include
+        globs and pruning to the files the Dockerfile uses.
+        """
+        total_files = set(scan.all_files)
+        combined = set(scan.all_files)
 
         if context.use_gitignore:
             if context.parent_dir == context.git_root:
-                all_files = set([path for path in all_files if not path.startswith(".git")])
+                combined = set([path for path in combined if not path.startswith(".git")])
 
-            combined = set(all_files)
-            valid_files = self.find_notignored_git_files(context, silent_build)
+            valid_files = scan.valid_files
 
             removed = set()
             if valid_files:
@@ -246,13 +709,16 @@ class ContextBuilder(object):
                 log.info("Ignoring %s/%s files", len(removed), len(combined))
             combined -= removed
 
+        dockerignore = context.dockerignore
+        if dockerignore:
+            ignored = set(filename for filename in combined if dockerignore.matches(filename))
+            if not silent_build:
+                log.info("Ignoring %s/%s items from .dockerignore", len(ignored), len(combined))
+            combined -= ignored
+
         if context.exclude:
-            excluded = set()
-            for filename in combined:
-                for excluder in context.exclude:
-                    if fnmatch.fnmatch(filename, excluder):
-                        excluded.add(filename)
-                        break
+            excluder = context.exclude_matcher
+            excluded = set(filename for filename in combined if excluder.matches(filename))
             if not silent_build:
                 log.info(
                     "Filtering %s/%s items\texcluding=%s",
@@ -263,21 +729,173 @@ class ContextBuilder(object):
             combined -= excluded
 
         if context.include:
-            extra_included = []
-            for filename in total_files:
-                for includer in context.include:
-                    if fnmatch.fnmatch(filename, includer):
-                        extra_included.append(filename)
-                        break
+            includer = context.include_matcher
+            extra_included = [filename for filename in total_files if includer.matches(filename)]
             if not silent_build:
                 log.info("Adding back %s items\tincluding=%s", len(extra_included), context.include)
             combined = set(list(combined) + extra_included)
 
+        if sources is not sb.NotSpecified and context.prune != "never":
+            combined = self.prune_to_sources(context, combined, sources, silent_build)
+
         files = sorted(os.path.join(context.parent_dir, filename) for filename in combined)
         if not silent_build:
             log.info("Adding %s things from %s to the context", len(files), context.parent_dir)
         return files
 
+    def prune_to_sources(self, context, files, sources, silent_build):
+        """
+        Return the files that are used by these ADD and COPY sources
+
+        When ``context.prune`` is ``report`` we only log how many files and
+        bytes would be left out and return all the files.
+        """
+        matcher = sources_matcher(sources)
+        if matcher is None:
+            if not silent_build:
+                log.info("Can't prune context since the Dockerfile may use all of it")
+            return files
+
+        unused = set(filename for filename in files if not matcher.matches(filename))
+        if context.prune == "report" or not silent_build:
+            size = 0
+            for filename in unused:
+                location = os.path.join(context.parent_dir, filename)
+                try:
+                    size += (self.stats.get(location) or os.lstat(location)).st_size
+                except OSError:
+                    pass
+
+            log.info(
+                "%s %s/%s files (%s) not used by the Dockerfile\tparent_dir=%s",
+                "Would prune" if context.prune == "report" else "Pruning",
+                len(unused),
+                len(files),
+                humanize.naturalsize(size),
+                context.parent_dir,
+            )
+
+        if context.prune == "report":
+            return files
+        return set(files) - unused
+
+    def scan(self, context, silent_build, prune=None, skip=None):
+        """
+        Return a ``harpoon.ship.context_scans.Scan`` of all the files under parent_dir
+
+        ``prune`` and ``skip`` are passed into ``walk_files`` and
+        ``find_notignored_git_files`` to avoid looking inside excluded folders.
+        """
+        with self.timed("find"):
+            if context.find_options:
+                all_files = self.find_files_with_find(context)
+            else:
+                all_files = self.walk_files(context, prune)
+
+        valid_files = None
+        if context.use_gitignore:
+            with self.timed("git"):
+                valid_files = self.find_notignored_git_files(context, silent_build, skip)
+
+        return Scan(all_files, valid_files, dict(self.stats))
+
+    def shared_scan(self, context, silent_build, contexts):
+        """
+        Scan for all these contexts at once
+
+        We only avoid the folders that every one of these contexts excludes.
+        """
+        pruners = [self.pruner(ctx) for ctx in contexts]
+        prune = None
+        if all(pruners):
+            prune = lambda relpath: all(pruner(relpath) for pruner in pruners)
+
+        excluders = [ctx.exclude_matcher for ctx in contexts]
+        skip = lambda filename: all(excluder.matches(filename) for excluder in excluders)
+
+        if not silent_build:
+            log.info("Finding files in %s for %s contexts", context.parent_dir, len(contexts))
+        return self.scan(context, silent_build, prune, skip)
+
+    def walk_files(self, context, prune=None):
+        """
+        Find all the files under parent_dir with a ``harpoon.ship.walker.Walker``
+
+        We record the lstat of each file in ``self.stats``
+        """
+        if prune is not None:
+            should_prune = prune
+
+            def prune(relpath):
+                if should_prune(relpath):
+                    self.pruned.append(relpath)
+                    return True
+                return False
+
+        found, errors = Walker(context.parent_dir, prune=prune).walk()
+        if errors:
+            if context.ignore_find_errors:
+                log.warning("Failed to look at some files, will continue anyway")
+            else:
+                raise HarpoonError(
+                    "Couldn't find the files we care about",
+                    errors=[str(error) for _, error in errors],
+                    cwd=context.parent_dir,
+                )
+
+        for relpath, st in found.items():
+            self.stats[os.path.join(context.parent_dir, relpath)] = st
+        return set(found)
+
+    def find_files_with_find(self, context):
+        """
+        Find all the files under parent_dir with the find command
+
+        We only do this when the context has find_options
+        """
+        first_layer = ["'{0}'".format(thing) for thing in os.listdir(context.parent_dir)]
+        output, status = command_output(
+            "find {0} -type l -or -type f {1} -follow -print".format(
+                " ".join(first_layer), context.find_options
+            ),
+            cwd=context.parent_dir,
+        )
+        if status != 0:
+            if context.ignore_find_errors:
+                log.warning("The find command failed to run, will continue anyway")
+            else:
+                raise HarpoonError(
+                    "Couldn't find the files we care about", output=output, cwd=context.parent_dir
+                )
+        return set(self.convert_nonascii(output))
+
+    def pruner(self, context):
+        """
+        Return a function that says whether we can skip a directory entirely
+
+        We only skip a directory if everything inside it would be excluded or
+        ignored by the .dockerignore and there are no include globs that could
+        add any of it back.
+        """
+        excluder = context.exclude_matcher
+        includer = context.include_matcher
+        dockerignore = context.dockerignore
+        prune_git = context.use_gitignore and context.parent_dir == context.git_root
+
+        if not excluder and not dockerignore and not prune_git:
+            return None
+
+        def prune(relpath):
+            if includer.may_match_under(relpath):
+                return False
+            if prune_git and relpath == ".git":
+                return True
+            if dockerignore and dockerignore.ignores_everything_under(relpath):
+                return True
+            return excluder.matches_everything_under(relpath)
+
+        return prune
+
     def convert_nonascii(self, lst):
         """Convert the strange outputs from git commands"""
         for item in lst:
@@ -287,74 +905,91 @@ class ContextBuilder(object):
             else:
                 yield item.encode("utf-8").decode("unicode-escape")
 
-    def find_notignored_git_files(self, context, silent_build):
+    def find_notignored_git_files(self, context, silent_build, skip=None):
         """
-        Return a list of files that are not ignored by git
+        Return a set of files that are not ignored by git
+
+        We find tracked and untracked files with one ``git ls-files`` and then
+        look inside symlinked folders and submodules at the same time, unless
+        ``skip(filename)`` says that folder is excluded.
         """
+        if skip is None:
+            skip = context.exclude_matcher.matches
 
         def git(args, error_message, cwd=context.parent_dir, **error_kwargs):
-            output, status = command_output("git {0}".format(args), cwd=cwd)
+            output, status = command_output(["git", *args], cwd=cwd, nul_separated=True)
             if status != 0:
                 error_kwargs["output"] = output
                 error_kwargs["directory"] = context.parent_dir
                 raise HarpoonError(error_message, **error_kwargs)
             return output
 
-        untracked_files = git(
-            "ls-files --others --exclude-standard", "Failed to find untracked files"
-        )
-
         valid = set()
-        under_source_control = git(
-            "ls-files --exclude-standard", "Failed to find all the files under source control"
-        )
-        git_submodules = [
-            regexes["whitespace"].split(line.strip())[1]
-            for line in git("submodule status", "Failed to find submodules", cwd=context.git_root)
-        ]
-        git_submodules = [
-            os.path.normpath(
-                os.path.relpath(
-                    os.path.abspath(p),
-                    os.path.abspath(os.path.relpath(context.parent_dir, context.git_root)),
-                )
+        submodules = set()
+        maybe_symlinks = []
+
+        for line in git(
+            ["ls-files", "-z", "--cached", "--others", "--exclude-standard", "--stage"],
+            "Failed to find the files git knows about",
+        ):
+            m = regexes["staged_file"].match(line)
+            if m:
+                mode, filename = m.groups()
+                if mode == "160000":
+                    submodules.add(filename)
+                elif mode == "120000":
+                    maybe_symlinks.append(filename)
+            else:
+                # Untracked files don't have any stage information
+                filename = line
+                maybe_symlinks.append(filename)
+            valid.add(filename)
+
+        def in_submodule(filename):
+            location = os.path.join(context.parent_dir, filename)
+            if not os.path.isdir(location):
+                return None
+
+            to_include = git(
+                ["ls-files", "-z"], "Failed to find files in a submodule", cwd=location
             )
-            for p in git_submodules
-        ]
+            return [os.path.join(filename, found) for found in to_include]
 
-        valid = under_source_control + untracked_files
+        def under_symlink(filename):
+            location = os.path.join(context.parent_dir, filename)
+            if not (os.path.islink(location) and os.path.isdir(location)):
+                return []
 
-        for filename in list(valid):
-            matched = False
-            if context.exclude:
-                for excluder in context.exclude:
-                    if fnmatch.fnmatch(filename, excluder):
-                        matched = True
-                        break
+            actual_path = os.path.abspath(os.path.realpath(location))
+            parent_dir = os.path.abspath(os.path.realpath(context.parent_dir))
+            include_from = os.path.relpath(actual_path, parent_dir)
 
-            if matched:
-                continue
+            to_include = git(
+                ["ls-files", "-z", "--exclude-standard", "--", include_from],
+                "Failed to find files under a symlink",
+            )
+            return [
+                os.path.join(filename, os.path.relpath(found, include_from)) for found in to_include
+            ]
 
-            location = os.path.join(context.parent_dir, filename)
-            if os.path.islink(location) and os.path.isdir(location):
-                actual_path = os.path.abspath(os.path.realpath(location))
-                parent_dir = os.path.abspath(os.path.realpath(context.parent_dir))
-                include_from = os.path.relpath(actual_path, parent_dir)
-
-                to_include = git(
-                    "ls-files --exclude-standard -- {0}".format(include_from),
-                    "Failed to find files under a symlink",
-                )
-                for found in to_include:
-                    valid += [os.path.join(filename, os.path.relpath(found, include_from))]
-            elif os.path.isdir(location) and filename in git_submodules:
-                to_include = git(
-                    "ls-files --exclude-standard",
-                    "Failed to find files in a submodule",
-                    cwd=location,
-                )
-                valid = [v for v in valid if v != filename]
-                for found in to_include:
-                    valid.append(os.path.join(filename, found))
+        expansions = [
+            (in_submodule, filename) for filename in sorted(submodules) if not skip(filename)
+        ]
+        expansions.extend(
+            (under_symlink, filename) for filename in maybe_symlinks if not skip(filename)
+        )
+
+        if expansions:
+            with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4)) as executor:
+                futures = [executor.submit(expand, filename) for expand, filename in expansions]
+                for (expand, filename), future in zip(expansions, futures):
+                    found = future.result()
+                    if found is None:
+                        continue
+
+                    # The folder of a submodule is replaced by the files inside it
+                    if expand is in_submodule:
+                        valid.discard(filename)
+                    valid.update(found)
 
-        return set(self.convert_nonascii(valid))
+        return valid
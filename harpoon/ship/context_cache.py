@@ -0,0 +1,198 @@
+"""
+A cache of context tars that lives between runs of harpoon.
+
+Each entry holds the tar of the files we found for a context along with a
+manifest of the stat information of those files. When the manifest of the files
+we find next time is the same, we reuse the tar rather than reading every file
+into a new tar.
+
+The same mechanism is used to remember what we got from a path in an image,
+which can't change for the same image ID.
+
+Entries are evicted least recently used first when the cache grows larger than
+it's maximum size.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from delfick_project.norms import sb
+
+log = logging.getLogger("harpoon.ship.context_cache")
+
+
+def manifest_for(files, stats=None):
+    """
+    Return ``[[arcname, size, mtime_ns, inode, mode], ...]`` for these ``(path, arcname)`` pairs
+
+    We use lstat because tarfile doesn't follow symlinks when it adds them.
+    ``stats`` is an optional dictionary of ``{path: lstat}`` we already know about.
+    """
+    manifest = []
+    for path, arcname in files:
+        st = stats.get(path) if stats else None
+        if st is None:
+            st = os.lstat(path)
+        manifest.append([arcname, st.st_size, st.st_mtime_ns, st.st_ino, st.st_mode])
+    return manifest
+
+
+class ContextCache(object):
+    """Knows how to store and restore the tar of the files in a context"""
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key_for(self, context, sources=sb.NotSpecified):
+        """
+        Return the key for this ``harpoon.option_spec.image_objs.Context``
+
+        ``sources`` are the paths the Dockerfile uses, which change what is in
+        the context when we're pruning.
+        """
+        if context.prune != "always" or sources is sb.NotSpecified:
+            sources = None
+        elif sources is not None:
+            sources = sorted(sources)
+
+        options = [
+            context.parent_dir,
+            context.include,
+            context.exclude,
+            context.use_gitignore,
+            context.find_options,
+            context.deterministic,
+            context.prune,
+            sources,
+            context.use_dockerignore,
+        ]
+        return hashlib.sha1(json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def locations(self, key):
+        """Return (tar_location, manifest_location) for this key"""
+        base = os.path.join(self.directory, key)
+        return "{0}.tar".format(base), "{0}.json".format(base)
+
+    def restore(self, key, manifest, fileobj):
+        """
+        Write the cached tar for this key into fileobj if the manifest is unchanged
+
+        Return whether we restored anything. The tar that is written doesn't have
+        an end of archive marker so it may be opened with ``tarfile.open(mode="w")``
+        to add more members.
+        """
+        tar_location, manifest_location = self.locations(key)
+
+        try:
+            with open(manifest_location) as fle:
+                recorded = json.load(fle)
+        except (OSError, ValueError):
+            return False
+
+        if recorded.get("manifest") != manifest:
+            return False
+
+        try:
+            with open(tar_location, "rb") as fle:
+                copied = copy_bytes(fle, fileobj)
+        except OSError as error:
+            log.warning("Failed to read cached context\tlocation=%s\terror=%s", tar_location, error)
+            copied = None
+
+        if copied != recorded.get("offset"):
+            fileobj.seek(0)
+            fileobj.truncate()
+            return False
+
+        # Mark this entry as recently used
+        os.utime(manifest_location)
+        return True
+
+    def store(self, key, manifest, fileobj, offset):
+        """Store the first ``offset`` bytes of the tar in fileobj for this key"""
+        tar_location, manifest_location = self.locations(key)
+        fileobj.flush()
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as tmp:
+                with open(fileobj.name, "rb") as fle:
+                    copy_bytes(fle, tmp, limit=offset)
+            os.replace(tmp.name, tar_location)
+
+            with tempfile.NamedTemporaryFile("w", dir=self.directory, delete=False) as tmp:
+                json.dump({"offset": offset, "manifest": manifest}, tmp)
+            os.replace(tmp.name, manifest_location)
+        except OSError as error:
+            log.warning("Failed to store context in the cache\tkey=%s\terror=%s", key, error)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until we are under max_size"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+
+        entries = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+
+            tar_location, manifest_location = self.locations(name[: -len(".json")])
+            try:
+                entries.append(
+                    (
+                        os.stat(manifest_location).st_mtime,
+                        os.stat(tar_location).st_size,
+                        tar_location,
+                        manifest_location,
+                    )
+                )
+            except OSError:
+                pass
+
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, tar_location, manifest_location in sorted(entries):
+            if total <= self.max_size:
+                break
+
+            log.info("Evicting context from the cache\tlocation=%s", tar_location)
+            for location in (manifest_location, tar_location):
+                try:
+                    os.remove(location)
+                except OSError:
+                    pass
+            total -= size
+
+
+class ExtractionCache(ContextCache):
+    """
+    Knows how to store and restore what we got from a path in an image
+
+    The manifest for an entry is ``[image_id, path]``.
+    """
+
+    def key_for(self, image_id, path):
+        """Return the key for this path in the image with this ID"""
+        return hashlib.sha1(json.dumps([image_id, path]).encode("utf-8")).hexdigest()
+
+
+def copy_bytes(src, dst, limit=None, chunk_size=1024 * 1024):
+    """Copy from src to dst, stopping after limit bytes if specified. Return how many were copied"""
+    copied = 0
+    while limit is None or copied < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - copied)
+        chunk = src.read(size)
+        if not chunk:
+            break
+        dst.write(chunk)
+        copied += len(chunk)
+    return copied
@@ -0,0 +1,126 @@
+"""
+Explaining what is in a context and where the time to make it went.
+
+This is used by the ``context_report`` action to find out why a context is
+bigger or slower to make than we expect, without having to pull apart the tar.
+"""
+
+import fnmatch
+import os
+
+import humanize
+
+from harpoon.ship.matcher import GlobMatcher
+
+PHASES = ["find", "git", "filter", "tar"]
+
+
+class ContextReport(object):
+    """
+    Report on a context made by this ``harpoon.ship.context.ContextBuilder``
+
+    context
+        The ``harpoon.option_spec.image_objs.Context`` that was made
+
+    builder
+        The ``ContextBuilder`` that made it
+
+    size
+        The size in bytes of the tar that would be sent to docker
+
+    top
+        How many of the largest files and folders to show
+    """
+
+    def __init__(self, context, builder, size, top=10):
+        self.top = top
+        self.size = size
+        self.context = context
+        self.builder = builder
+
+    @property
+    def sizes(self):
+        """Return ``{relative_path: size}`` for the files in the context"""
+        sizes = {}
+        for path, arcname in self.builder.last_files or []:
+            st = self.builder.stats.get(path) or os.lstat(path)
+            sizes[arcname[2:]] = st.st_size
+        return sizes
+
+    def largest_files(self):
+        """Return ``[(size, path), ...]`` for the biggest files"""
+        found = sorted(((size, path) for path, size in self.sizes.items()), reverse=True)
+        return found[: self.top]
+
+    def largest_folders(self):
+        """Return ``[(size, folder), ...]`` for the folders with the most in them"""
+        folders = {}
+        for path, size in self.sizes.items():
+            folder = os.path.dirname(path)
+            while folder:
+                folders[folder] = folders.get(folder, 0) + size
+                folder = os.path.dirname(folder)
+
+        found = sorted(((size, folder) for folder, size in folders.items()), reverse=True)
+        return found[: self.top]
+
+    def pattern_matches(self):
+        """
+        Return ``[(option, glob, files, folders), ...]`` for the include and exclude globs
+
+        ``files`` is how many of the files we found match the glob and
+        ``folders`` is how many folders we didn't look inside because of it.
+        """
+        scan = self.builder.last_scan
+        found = sorted(scan.all_files) if scan is not None else []
+
+        result = []
+        for option in ("exclude", "include"):
+            for glob in getattr(self.context, option) or []:
+                files = sum(1 for path in found if fnmatch.fnmatchcase(path, glob))
+                folders = 0
+                if option == "exclude":
+                    matcher = GlobMatcher([glob])
+                    folders = sum(
+                        1
+                        for folder in self.builder.pruned
+                        if matcher.matches_everything_under(folder)
+                    )
+                result.append((option, glob, files, folders))
+        return result
+
+    def lines(self):
+        """Yield the lines of the report"""
+        sizes = self.sizes
+        yield "Context from {0}".format(self.context.parent_dir)
+        yield "  files: {0}".format(len(sizes))
+        yield "  bytes in files: {0} ({1})".format(
+            sum(sizes.values()), humanize.naturalsize(sum(sizes.values()))
+        )
+        if self.size is not None:
+            yield "  bytes in tar: {0} ({1})".format(self.size, humanize.naturalsize(self.size))
+
+        yield ""
+        yield "Largest files:"
+        for size, path in self.largest_files():
+            yield "  {0:>10}  {1}".format(humanize.naturalsize(size), path)
+
+        yield ""
+        yield "Largest folders:"
+        for size, folder in self.largest_folders():
+            yield "  {0:>10}  {1}/".format(humanize.naturalsize(size), folder)
+
+        matches = self.pattern_matches()
+        if matches:
+            yield ""
+            yield "Patterns:"
+            for option, glob, files, folders in matches:
+                line = "  {0} {1}: {2} files".format(option, glob, files)
+                if folders:
+                    line = "{0}, {1} folders not looked in".format(line, folders)
+                yield line
+
+        yield ""
+        yield "Timings:"
+        for phase in PHASES:
+            yield "  {0:<7} {1:.3f}s".format(phase, self.builder.timings.get(phase, 0))
@@ -0,0 +1,78 @@
+"""
+Sharing the files found for contexts between images in the same run.
+
+Images often have the same ``parent_dir`` for their context and only differ in
+what they include and exclude. Rather than walk the same folder and ask git
+about it for every one of those images, ``ContextScans`` remembers what was
+found for each ``(parent_dir, use_gitignore, find_options)`` until harpoon exits.
+"""
+
+import threading
+from collections import namedtuple
+
+Scan = namedtuple("Scan", ["all_files", "valid_files", "stats"])
+
+
+class ContextScans(object):
+    """
+    Remembers the files found for contexts we've been told will be shared
+
+    Only contexts given to ``share`` use this, so that a single image can still
+    skip looking inside the folders it excludes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.scans = {}
+        self.sharing = {}
+
+    def key_for(self, context):
+        return (context.parent_dir, context.use_gitignore, context.find_options)
+
+    def share(self, contexts):
+        """Share the scan between any of these contexts that have the same key"""
+        grouped = {}
+        for context in contexts:
+            if context.enabled:
+                grouped.setdefault(self.key_for(context), []).append(context)
+
+        with self.lock:
+            for key, group in grouped.items():
+                if len(group) > 1 or key in self.sharing:
+                    self.sharing.setdefault(key, []).extend(group)
+
+    def shared(self, context):
+        """Return whether the scan for this context is shared with other contexts"""
+        return context.enabled and self.key_for(context) in self.sharing
+
+    def update(self, context, scan):
+        """
+        Use this scan for this context from now on
+
+        This is used when something else is keeping track of the files in the
+        context, like ``harpoon.ship.watcher.ContextWatcher``.
+        """
+        key = self.key_for(context)
+        with self.lock:
+            sharing = self.sharing.setdefault(key, [])
+            if context not in sharing:
+                sharing.append(context)
+            self.scans[key] = scan
+
+    def scan(self, context, make_scan):
+        """
+        Return the ``Scan`` for this context, making it if we haven't already
+
+        ``make_scan(contexts)`` is given all the contexts sharing this scan so
+        that it only skips folders that all of them would skip.
+        """
+        key = self.key_for(context)
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+            contexts = list(self.sharing[key])
+
+        with lock:
+            if key not in self.scans:
+                self.scans[key] = make_scan(contexts)
+            return self.scans[key]
@@ -0,0 +1,118 @@
+"""
+Understanding ``.dockerignore`` files.
+
+Each line of a ``.dockerignore`` is a pattern matched against paths relative to
+the root of the context. Unlike the ``fnmatch`` globs used by ``include`` and
+``exclude``, ``*`` and ``?`` don't match a ``/`` and ``**`` matches any number
+of folders. A pattern that matches a folder matches everything inside it, and
+patterns starting with ``!`` add back paths matched by earlier patterns. The
+last pattern that matches a path decides if it's ignored.
+
+The patterns are compiled once into a ``DockerIgnore`` so that the walker can
+ask it which folders it doesn't need to look inside.
+"""
+
+import os
+import re
+
+from harpoon.ship.matcher import literal_prefix
+
+
+def translate(pattern):
+    """Return a regex string for this .dockerignore pattern"""
+    result = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**/", index):
+            result.append("(?:.*/)?")
+            index += 3
+            continue
+        elif pattern.startswith("**", index):
+            result.append(".*")
+            index += 2
+            continue
+        elif char == "*":
+            result.append("[^/]*")
+        elif char == "?":
+            result.append("[^/]")
+        elif char == "[":
+            end = pattern.find("]", index + 1)
+            if end == -1:
+                result.append(re.escape(char))
+            else:
+                group = pattern[index + 1 : end]
+                if group.startswith("^") or group.startswith("!"):
+                    group = "^{0}".format(group[1:])
+                result.append("[{0}]".format(group.replace("\\", "\\\\")))
+                index = end
+        else:
+            result.append(re.escape(char))
+        index += 1
+    return "".join(result)
+
+
+class DockerIgnore(object):
+    """
+    Compiled version of the patterns from a ``.dockerignore``
+
+    ``matches(path)`` says whether a path relative to the context is ignored.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = []
+        for line in patterns:
+            pattern = line.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+
+            negated = pattern.startswith("!")
+            if negated:
+                pattern = pattern[1:].strip()
+
+            pattern = os.path.normpath(pattern).lstrip("/")
+            if pattern in ("", "."):
+                continue
+
+            self.patterns.append((pattern, negated, re.compile("{0}$".format(translate(pattern)))))
+
+        self.negated_prefixes = [
+            literal_prefix(pattern) for pattern, negated, _ in self.patterns if negated
+        ]
+
+    @classmethod
+    def from_file(kls, location):
+        """Return a DockerIgnore for the file at this location, or None if it doesn't exist"""
+        if not os.path.exists(location):
+            return None
+        with open(location) as fle:
+            return kls(fle.read().split("\n"))
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def matches(self, path):
+        """Return whether this path is ignored"""
+        parts = path.split("/")
+        parents = ["/".join(parts[: index + 1]) for index in range(len(parts))]
+
+        ignored = False
+        for _, negated, regex in self.patterns:
+            if ignored == negated and any(regex.match(parent) for parent in parents):
+                ignored = not negated
+        return ignored
+
+    def ignores_everything_under(self, directory):
+        """
+        Return whether every path inside this directory is ignored
+
+        We say no if there is a ``!`` pattern that could add back anything in it.
+        """
+        if not self.matches(directory):
+            return False
+
+        directory = "{0}/".format(directory)
+        for prefix in self.negated_prefixes:
+            if prefix.startswith(directory) or directory.startswith(prefix):
+                return False
+        return True
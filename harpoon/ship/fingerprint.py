@@ -0,0 +1,280 @@
+"""
+Working out a digest for the files in a context.
+
+The digest is a sha256 over the name, type, permissions and hash of every file
+in the context, so it changes whenever anything that would go into the context
+changes. Asking for it should be much cheaper than making the context.
+
+The hash of each file is kept in a sqlite database between runs of harpoon,
+keyed by the device, inode, size and modified time of the file, so we only
+read files that have changed. Files that git says are unchanged from the index
+use the object ID git already has for them. Any files left to hash are hashed
+in a pool of processes when there are enough of them to be worth it.
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import stat
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from harpoon.ship.context import command_output
+
+log = logging.getLogger("harpoon.ship.fingerprint")
+
+regexes = {
+    "staged_file": re.compile(r"^(\S) ([0-7]{6}) ([0-9a-f]+) [0-3]\t(.*)$", re.DOTALL),
+}
+
+
+def hash_file(path):
+    """Return the sha256 of the file at path, or of where it points if it's a symlink"""
+    digest = hashlib.sha256()
+    if os.path.islink(path):
+        digest.update(os.fsencode(os.readlink(path)))
+    else:
+        with open(path, "rb") as fle:
+            while True:
+                chunk = fle.read(1024 * 1024)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pool_context():
+    """
+    Return the multiprocessing context for the pool that hashes files
+
+    We may be hashing on one thread while other threads are making images, so
+    we don't fork, which would copy locks held by those threads into the child.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def hash_files(paths):
+    """Return [(path, sha256), ...] for these paths. This is what we give the process pool"""
+    return [(path, hash_file(path)) for path in paths]
+
+
+def git_object_ids(directory):
+    """
+    Return ``{relative_path: object_id}`` for files under directory that git has unchanged
+
+    Files that are modified or deleted in the working tree are left out, as are
+    submodules. Files marked assume-unchanged or skip-worktree are left out as
+    well because git doesn't tell us when those are modified. Return an empty
+    dictionary if directory isn't in a git repository.
+    """
+    staged, status = command_output(
+        ["git", "ls-files", "-z", "--stage", "-v"], cwd=directory, nul_separated=True
+    )
+    if status != 0:
+        return {}
+
+    modified, status = command_output(
+        ["git", "ls-files", "-z", "--modified"], cwd=directory, nul_separated=True
+    )
+    if status != 0:
+        return {}
+
+    found = {}
+    for line in staged:
+        m = regexes["staged_file"].match(line)
+        if m:
+            tag, mode, object_id, filename = m.groups()
+            # "H" is a normal cached file, assume-unchanged is lowercase and skip-worktree is "S"
+            if tag == "H" and mode != "160000":
+                found[filename] = object_id
+
+    for filename in modified:
+        found.pop(filename, None)
+    return found
+
+
+def kind_of(st, deterministic=False):
+    """
+    Return the part of the mode of a file that matters for the digest
+
+    That's the type of the file and its permissions, which ADD and COPY keep.
+    If ``deterministic`` then permissions are only whether the file is
+    executable, like ``harpoon.ship.context.normalise_tarinfo``.
+    """
+    mode = stat.S_IMODE(st.st_mode)
+    if stat.S_ISLNK(st.st_mode):
+        return "symlink"
+    elif stat.S_ISDIR(st.st_mode):
+        return "directory" if deterministic else "directory:{0:04o}".format(mode)
+    elif deterministic:
+        return "executable" if mode & 0o111 else "file"
+    return "file:{0:04o}".format(mode)
+
+
+class HashCache(object):
+    """
+    A sqlite database of the sha256 of files keyed by their dev, inode, size and mtime
+
+    Problems with the database are logged and treated as if it were empty.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self.lock = threading.Lock()
+        self._connection = None
+
+    def key_for(self, st):
+        return "{0}:{1}:{2}:{3}".format(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.location), exist_ok=True)
+            connection = sqlite3.connect(self.location, check_same_thread=False)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS hashes (key TEXT PRIMARY KEY, digest TEXT NOT NULL)"
+            )
+            self._connection = connection
+        return self._connection
+
+    def get_many(self, keys):
+        """Return ``{key: digest}`` for the keys we have a digest for"""
+        found = {}
+        keys = list(keys)
+        try:
+            with self.lock:
+                for start in range(0, len(keys), 500):
+                    batch = keys[start : start + 500]
+                    rows = self.connection.execute(
+                        "SELECT key, digest FROM hashes WHERE key IN ({0})".format(
+                            ",".join("?" for _ in batch)
+                        ),
+                        batch,
+                    )
+                    found.update(rows)
+        except (sqlite3.Error, OSError) as error:
+            log.warning(
+                "Failed to read the hash cache\tlocation=%s\terror=%s", self.location, error
+            )
+        return found
+
+    def put_many(self, digests):
+        """Remember these ``{key: digest}``"""
+        if not digests:
+            return
+        try:
+            with self.lock:
+                with self.connection:
+                    self.connection.executemany(
+                        "INSERT OR REPLACE INTO hashes (key, digest) VALUES (?, ?)",
+                        list(digests.items()),
+                    )
+        except (sqlite3.Error, OSError) as error:
+            log.warning(
+                "Failed to write to the hash cache\tlocation=%s\terror=%s", self.location, error
+            )
+
+
+class Fingerprinter(object):
+    """
+    Knows how to make a digest for a list of files
+
+    cache
+        An optional ``HashCache`` for the hashes of files between runs
+
+    workers
+        The number of processes used to hash files. Defaults to the number of cpus
+
+    min_files_for_pool
+        We only start processes to hash files if there are at least this many
+        files to hash that aren't in the cache or known by git
+    """
+
+    def __init__(self, cache=None, workers=None, min_files_for_pool=64):
+        self.cache = cache
+        self.workers = workers or os.cpu_count() or 1
+        self.min_files_for_pool = min_files_for_pool
+
+    def digest(self, files, stats=None, git_dir=None, deterministic=False):
+        """
+        Return a sha256 hex digest for these ``[(path, arcname), ...]``
+
+        ``stats`` is an optional dictionary of ``{path: lstat}`` for the files
+        we already have an lstat for. If ``git_dir`` is given then object IDs
+        from git are used for files under it that are unchanged from the index.
+        ``deterministic`` is whether the context normalises permissions.
+        """
+        hashes = self.hashes(files, stats=stats, git_dir=git_dir, deterministic=deterministic)
+
+        digest = hashlib.sha256()
+        for arcname, kind, file_hash in sorted(hashes.values()):
+            digest.update("{0}\0{1}\0{2}\n".format(arcname, kind, file_hash).encode("utf-8"))
+        return digest.hexdigest()
+
+    def hashes(self, files, stats=None, git_dir=None, deterministic=False):
+        """Return ``{path: (arcname, kind, hash)}`` for these ``[(path, arcname), ...]``"""
+        stats = stats or {}
+        object_ids = git_object_ids(git_dir) if git_dir is not None else {}
+
+        found = {}
+        keys = {}
+        for path, arcname in files:
+            st = stats.get(path) or os.lstat(path)
+            kind = kind_of(st, deterministic=deterministic)
+
+            if stat.S_ISDIR(st.st_mode):
+                found[path] = (arcname, kind, "")
+                continue
+
+            object_id = None
+            if object_ids:
+                object_id = object_ids.get(os.path.relpath(path, git_dir))
+
+            if object_id is not None:
+                found[path] = (arcname, kind, "git:{0}".format(object_id))
+            else:
+                found[path] = (arcname, kind, None)
+                keys[path] = self.cache.key_for(st) if self.cache is not None else None
+
+        cached = {}
+        if self.cache is not None and keys:
+            cached = self.cache.get_many(set(keys.values()))
+
+        missing = []
+        for path, key in keys.items():
+            if key in cached:
+                arcname, kind, _ = found[path]
+                found[path] = (arcname, kind, "sha256:{0}".format(cached[key]))
+            else:
+                missing.append(path)
+
+        new = {}
+        for path, file_hash in self.hash_files(missing):
+            arcname, kind, _ = found[path]
+            found[path] = (arcname, kind, "sha256:{0}".format(file_hash))
+            if self.cache is not None:
+                new[keys[path]] = file_hash
+
+        if self.cache is not None:
+            self.cache.put_many(new)
+
+        return found
+
+    def hash_files(self, paths):
+        """Return [(path, sha256), ...] for these paths, using processes if there are many"""
+        if len(paths) < self.min_files_for_pool or self.workers < 2:
+            return hash_files(paths)
+
+        chunk_size = max(16, len(paths) // (self.workers * 4))
+        chunks = [paths[i : i + chunk_size] for i in range(0, len(paths), chunk_size)]
+
+        result = []
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context()) as executor:
+            for hashed in executor.map(hash_files, chunks):
+                result.extend(hashed)
+        return result
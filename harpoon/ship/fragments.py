@@ -0,0 +1,153 @@
+"""
+A store of the members of context tars that lives between runs of harpoon.
+
+The bytes for a member of a tar are a header followed by the data of the file
+padded to a multiple of 512 bytes, and nothing in them depends on where in the
+tar the member is. So we can keep the bytes for each file we put in a context
+and make a new context by copying those fragments one after another.
+
+Fragments are keyed by the path, inode, size, mtime and mode of the file along
+with the name it has in the tar. When only a few files have changed since the
+last build, we only need to read those files.
+
+Fragments are copied with ``os.copy_file_range`` where the platform supports
+it, which lets the kernel copy the data without it going through python.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import tempfile
+
+from harpoon.ship.tar_writer import copy_file_into
+
+log = logging.getLogger("harpoon.ship.fragments")
+
+
+class FragmentStore(object):
+    """Knows how to keep and reuse the bytes for each member of a context tar"""
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.stored = False
+
+    def key_for(self, path, arcname, st, deterministic=False):
+        """Return the key for the file at path that will be at arcname"""
+        options = [
+            path,
+            arcname,
+            st.st_ino,
+            st.st_size,
+            st.st_mtime_ns,
+            st.st_mode,
+            st.st_uid,
+            st.st_gid,
+            deterministic,
+        ]
+        return hashlib.sha1(json.dumps(options).encode("utf-8")).hexdigest()
+
+    def location(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def add(self, writer, path, arcname, st):
+        """
+        Add the file at path to the tar of this ``harpoon.ship.tar_writer.TarWriter``
+
+        If we have a fragment for this file we copy it into the tar, otherwise
+        we render a fragment, keep it and then copy it into the tar.
+        Return the key that was used or None if we didn't use the store.
+        """
+        t = writer.t
+        tarinfo = writer.tarinfo_for(path, arcname, st)
+        if tarinfo is not None and writer.filter is not None:
+            tarinfo = writer.filter(tarinfo)
+
+        # Hard links depend on the other members in the tar and other types
+        # don't have enough in them to be worth storing
+        if tarinfo is None or not (tarinfo.isreg() or tarinfo.issym()):
+            t.add(path, arcname=arcname, filter=writer.filter)
+            return None
+
+        key = self.key_for(path, arcname, st, deterministic=writer.filter is not None)
+        location = self.location(key)
+
+        if not os.path.exists(location):
+            try:
+                self.store(location, tarinfo, path, t)
+            except OSError as error:
+                log.warning("Failed to store a fragment\tpath=%s\terror=%s", path, error)
+                writer.add(path, arcname, st)
+                return None
+
+        t.fileobj.seek(t.offset)
+        size = os.stat(location).st_size
+        copied = copy_file_into(location, t.fileobj, size)
+        if copied != size:
+            raise OSError("Fragment for {0} was only {1} of {2} bytes".format(path, copied, size))
+        t.offset += size
+        return key
+
+    def store(self, location, tarinfo, path, t):
+        """Write the header and padded data for this member into location"""
+        directory = os.path.dirname(location)
+        os.makedirs(directory, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as tmp:
+            try:
+                tmp.write(tarinfo.tobuf(t.format, t.encoding, t.errors))
+                if tarinfo.isreg():
+                    copied = copy_file_into(path, tmp, tarinfo.size)
+                    if copied != tarinfo.size:
+                        raise OSError("{0} changed while we were reading it".format(path))
+
+                    remainder = tarinfo.size % tarfile.BLOCKSIZE
+                    if remainder:
+                        tmp.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            except BaseException:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+
+        os.replace(tmp.name, location)
+        self.stored = True
+
+    def evict(self, keep=()):
+        """
+        Remove the oldest fragments until we are under max_size
+
+        Fragments with keys in ``keep`` are never removed. We only look at the
+        fragments if we've stored any since the last time we evicted.
+        """
+        if not self.stored:
+            return
+        self.stored = False
+
+        keep = set(keep)
+        entries = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                location = os.path.join(root, name)
+                try:
+                    st = os.stat(location)
+                except OSError:
+                    continue
+                total += st.st_size
+                if name not in keep:
+                    entries.append((st.st_mtime, st.st_size, location))
+
+        if total <= self.max_size:
+            return
+
+        log.info("Evicting fragments from the cache\tdirectory=%s", self.directory)
+        for _, size, location in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(location)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,88 @@
+"""
+Matching paths against many globs at once.
+
+The include and exclude options of a context are lists of ``fnmatch`` style
+globs that are matched against the path of each file relative to the
+``parent_dir`` of the context. Calling ``fnmatch.fnmatch`` for every file and
+every glob is slow for large contexts, so instead we compile the globs once.
+
+Globs are put into a trie keyed by the folders in their literal prefix and the
+globs at each node are compiled into one regex alternation. Matching a path
+then only looks at the nodes along that path, so a glob like
+``frontend/node_modules/**`` is never tried against files in ``backend/``.
+"""
+
+import fnmatch
+import re
+
+
+def literal_prefix(glob):
+    """Return the part of this glob before any wildcards"""
+    for index, char in enumerate(glob):
+        if char in "*?[":
+            return glob[:index]
+    return glob
+
+
+class GlobMatcher(object):
+    """
+    Compiled version of a list of globs
+
+    A path matches if ``fnmatch.fnmatchcase(path, glob)`` is True for any of the globs.
+    """
+
+    def __init__(self, globs):
+        self.globs = list(globs or [])
+        self.trie = {}
+
+        grouped = {}
+        for glob in self.globs:
+            folders = tuple(literal_prefix(glob).split("/")[:-1])
+            grouped.setdefault(folders, []).append(glob)
+
+        for folders, globs in grouped.items():
+            node = self.trie
+            for folder in folders:
+                node = node.setdefault("children", {}).setdefault(folder, {})
+            node["regex"] = re.compile("|".join(fnmatch.translate(glob) for glob in globs))
+
+        # Globs ending in a * match everything under a folder they match
+        self.everything_under = [
+            re.compile(fnmatch.translate(glob)) for glob in self.globs if glob.endswith("*")
+        ]
+        self.prefixes = [literal_prefix(glob) for glob in self.globs]
+
+    def __bool__(self):
+        return bool(self.globs)
+
+    def matches(self, path):
+        """Return whether this path matches any of our globs"""
+        node = self.trie
+        folders = path.split("/")
+        index = 0
+        while True:
+            regex = node.get("regex")
+            if regex is not None and regex.match(path):
+                return True
+
+            children = node.get("children")
+            if children is None or index >= len(folders) - 1:
+                return False
+
+            node = children.get(folders[index])
+            if node is None:
+                return False
+            index += 1
+
+    def matches_everything_under(self, directory):
+        """Return whether every path inside this directory would match"""
+        directory = "{0}/".format(directory)
+        return any(regex.match(directory) for regex in self.everything_under)
+
+    def may_match_under(self, directory):
+        """Return whether any path inside this directory could match"""
+        directory = "{0}/".format(directory)
+        for prefix in self.prefixes:
+            if prefix.startswith(directory) or directory.startswith(prefix):
+                return True
+        return False
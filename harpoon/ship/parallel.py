@@ -0,0 +1,203 @@
+"""
+Making many images at the same time.
+
+``make_in_parallel`` makes images on a pool of threads in the order given by a
+``harpoon.ship.scheduler.Scheduler``. An image is started as soon as the images
+it depends on are made and there is a free thread. Once one image fails we
+don't start any more and raise that error after the images already being made
+are finished.
+
+``pushing_in_background`` gives a ``BackgroundPusher`` that pushes images on
+their own pool of threads so that we can make the next image while the last
+one is pushed. Failed pushes are reported once all the pushes are finished.
+
+Output from docker goes through ``PrefixedOutput`` so every line says which
+image it came from.
+"""
+
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from harpoon import helpers as hp
+from harpoon.errors import FailedImage
+
+log = logging.getLogger("harpoon.ship.parallel")
+
+
+class PrefixedOutput(object):
+    """
+    Writes whole lines to output with the prefix for the thread that wrote them
+
+    Text written by a thread without a prefix is written straight away.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def prefixed(self, prefix):
+        """Prefix lines written by this thread in this block"""
+        self.local.prefix = prefix
+        self.local.buf = ""
+        try:
+            yield
+        finally:
+            if self.local.buf:
+                self.write("\n")
+            self.local.prefix = None
+
+    def write(self, txt):
+        if isinstance(txt, bytes):
+            txt = txt.decode("utf-8", "replace")
+
+        prefix = getattr(self.local, "prefix", None)
+        if prefix is None:
+            with self.lock:
+                hp.write_to(self.output, txt)
+            return
+
+        lines = (self.local.buf + txt).split("\n")
+        self.local.buf = lines.pop()
+        if lines:
+            with self.lock:
+                for line in lines:
+                    # Progress from docker rewrites the line with \r, we only want the last one
+                    line = line.rsplit("\r", 1)[-1]
+                    hp.write_to(self.output, "{0}{1}\n".format(prefix, line))
+
+    def flush(self):
+        with self.lock:
+            self.output.flush()
+
+
+def make_in_parallel(harpoon, scheduler, make, jobs):
+    """
+    Call ``make(image)`` for each image from this scheduler, ``jobs`` at a time
+
+    If ``make`` raises an exception, we don't start any more images and raise
+    it once the images already being made are done.
+
+    We don't offer to intervene in failed builds while other images are being
+    made, because the question would be lost in their output and more than one
+    thread could be waiting on stdin.
+    """
+    output = PrefixedOutput(harpoon.stdout)
+
+    def make_prefixed(image):
+        with output.prefixed("[{0}] ".format(image.name)):
+            make(image)
+
+    error = None
+    running = {}
+    original_stdout = harpoon.stdout
+    original_no_intervention = harpoon.no_intervention
+    harpoon.stdout = output
+    harpoon.no_intervention = True
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while True:
+                while error is None and len(running) < jobs:
+                    nxt = scheduler.next_ready()
+                    if nxt is None:
+                        break
+                    name, image = nxt
+                    running[executor.submit(make_prefixed, image)] = name
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        if error is None:
+                            error = future.exception()
+                    else:
+                        scheduler.finish(name)
+    finally:
+        harpoon.stdout = original_stdout
+        harpoon.no_intervention = original_no_intervention
+
+    if error is not None:
+        if not original_no_intervention:
+            log.info("Not offering to intervene in failed builds when making images in parallel")
+        raise error
+
+
+class BackgroundPusher(object):
+    """
+    Pushes images on a pool of ``workers`` threads
+
+    ``push(image)`` waits before handing over another image if there are
+    already ``max_pending`` images waiting to be pushed or being pushed, so
+    we don't get too far ahead of the registry.
+    """
+
+    def __init__(self, output, push, workers=1, max_pending=None):
+        self.output = output
+        self.push_image = push
+        self.lock = threading.Lock()
+        self.pushes = []
+        self.pending = threading.BoundedSemaphore(max_pending or workers * 2)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def push(self, image):
+        """Push this image on another thread"""
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(self.push_prefixed, image)
+        except BaseException:
+            self.pending.release()
+            raise
+        future.add_done_callback(lambda _: self.pending.release())
+
+        with self.lock:
+            self.pushes.append((image.name, future))
+
+    def push_prefixed(self, image):
+        with self.output.prefixed("[push {0}] ".format(image.name)):
+            self.push_image(image)
+
+    def join(self):
+        """Wait for all the pushes and return ``{name: error}`` for those that failed"""
+        self.executor.shutdown(wait=True)
+
+        failures = {}
+        for name, future in self.pushes:
+            error = future.exception()
+            if error is not None:
+                log.error("Failed to push an image\timage=%s\terror=%s", name, error)
+                failures[name] = error
+        return failures
+
+
+@contextmanager
+def pushing_in_background(harpoon, push, workers=1, max_pending=None):
+    """
+    Yield a ``BackgroundPusher`` and wait for its pushes when we're done
+
+    If any of the pushes failed then we raise a ``FailedImage`` once they are
+    all finished, unless something else went wrong first.
+    """
+    output = PrefixedOutput(harpoon.stdout)
+    original_stdout = harpoon.stdout
+    harpoon.stdout = output
+    pusher = BackgroundPusher(output, push, workers=workers, max_pending=max_pending)
+    try:
+        try:
+            yield pusher
+        finally:
+            failures = pusher.join()
+    finally:
+        harpoon.stdout = original_stdout
+
+    if failures:
+        raise FailedImage(
+            "Failed to push images",
+            images=sorted(failures),
+            errors=dict((name, str(error)) for name, error in failures.items()),
+        )
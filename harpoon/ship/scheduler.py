@@ -0,0 +1,209 @@
+"""
+Deciding what order to make images in.
+
+``Scheduler`` knows which of the images being made depend on each other. An
+image is ready as soon as everything it depends on is done, rather than when
+everything in the layer before it is done. Of the images that are ready, the
+one with the longest path of work left after it starts first, so the images
+holding up the most other images aren't left until last.
+
+How long each image takes is remembered between runs of harpoon by
+``BuildTimes``. Images we haven't timed before are guessed to take as long as
+the average of the images we have.
+"""
+
+import heapq
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from harpoon.errors import HarpoonError
+from harpoon.ship.parallel import make_in_parallel
+
+log = logging.getLogger("harpoon.ship.scheduler")
+
+
+class BuildTimes(object):
+    """
+    A json file of how many seconds each image took the last few times
+
+    Durations are kept per kind of work, i.e. "make" or "pull", as a moving
+    average so that one slow build doesn't change the order too much.
+    """
+
+    def __init__(self, location, weight=0.5):
+        self.lock = threading.Lock()
+        self.weight = weight
+        self.location = location
+        self._times = None
+
+    @property
+    def times(self):
+        if self._times is None:
+            try:
+                with open(self.location) as fle:
+                    self._times = json.load(fle)
+            except (OSError, ValueError):
+                self._times = {}
+        return self._times
+
+    def durations(self, kind):
+        """Return ``{image_name: seconds}`` for this kind of work"""
+        with self.lock:
+            return dict(self.times.get(kind, {}))
+
+    def record(self, kind, name, seconds):
+        """Remember that this image took this many seconds"""
+        with self.lock:
+            durations = self.times.setdefault(kind, {})
+            if name in durations:
+                seconds = durations[name] * (1 - self.weight) + seconds * self.weight
+            durations[name] = seconds
+
+    @contextmanager
+    def timed(self, kind, name):
+        """
+        Record how long this block takes if it doesn't raise an exception
+
+        We yield a dictionary and don't record anything if the block sets
+        ``skipped`` in it, so that images we didn't need to build don't make
+        the next real build look cheap.
+        """
+        start = time.time()
+        info = {"skipped": False}
+        yield info
+        if not info["skipped"]:
+            self.record(kind, name, time.time() - start)
+
+    def save(self):
+        """Write what we know to our location"""
+        with self.lock:
+            if self._times is None:
+                return
+
+            directory = os.path.dirname(self.location)
+            try:
+                os.makedirs(directory, exist_ok=True)
+                with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as tmp:
+                    json.dump(self._times, tmp, sort_keys=True)
+                os.replace(tmp.name, self.location)
+            except OSError as error:
+                log.warning(
+                    "Failed to save build times\tlocation=%s\terror=%s", self.location, error
+                )
+
+
+class Scheduler(object):
+    """
+    Hands out images once everything they depend on is done
+
+    images
+        ``{name: image}`` of the images to make
+
+    all_images
+        ``{name: image}`` of every image, used to find dependencies. Only
+        dependencies in ``images`` are waited for.
+
+    durations
+        ``{name: seconds}`` of how long each image took last time
+    """
+
+    def __init__(self, images, all_images=None, durations=None):
+        self.images = images
+        durations = durations or {}
+
+        known = [durations[name] for name in images if name in durations]
+        default = sum(known) / len(known) if known else 1.0
+        self.durations = dict((name, durations.get(name, default)) for name in images)
+
+        self.deps = {}
+        self.dependents = dict((name, set()) for name in images)
+        for name, image in images.items():
+            deps = set(image.dependencies(all_images or images)) & set(images)
+            deps.discard(name)
+            self.deps[name] = deps
+            for dep in deps:
+                self.dependents[dep].add(name)
+
+        self.priorities = self.find_priorities()
+        self.waiting = dict((name, len(deps)) for name, deps in self.deps.items())
+        self.ready = []
+        for name, count in self.waiting.items():
+            if count == 0:
+                self.push(name)
+        self.finished = set()
+
+    def find_priorities(self):
+        """Return ``{name: seconds}`` of the longest path of work starting at each image"""
+        priorities = {}
+
+        def priority(name, chain):
+            if name in priorities:
+                return priorities[name]
+            if name in chain:
+                # chain follows dependents, so reverse it to show what depends on what
+                cycle = chain[chain.index(name) :] + [name]
+                raise HarpoonError("Found a cycle in the dependencies", chain=cycle[::-1])
+
+            after = [priority(dependent, chain + [name]) for dependent in self.dependents[name]]
+            priorities[name] = self.durations[name] + max(after, default=0)
+            return priorities[name]
+
+        for name in sorted(self.images):
+            priority(name, [])
+        return priorities
+
+    def push(self, name):
+        heapq.heappush(self.ready, (-self.priorities[name], name))
+
+    @property
+    def done(self):
+        """Whether every image has been handed out and finished"""
+        return len(self.finished) == len(self.images)
+
+    def next_ready(self):
+        """Return ``(name, image)`` for the ready image with the most work after it or None"""
+        if not self.ready:
+            return None
+        _, name = heapq.heappop(self.ready)
+        return name, self.images[name]
+
+    def finish(self, name):
+        """Say this image is done and make ready the images that were waiting for it"""
+        self.finished.add(name)
+        for dependent in sorted(self.dependents[name]):
+            self.waiting[dependent] -= 1
+            if self.waiting[dependent] == 0:
+                self.push(dependent)
+
+    def in_order(self):
+        """Yield every image one at a time in the order they would be handed out"""
+        while True:
+            nxt = self.next_ready()
+            if nxt is None:
+                return
+            name, image = nxt
+            yield image
+            self.finish(name)
+
+
+def in_dependency_order(harpoon, kind, chosen, images, action):
+    """
+    Call action with each chosen image once the chosen images it depends on are done
+
+    Images with the longest chain of work after them according to how long
+    they took last time go first.
+    """
+    scheduler = Scheduler(chosen, images, harpoon.build_times.durations(kind))
+    try:
+        if harpoon.jobs > 1:
+            make_in_parallel(harpoon, scheduler, action, harpoon.jobs)
+        else:
+            for image in scheduler.in_order():
+                action(image)
+    finally:
+        harpoon.build_times.save()
@@ -0,0 +1,121 @@
+"""
+Helpers for working with data as it's created rather than all at once.
+
+This is used so that we can create the tar for a context while it's being
+uploaded to docker rather than writing the whole tar to disk first, and so we
+can read archives from docker without holding the whole archive in memory.
+"""
+
+import queue
+import threading
+
+
+class StreamCancelled(Exception):
+    """Raised in the writing thread when nothing is reading anymore"""
+
+
+class Failed(object):
+    """Holds an error from the writing thread"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class QueueWriter(object):
+    """File like object that puts what is written onto a queue in chunks"""
+
+    def __init__(self, queue, chunk_size, cancelled):
+        self.queue = queue
+        self.cancelled = cancelled
+        self.chunk_size = chunk_size
+        self.buf = bytearray()
+
+    def write(self, data):
+        if self.cancelled.is_set():
+            raise StreamCancelled()
+
+        self.buf += data
+        if len(self.buf) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buf:
+            self.put(bytes(self.buf))
+            self.buf.clear()
+
+    def put(self, item):
+        """Put this item on the queue, giving up if we get cancelled"""
+        while True:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self.cancelled.is_set():
+                    raise StreamCancelled()
+
+
+class ChunkReader(object):
+    """File like object for reading from an iterable of bytes"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buf) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buf += chunk
+
+        if size < 0:
+            size = len(self.buf)
+
+        # Deleting from the front of a bytearray doesn't copy what is left
+        result = bytes(self.buf[:size])
+        del self.buf[:size]
+        return result
+
+
+def iter_written(write, chunk_size=1024 * 1024, max_chunks=8):
+    """
+    Call ``write(fileobj)`` in a thread and yield what it writes as it writes it
+
+    At most ``max_chunks`` chunks of ``chunk_size`` bytes are held in memory
+    before ``write`` has to wait for them to be consumed. Any exception from
+    ``write`` is raised from this generator.
+    """
+    q = queue.Queue(maxsize=max_chunks)
+    cancelled = threading.Event()
+    writer = QueueWriter(q, chunk_size, cancelled)
+    done = object()
+
+    def produce():
+        try:
+            try:
+                write(writer)
+                writer.flush()
+            except StreamCancelled:
+                return
+            except BaseException as error:
+                writer.put(Failed(error))
+            else:
+                writer.put(done)
+        except StreamCancelled:
+            pass
+
+    thread = threading.Thread(target=produce, name="harpoon-stream-writer", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                break
+            if isinstance(item, Failed):
+                raise item.error
+            yield item
+    finally:
+        cancelled.set()
+        thread.join()
@@ -0,0 +1,184 @@
+"""
+A faster way of adding files to a tar than ``tarfile.TarFile.add``.
+
+For every file ``tarfile`` will lstat the file again, look up the names of its
+owner and group and copy the data through python buffers. We already have the
+lstat from walking the context, so ``TarWriter`` uses that, remembers owner
+names and copies the data with ``os.copy_file_range`` where it can.
+
+Like ``tarfile``, a file that is hard linked to a file we've already added is
+added as a link to that member so its data is only in the tar once.
+"""
+
+import io
+import os
+import stat
+import tarfile
+
+from harpoon.ship.context_cache import copy_bytes
+
+try:
+    import grp
+    import pwd
+except ImportError:
+    grp = pwd = None
+
+
+def copy_file_into(location, dst, count, offset=0):
+    """
+    Copy ``count`` bytes from ``offset`` in the file at ``location`` into ``dst``
+
+    We copy into the current position of ``dst`` and leave it positioned after
+    what we copied. Return how many bytes were copied.
+    """
+    dst.flush()
+    position = dst.tell()
+    copied = 0
+
+    try:
+        dst_fd = dst.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        dst_fd = None
+
+    with open(location, "rb") as src:
+        if dst_fd is not None and hasattr(os, "copy_file_range"):
+            try:
+                while copied < count:
+                    done = os.copy_file_range(
+                        src.fileno(),
+                        dst_fd,
+                        count - copied,
+                        offset + copied,
+                        position + copied,
+                    )
+                    if done == 0:
+                        break
+                    copied += done
+            except OSError:
+                # Not every filesystem supports this, so fallback to copying ourselves
+                pass
+
+        dst.seek(position + copied)
+        if copied < count:
+            src.seek(offset + copied)
+            copied += copy_bytes(src, dst, limit=count - copied)
+
+    return copied
+
+
+class TarWriter(object):
+    """Adds files to a ``tarfile.TarFile`` that was opened for writing"""
+
+    def __init__(self, t, filter=None):
+        self.t = t
+        self.filter = filter
+        self.unames = {}
+        self.gnames = {}
+
+    def tarinfo_for(self, path, arcname, st):
+        """
+        Return a TarInfo for the file at path from this lstat
+
+        This is the same as ``tarfile.TarFile.gettarinfo`` without the lstat.
+        Return None for types of files that can't go in a tar.
+        """
+        tarinfo = self.t.tarinfo()
+        tarinfo.tarfile = self.t
+
+        linkname = ""
+        mode = st.st_mode
+        if stat.S_ISREG(mode):
+            inode = (st.st_ino, st.st_dev)
+            inodes = self.t.inodes
+            if st.st_nlink > 1 and inode in inodes and arcname != inodes[inode]:
+                kind = tarfile.LNKTYPE
+                linkname = inodes[inode]
+            else:
+                kind = tarfile.REGTYPE
+                if inode[0]:
+                    inodes[inode] = arcname
+        elif stat.S_ISDIR(mode):
+            kind = tarfile.DIRTYPE
+        elif stat.S_ISFIFO(mode):
+            kind = tarfile.FIFOTYPE
+        elif stat.S_ISLNK(mode):
+            kind = tarfile.SYMTYPE
+            linkname = os.readlink(path)
+        elif stat.S_ISCHR(mode):
+            kind = tarfile.CHRTYPE
+        elif stat.S_ISBLK(mode):
+            kind = tarfile.BLKTYPE
+        else:
+            return None
+
+        tarinfo.name = arcname
+        tarinfo.mode = stat.S_IMODE(mode)
+        tarinfo.uid = st.st_uid
+        tarinfo.gid = st.st_gid
+        tarinfo.size = st.st_size if kind == tarfile.REGTYPE else 0
+        tarinfo.mtime = st.st_mtime
+        tarinfo.type = kind
+        tarinfo.linkname = linkname
+        tarinfo.uname = self.uname(st.st_uid)
+        tarinfo.gname = self.gname(st.st_gid)
+
+        if kind in (tarfile.CHRTYPE, tarfile.BLKTYPE):
+            tarinfo.devmajor = os.major(st.st_rdev)
+            tarinfo.devminor = os.minor(st.st_rdev)
+
+        return tarinfo
+
+    def uname(self, uid):
+        if uid not in self.unames:
+            self.unames[uid] = ""
+            if pwd is not None:
+                try:
+                    self.unames[uid] = pwd.getpwuid(uid)[0]
+                except KeyError:
+                    pass
+        return self.unames[uid]
+
+    def gname(self, gid):
+        if gid not in self.gnames:
+            self.gnames[gid] = ""
+            if grp is not None:
+                try:
+                    self.gnames[gid] = grp.getgrgid(gid)[0]
+                except KeyError:
+                    pass
+        return self.gnames[gid]
+
+    def add(self, path, arcname, st=None):
+        """Add the file at path to the tar as arcname, using this lstat if we have it"""
+        t = self.t
+        if st is None:
+            st = os.lstat(path)
+
+        tarinfo = self.tarinfo_for(path, arcname, st)
+
+        # Folders need their contents added as well, which tarfile already does
+        if tarinfo is None or tarinfo.isdir():
+            t.add(path, arcname=arcname, filter=self.filter)
+            return
+
+        if self.filter is not None:
+            tarinfo = self.filter(tarinfo)
+            if tarinfo is None:
+                return
+
+        buf = tarinfo.tobuf(t.format, t.encoding, t.errors)
+        t.fileobj.write(buf)
+        t.offset += len(buf)
+
+        if tarinfo.isreg():
+            copied = copy_file_into(path, t.fileobj, tarinfo.size)
+            if copied != tarinfo.size:
+                raise tarfile.ReadError("unexpected end of data")
+
+            blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+            if remainder > 0:
+                t.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+                blocks += 1
+            t.offset += blocks * tarfile.BLOCKSIZE
+
+        t.members.append(tarinfo)
@@ -0,0 +1,123 @@
+"""
+Find the files that make up a context without shelling out to ``find``.
+
+The walker behaves like ``find <entries> -type l -or -type f -follow`` in that
+it yields regular files and symlinks and follows symlinks to directories. It
+also remembers the ``lstat`` of everything it finds so that we don't need to
+stat those files again when we add them to the context.
+
+Each top level directory is walked in it's own thread.
+"""
+
+import logging
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("harpoon.ship.walker")
+
+
+class Walker(object):
+    """
+    Walk everything under parent_dir
+
+    prune
+        Optional callable that takes in the path of a directory relative to
+        parent_dir and says whether we should not look inside that directory.
+
+    workers
+        The number of threads to use for walking the top level directories.
+    """
+
+    def __init__(self, parent_dir, prune=None, workers=None):
+        self.prune = prune
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.parent_dir = parent_dir
+
+    def walk(self):
+        """
+        Return ``(found, errors)``
+
+        Where found is a dictionary of ``{relative_path: lstat}`` for every file
+        and symlink we found and errors is a list of ``(path, error)`` for
+        anything we couldn't look at.
+        """
+        found = {}
+        errors = []
+
+        try:
+            root = os.stat(self.parent_dir)
+        except OSError as error:
+            return found, [(self.parent_dir, error)]
+
+        ancestors = frozenset([(root.st_dev, root.st_ino)])
+
+        directories = []
+        self.visit_children("", self.parent_dir, ancestors, found, errors, directories)
+
+        if directories:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [
+                    executor.submit(self.walk_directory, relpath, path, ancestors)
+                    for relpath, path, ancestors in directories
+                ]
+                for future in futures:
+                    f, e = future.result()
+                    found.update(f)
+                    errors.extend(e)
+
+        return found, errors
+
+    def walk_directory(self, relpath, path, ancestors):
+        """Return ``(found, errors)`` for everything under this directory"""
+        found = {}
+        errors = []
+        pending = [(relpath, path, ancestors)]
+        while pending:
+            self.visit_children(*pending.pop(), found, errors, pending)
+        return found, errors
+
+    def visit_children(self, relpath, path, ancestors, found, errors, directories):
+        """
+        Record the files directly inside this directory
+
+        Directories we should look inside are appended to ``directories`` as
+        ``(relpath, path, ancestors)``
+        """
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError as error:
+            errors.append((path, error))
+            return
+
+        for entry in entries:
+            child = entry.name if not relpath else "{0}/{1}".format(relpath, entry.name)
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError as error:
+                errors.append((entry.path, error))
+                continue
+
+            target = st
+            if stat.S_ISLNK(st.st_mode):
+                try:
+                    target = os.stat(entry.path)
+                except OSError:
+                    # Broken symlinks are still found by find
+                    found[child] = st
+                    continue
+
+            if stat.S_ISDIR(target.st_mode):
+                if self.prune is not None and self.prune(child):
+                    log.debug("Pruning %s", child)
+                    continue
+
+                identity = (target.st_dev, target.st_ino)
+                if identity in ancestors:
+                    log.warning("Ignoring file system loop\tpath=%s", entry.path)
+                    continue
+
+                directories.append((child, entry.path, ancestors | {identity}))
+            elif stat.S_ISREG(target.st_mode):
+                found[child] = st
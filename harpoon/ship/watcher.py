@@ -0,0 +1,231 @@
+"""
+Watching the files in a context for changes.
+
+``ContextWatcher`` keeps the ``lstat`` of every file in a context up to date as
+files change, so that rebuilding an image doesn't need to walk the context
+again. Changes are found with inotify when ``inotify_simple`` is installed and
+otherwise by looking at the lstat of every file every ``interval`` seconds.
+
+Changes are debounced so that saving many files at once only causes one rebuild.
+"""
+
+import logging
+import os
+import stat
+import time
+
+from harpoon.ship.context import ContextBuilder
+from harpoon.ship.context_scans import Scan
+from harpoon.ship.walker import Walker
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = flags = None
+
+log = logging.getLogger("harpoon.ship.watcher")
+
+
+def signature(st):
+    """The parts of an lstat that say whether a file has changed"""
+    return (st.st_mode, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def changed_between(before, after):
+    """Return the paths that are different between these two ``{path: lstat}``"""
+    changed = set(before) ^ set(after)
+    for path in set(before) & set(after):
+        if signature(before[path]) != signature(after[path]):
+            changed.add(path)
+    return changed
+
+
+class ContextWatcher(object):
+    """
+    Keeps ``found``, a dictionary of ``{relative_path: lstat}``, up to date for a context
+
+    context
+        The ``harpoon.option_spec.image_objs.Context`` to watch. Folders that
+        the context would prune are not watched.
+
+    builder
+        The ``harpoon.ship.context.ContextBuilder`` used to prune folders and
+        ask git what it ignores.
+
+    interval
+        How many seconds to wait for changes at a time.
+
+    use_inotify
+        Whether to use inotify if ``inotify_simple`` is installed.
+    """
+
+    def __init__(self, context, builder=None, interval=0.5, use_inotify=True):
+        self.context = context
+        self.interval = interval
+        self.builder = builder or ContextBuilder()
+        self.prune = self.builder.pruner(context)
+
+        self.found = {}
+        self.watches = {}
+        self.inotify = None
+        if use_inotify and INotify is not None:
+            self.inotify = INotify()
+
+    @property
+    def mask(self):
+        return (
+            flags.CREATE
+            | flags.DELETE
+            | flags.MODIFY
+            | flags.ATTRIB
+            | flags.CLOSE_WRITE
+            | flags.MOVED_FROM
+            | flags.MOVED_TO
+        )
+
+    def start(self):
+        """Find all the files in the context and start watching them"""
+        if self.inotify is not None:
+            # Watch before walking so we don't miss changes made while we walk
+            self.add_watches()
+        self.found = self.walk()
+
+    def scan(self, silent_build=True):
+        """Return a ``harpoon.ship.context_scans.Scan`` of what we know about"""
+        valid_files = None
+        if self.context.use_gitignore:
+            valid_files = self.builder.find_notignored_git_files(self.context, silent_build)
+
+        parent_dir = self.context.parent_dir
+        stats = dict((os.path.join(parent_dir, path), st) for path, st in self.found.items())
+        return Scan(set(self.found), valid_files, stats)
+
+    def watch(self, on_change, debounce=1.0, until=None):
+        """
+        Call ``on_change(changed)`` after files change and then stop changing for ``debounce`` seconds
+
+        ``changed`` is the set of relative paths that changed. We keep watching
+        until ``until()`` returns True, or forever if ``until`` isn't given.
+        """
+        while until is None or not until():
+            changed = self.changes(self.interval)
+            if not changed:
+                continue
+
+            while True:
+                more = self.changes(debounce)
+                if not more:
+                    break
+                changed |= more
+
+            on_change(changed)
+
+    def changes(self, timeout):
+        """Wait up to timeout seconds and return the paths that changed"""
+        if self.inotify is not None:
+            return self.read_inotify(timeout)
+
+        time.sleep(timeout)
+        found = self.walk()
+        changed = changed_between(self.found, found)
+        self.found = found
+        return changed
+
+    def walk(self, relpath=""):
+        """Return ``{relative_path: lstat}`` for the files under this folder in the context"""
+        directory = os.path.join(self.context.parent_dir, relpath)
+
+        prune = self.prune
+        if relpath and prune is not None:
+            prune = lambda path: self.prune(os.path.join(relpath, path))
+
+        found, errors = Walker(directory, prune=prune).walk()
+        for path, error in errors:
+            log.warning("Failed to look at a file\tpath=%s\terror=%s", path, error)
+
+        if not relpath:
+            return found
+        return dict((os.path.join(relpath, path), st) for path, st in found.items())
+
+    def add_watches(self, relpath=""):
+        """Add an inotify watch for this folder and the folders under it"""
+        parent_dir = self.context.parent_dir
+        for root, dirs, _ in os.walk(os.path.join(parent_dir, relpath)):
+            rel = os.path.relpath(root, parent_dir)
+            if rel == ".":
+                rel = ""
+
+            if rel and self.prune is not None and self.prune(rel):
+                dirs[:] = []
+                continue
+
+            try:
+                self.watches[self.inotify.add_watch(root, self.mask)] = rel
+            except OSError as error:
+                log.warning("Failed to watch a folder\tpath=%s\terror=%s", root, error)
+
+    def read_inotify(self, timeout):
+        """Return the paths that changed according to inotify events in the next timeout seconds"""
+        changed = set()
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            if event.mask & flags.Q_OVERFLOW:
+                log.warning("Missed some changes, looking at the whole context again")
+                changed |= self.rescan()
+                continue
+
+            if event.mask & flags.IGNORED:
+                self.watches.pop(event.wd, None)
+                continue
+
+            folder = self.watches.get(event.wd)
+            if folder is None or not event.name:
+                continue
+
+            relpath = os.path.join(folder, event.name) if folder else event.name
+            changed |= self.refresh(relpath)
+
+            if event.mask & flags.ISDIR and event.mask & (flags.CREATE | flags.MOVED_TO):
+                self.add_watches(relpath)
+        return changed
+
+    def rescan(self):
+        """Watch and walk the whole context again and return what changed since we last looked"""
+        self.add_watches()
+        found = self.walk()
+        changed = changed_between(self.found, found)
+        self.found = found
+        return changed
+
+    def refresh(self, relpath):
+        """Update what we know about this path and anything under it and return what changed"""
+        location = os.path.join(self.context.parent_dir, relpath)
+        try:
+            st = os.lstat(location)
+        except FileNotFoundError:
+            st = None
+
+        is_file = st is not None and (stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode))
+        if is_file and stat.S_ISLNK(st.st_mode) and os.path.isdir(location):
+            # The walker follows symlinks to folders
+            is_file = False
+
+        if is_file or (st is None and relpath in self.found):
+            before = {relpath: self.found[relpath]} if relpath in self.found else {}
+        else:
+            prefix = "{0}/".format(relpath)
+            before = dict(
+                (path, found)
+                for path, found in self.found.items()
+                if path == relpath or path.startswith(prefix)
+            )
+
+        after = {}
+        if is_file:
+            after = {relpath: st}
+        elif st is not None and not (self.prune is not None and self.prune(relpath)):
+            after = self.walk(relpath)
+
+        for path in before:
+            del self.found[path]
+        self.found.update(after)
+        return changed_between(before, after)
@@ -35,6 +35,29 @@ describe HarpoonCase, "Context object":
             cmd = mock.NonCallableMock(name="cmd", from_name=from_name)
             assert co.Command(("FROM", cmd)).as_string == "FROM {0}".format(from_name)
 
+    describe "context_sources":
+        it "returns the sources from ADD and COPY":
+            assert co.Command("ADD one two /app").context_sources == ["one", "two"]
+            assert co.Command("COPY ./src /app/src").context_sources == ["./src"]
+            assert co.Command("COPY --chown=1:1 src /app").context_sources == ["src"]
+            assert co.Command('COPY ["a file", "b", "/app/"]').context_sources == ["a file", "b"]
+
+        it "doesn't care about the case of the instruction":
+            assert co.Command("copy src /app").context_sources == ["src"]
+            assert co.Command("Add one http://example.com/a /app").context_sources == ["one"]
+            assert co.Command("copy --from=builder /src /app").context_sources == []
+
+        it "returns no sources for other instructions and copying from elsewhere":
+            assert co.Command("RUN cat one").context_sources == []
+            assert co.Command("COPY --from=builder /src /app").context_sources == []
+            assert co.Command("ADD http://example.com/a.tar one /app").context_sources == ["one"]
+            assert co.Command("COPY <<EOF /app/file").context_sources == []
+
+        it "returns None if it can't tell what the sources are":
+            assert co.Command("COPY $SRC /app").context_sources is None
+            assert co.Command("COPY onlyone").context_sources is None
+            assert co.Command('COPY ["unfinished", "/app"').context_sources is None
+
 describe HarpoonCase, "Commands":
 
     @pytest.fixture()
@@ -100,6 +123,17 @@ describe HarpoonCase, "Commands":
                 "9 10",
             ]
 
+    describe "context_sources":
+        it "combines the sources from all the commands":
+            commands = co.Commands(
+                [co.Command("FROM ubuntu"), [co.Command("COPY one /"), co.Command("ADD two /")]]
+            )
+            assert commands.context_sources == ["one", "two"]
+
+        it "returns None if any command has sources we can't work out":
+            commands = co.Commands([co.Command("COPY one /"), co.Command("COPY ${SRC} /")])
+            assert commands.context_sources is None
+
     describe "extra_context":
         it "yields all the extra_context found on commands":
             ec1 = mock.Mock(name="ec1")
@@ -8,6 +8,7 @@ from delfick_project.norms import Meta
 from harpoon.option_spec import command_objs
 from harpoon.option_spec import image_objs as objs
 from harpoon.option_spec.harpoon_specs import HarpoonSpec
+from harpoon.ship.context import IN_MEMORY_CONTEXT_SIZE
 from tests.helpers import HarpoonCase
 
 describe HarpoonCase, "Image object":
@@ -38,10 +39,16 @@ describe HarpoonCase, "Image object":
                 docker_file = mock.Mock(name="docker_file")
                 docker_file.docker_lines = image.docker_file.docker_lines
                 extra_context = mock.Mock(name="extra_context")
-                context_options = mock.Mock(name="context_options")
+                context_options = mock.Mock(
+                    name="context_options",
+                    use_cache=False,
+                    stream=False,
+                    deterministic=False,
+                    prune="never",
+                )
 
-                t = mock.Mock(name="t")
-                ctxt = mock.Mock(name="context", t=t)
+                overlay = mock.Mock(name="overlay")
+                ctxt = mock.Mock(name="context", overlay=overlay)
                 make_context_manager_called = mock.Mock(name="context_manager()")
                 make_context_manager = mock.MagicMock(
                     name="context_manager", return_value=make_context_manager_called
@@ -65,9 +72,12 @@ describe HarpoonCase, "Image object":
                                 with image.make_context() as ct:
                                     assert ct is ctxt
 
-                add_docker_file_to_tarfile.assert_called_once_with(docker_file, t)
+                add_docker_file_to_tarfile.assert_called_once_with(docker_file, overlay)
                 make_context_manager.assert_called_once_with(
-                    context_options, silent_build=False, extra_context=extra_context
+                    context_options,
+                    silent_build=False,
+                    extra_context=extra_context,
+                    memory_limit=IN_MEMORY_CONTEXT_SIZE,
                 )
 
             it "uses ContextBuilder with docker_file passed in":
@@ -78,10 +88,16 @@ describe HarpoonCase, "Image object":
                 docker_file = mock.Mock(name="docker_file")
                 docker_file.docker_lines = image.docker_file.docker_lines
                 extra_context = mock.Mock(name="extra_context")
-                context_options = mock.Mock(name="context_options")
+                context_options = mock.Mock(
+                    name="context_options",
+                    use_cache=False,
+                    stream=False,
+                    deterministic=False,
+                    prune="never",
+                )
 
-                t = mock.Mock(name="t")
-                ctxt = mock.Mock(name="context", t=t)
+                overlay = mock.Mock(name="overlay")
+                ctxt = mock.Mock(name="context", overlay=overlay)
                 make_context_manager_called = mock.Mock(name="context_manager()")
                 make_context_manager = mock.MagicMock(
                     name="context_manager", return_value=make_context_manager_called
@@ -106,9 +122,12 @@ describe HarpoonCase, "Image object":
                                 with image.make_context(docker_file=docker_file) as ct:
                                     assert ct is ctxt
 
-                add_docker_file_to_tarfile.assert_called_once_with(docker_file, t)
+                add_docker_file_to_tarfile.assert_called_once_with(docker_file, overlay)
                 make_context_manager.assert_called_once_with(
-                    context_options, silent_build=False, extra_context=extra_context
+                    context_options,
+                    silent_build=False,
+                    extra_context=extra_context,
+                    memory_limit=IN_MEMORY_CONTEXT_SIZE,
                 )
 
         describe "add_docker_file_to_tarfile":
@@ -120,3 +139,40 @@ describe HarpoonCase, "Image object":
                 tar.close()
 
                 self.assertTarFileContent(tar.name, {"./Dockerfile": "RUN one\nRUN two"})
+
+        describe "compress_context":
+
+            def make_compressable_image(self, base_url, context=None, **harpoon_options):
+                docker_context = mock.Mock(name="docker_context")
+                docker_context.api.base_url = base_url
+                harpoon = HarpoonSpec().harpoon_spec.normalise(
+                    Meta({}, []), dict(docker_context=docker_context, **harpoon_options)
+                )
+                options = {"commands": ["FROM ubuntu:14.04"], "harpoon": harpoon}
+                if context is not None:
+                    options["context"] = context
+                return self.make_image(options)
+
+            it "only compresses for remote daemons by default":
+                for base_url, expected in [
+                    ("http+docker://localhost", False),
+                    ("http+docker://localnpipe", False),
+                    ("http+docker://ssh", True),
+                    ("https://somewhere:2376", True),
+                ]:
+                    assert self.make_compressable_image(base_url).compress_context is expected
+
+            it "can always or never compress":
+                image = self.make_compressable_image(
+                    "http+docker://localhost", compress_context="always"
+                )
+                assert image.compress_context is True
+
+                image = self.make_compressable_image("https://somewhere", compress_context="never")
+                assert image.compress_context is False
+
+            it "prefers the compress option on the context":
+                image = self.make_compressable_image(
+                    "https://somewhere", context={"compress": False}, compress_context="always"
+                )
+                assert image.compress_context is False
@@ -43,6 +43,12 @@ describe HarpoonCase, "HarpoonSpec":
                     "parent_dir",
                     "find_options",
                     "ignore_find_errors",
+                    "use_cache",
+                    "stream",
+                    "compress",
+                    "deterministic",
+                    "prune",
+                    "use_dockerignore",
                 ]
             )
         )
@@ -88,6 +94,16 @@ describe HarpoonCase, "HarpoonSpec":
             def spec(self):
                 return HarpoonSpec().task_name_spec
 
+    describe "jobs":
+        it "needs at least one job and one push job", meta:
+            harpoon = HarpoonSpec().harpoon_spec.normalise(meta, {"jobs": 3})
+            assert (harpoon.jobs, harpoon.push_jobs) == (3, 1)
+
+            for key in ("jobs", "push_jobs"):
+                for value in (0, -1):
+                    with assertRaises(BadSpecValue):
+                        HarpoonSpec().harpoon_spec.normalise(meta, {key: value})
+
     describe "task spec":
         it "creates a Task object for each task", meta:
             tasks = HarpoonSpec().tasks_spec(["run"]).normalise(meta, {"one": {}})
@@ -0,0 +1,177 @@
+# coding: spec
+
+import json
+import os
+from unittest import mock
+
+import docker.errors
+from delfick_project.norms import sb
+
+from harpoon.option_spec import image_objs as objs
+from harpoon.ship.builder import UNCHANGED, Builder, BuildProgressStream
+from harpoon.ship.builders.base import FINGERPRINT_LABEL
+from harpoon.ship.context_scans import ContextScans
+from harpoon.ship.fingerprint import Fingerprinter
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "Image fingerprints":
+
+    def make_conf(self, root, lines=None, images=None):
+        images = {"parent:latest": {"Id": "sha256:parent"}} if images is None else images
+
+        def inspect_image(image_name):
+            if image_name not in images:
+                raise docker.errors.ImageNotFound(image_name)
+            return images[image_name]
+
+        lines = ["FROM parent", "ADD . /app"] if lines is None else lines
+        commands = [mock.Mock(name=line, action=line.split()[0], command=line) for line in lines]
+
+        harpoon = mock.Mock(
+            name="harpoon",
+            always_build=False,
+            keep_replaced=False,
+            silent_build=True,
+            context_scans=ContextScans(),
+            fingerprinter=Fingerprinter(),
+            spec=[
+                "always_build",
+                "keep_replaced",
+                "silent_build",
+                "context_scans",
+                "fingerprinter",
+                "docker_api",
+            ],
+        )
+        harpoon.docker_api.inspect_image.side_effect = inspect_image
+
+        conf = mock.Mock(name="conf", harpoon=harpoon, image_name_with_tag="app:latest")
+        conf.context = objs.Context(enabled=True, parent_dir=root, prune="never")
+        conf.docker_file.docker_lines = lines
+        conf.commands.commands = commands
+        conf.commands.dependent_images = [line.split()[1] for line in lines if line[:4] == "FROM"]
+        conf.commands.extra_context = []
+        conf.cache_from_names = []
+        conf.context_files = lambda builder: objs.Image.context_files(conf, builder)
+        conf.context_file_options = lambda: objs.Image.context_file_options(conf)
+        return conf
+
+    it "changes when anything that goes into the image changes":
+        root, _ = self.setup_directory({"one": "1", "two": "2"})
+        builder = Builder()
+
+        conf = self.make_conf(root)
+        fingerprint = builder.image_fingerprint(conf)
+        assert len(fingerprint) == 64
+        assert builder.image_fingerprint(self.make_conf(root)) == fingerprint
+
+        changed_lines = self.make_conf(root, lines=["FROM parent", "ADD . /other"])
+        assert builder.image_fingerprint(changed_lines) != fingerprint
+
+        new_parent = self.make_conf(root, images={"parent:latest": {"Id": "sha256:new"}})
+        assert builder.image_fingerprint(new_parent) != fingerprint
+
+        conf.cache_from_names = ["app:latest"]
+        assert builder.image_fingerprint(conf) != fingerprint
+
+        with open("{0}/two".format(root), "w") as fle:
+            fle.write("22")
+        assert builder.image_fingerprint(self.make_conf(root)) != fingerprint
+
+    it "has no fingerprint if it can't know everything before building":
+        root, _ = self.setup_directory({"one": "1"})
+        builder = Builder()
+
+        assert builder.image_fingerprint(self.make_conf(root, images={})) is None
+
+        from_url = ["FROM parent", "ADD https://example.com/thing /thing"]
+        assert builder.image_fingerprint(self.make_conf(root, lines=from_url)) is None
+
+        lowercase = ["FROM parent", "add https://example.com/thing /thing"]
+        assert builder.image_fingerprint(self.make_conf(root, lines=lowercase)) is None
+
+        from_scratch = self.make_conf(root, lines=["FROM scratch"], images={})
+        assert builder.image_fingerprint(from_scratch) is not None
+
+    it "doesn't build an image that already has the fingerprint":
+        root, _ = self.setup_directory({"one": "1"})
+        builder = Builder()
+        conf = self.make_conf(root)
+        fingerprint = builder.image_fingerprint(conf)
+
+        conf.harpoon.docker_api.inspect_image.side_effect = None
+        conf.harpoon.docker_api.inspect_image.return_value = {
+            "Id": "sha256:parent",
+            "Config": {"Labels": {FINGERPRINT_LABEL: fingerprint}},
+        }
+        assert builder.build_image(conf) is UNCHANGED
+        conf.make_context.assert_not_called()
+
+    it "labels the image with the fingerprint when it builds":
+        root, _ = self.setup_directory({"one": "1"})
+        builder = Builder()
+        conf = self.make_conf(root)
+        conf.tag = sb.NotSpecified
+        conf.make_context = mock.MagicMock(name="make_context")
+        fingerprint = builder.image_fingerprint(conf)
+
+        build = mock.Mock(name="build", return_value=False)
+        with mock.patch("harpoon.ship.builder.NormalBuilder.build", build):
+            assert builder.build_image(conf) is False
+
+        assert build.call_args[1] == {"labels": {FINGERPRINT_LABEL: fingerprint}}
+
+    it "fingerprints the same files it puts in the context":
+        root, _ = self.setup_directory({"one": "1"})
+        builder = Builder()
+        conf = self.make_conf(root)
+        conf.tag = sb.NotSpecified
+        conf.make_context = mock.MagicMock(name="make_context")
+
+        build = mock.Mock(name="build", return_value=False)
+        with mock.patch("harpoon.ship.builder.NormalBuilder.build", build):
+            builder.build_image(conf)
+
+        kwargs = conf.make_context.call_args[1]
+        assert kwargs["files"] == [(os.path.join(root, "one"), "./one")]
+        assert kwargs["builder"].last_scan is not None
+
+        fingerprint = builder.image_fingerprint(conf, kwargs["builder"], kwargs["files"])
+        assert build.call_args[1] == {"labels": {FINGERPRINT_LABEL: fingerprint}}
+
+    it "doesn't label the image if files change while making the context":
+        root, _ = self.setup_directory({"one": "1"})
+        builder = Builder()
+        conf = self.make_conf(root)
+        conf.tag = sb.NotSpecified
+        conf.make_context = mock.MagicMock(name="make_context")
+
+        def change(*args):
+            with open(os.path.join(root, "one"), "w") as fle:
+                fle.write("11")
+
+        conf.make_context.return_value.__enter__.side_effect = change
+
+        build = mock.Mock(name="build", return_value=False)
+        with mock.patch("harpoon.ship.builder.NormalBuilder.build", build):
+            assert builder.build_image(conf) is False
+
+        assert build.call_args[1] == {"labels": None}
+
+describe HarpoonCase, "BuildProgressStream":
+    it "doesn't let the step for the fingerprint label change whether the build was cached":
+        stream = BuildProgressStream()
+        lines = [
+            "Step 1/3 : FROM parent\n",
+            " ---> 1234\n",
+            "Step 2/3 : RUN true\n",
+            " ---> Using cache\n",
+            " ---> 5678\n",
+            "Step 3/3 : LABEL \"harpoon.fingerprint\"='abcd'\n",
+            " ---> Running in 9abc\n",
+            " ---> def0\n",
+            "Successfully built def0\n",
+        ]
+        for line in lines:
+            stream.feed(json.dumps({"stream": line}).encode())
+        assert stream.cached is True
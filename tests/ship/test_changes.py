@@ -0,0 +1,114 @@
+# coding: spec
+
+import os
+import subprocess
+from unittest import mock
+
+from harpoon.option_spec import image_objs as objs
+from harpoon.ship.changes import ChangedImages, changed_files, context_uses
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "changed_files":
+    it "finds changed, deleted and untracked files since a ref":
+        root, _ = self.setup_directory(
+            {"one": "1", "two": "2", "ignored": "i", ".gitignore": "ignored", "sub": {"three": "3"}}
+        )
+        root = os.path.realpath(root)
+
+        def git(*args):
+            subprocess.check_output(["git", *args], cwd=root, stderr=subprocess.STDOUT)
+
+        git("init", "-q")
+        git("add", ".")
+        git("-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "-m", "first")
+
+        with open(os.path.join(root, "one"), "w") as fle:
+            fle.write("11")
+        os.remove(os.path.join(root, "two"))
+        with open(os.path.join(root, "sub", "four"), "w") as fle:
+            fle.write("4")
+        with open(os.path.join(root, "ignored"), "w") as fle:
+            fle.write("ii")
+
+        found = changed_files(os.path.join(root, "sub"), "HEAD")
+        assert found == set(
+            [os.path.join(root, "one"), os.path.join(root, "two"), os.path.join(root, "sub/four")]
+        )
+
+    it "finds untracked files outside the directory it's given":
+        root, _ = self.setup_directory({"a": {"one": "1"}, "b": {"two": "2"}})
+        root = os.path.realpath(root)
+
+        def git(*args):
+            subprocess.check_output(["git", *args], cwd=root, stderr=subprocess.STDOUT)
+
+        git("init", "-q")
+        git("add", ".")
+        git("-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "-m", "first")
+
+        with open(os.path.join(root, "a", "x"), "w") as fle:
+            fle.write("x")
+        with open(os.path.join(root, "b", "y"), "w") as fle:
+            fle.write("y")
+
+        found = changed_files(os.path.join(root, "a"), "HEAD")
+        assert found == set([os.path.join(root, "a/x"), os.path.join(root, "b/y")])
+
+describe HarpoonCase, "ChangedImages":
+
+    def make_image(self, name, context, sources=None, dependencies=None, added=None):
+        image = mock.Mock(name=name, spec=["name", "context", "commands", "dependencies"])
+        image.name = name
+        image.context = context
+        image.commands.context_sources = sources
+        image.commands.extra_context = [({"context": ctx}, "added.tar") for ctx in added or []]
+        image.dependencies.return_value = dependencies or []
+        return image
+
+    it "knows what files a context uses":
+        root, _ = self.setup_directory({".dockerignore": "docs"})
+        context = objs.Context(
+            enabled=True,
+            parent_dir=root,
+            exclude=["*.pyc"],
+            include=["keep.pyc"],
+            use_dockerignore=True,
+        )
+        path = lambda p: os.path.join(os.path.realpath(root), p)
+
+        assert context_uses(context, path("src/app.py"))
+        assert not context_uses(context, path("src/app.pyc"))
+        assert context_uses(context, path("keep.pyc"))
+        assert not context_uses(context, path("docs/index.rst"))
+        assert context_uses(context, path(".dockerignore"))
+        assert not context_uses(context, os.path.join(os.path.dirname(root), "elsewhere"))
+
+        assert context_uses(context, path("src/app.py"), sources=["src"])
+        assert not context_uses(context, path("README"), sources=["src"])
+        assert context_uses(context, path("README"), sources=None)
+
+    it "finds the images using changed files and the images that depend on them":
+        root, _ = self.setup_directory({"api": {}, "web": {}, "lib": {}})
+        root = os.path.realpath(root)
+        context_for = lambda folder: objs.Context(
+            enabled=True, parent_dir=os.path.join(root, folder)
+        )
+        no_context = objs.Context(enabled=False, parent_dir=root)
+
+        images = {
+            "api": self.make_image("api", context_for("api"), sources=["src"]),
+            "web": self.make_image("web", context_for("web")),
+            "api_tests": self.make_image("api_tests", no_context, dependencies=["api"]),
+            "bundle": self.make_image("bundle", no_context, added=[context_for("lib")]),
+            "other": self.make_image("other", no_context),
+        }
+        config = os.path.join(root, "harpoon.yml")
+        changed = ChangedImages(images, [config])
+
+        assert changed.affected_by(set([os.path.join(root, "api/src/main.py")])) == set(
+            ["api", "api_tests"]
+        )
+        assert changed.affected_by(set([os.path.join(root, "api/README")])) == set()
+        assert changed.affected_by(set([os.path.join(root, "lib/thing")])) == set(["bundle"])
+        assert changed.affected_by(set([os.path.join(root, "web/index.html")])) == set(["web"])
+        assert changed.affected_by(set([config])) == set(images)
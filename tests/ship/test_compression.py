@@ -0,0 +1,33 @@
+# coding: spec
+
+import gzip
+import os
+from io import BytesIO
+
+from harpoon.ship.compression import gzip_blocks, iter_blocks
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "Compression":
+    describe "iter_blocks":
+        it "splits a file into blocks":
+            blocks = list(iter_blocks(BytesIO(b"a" * 10), 4))
+            assert blocks == [b"aaaa", b"aaaa", b"aa"]
+
+        it "joins and splits an iterable of chunks into blocks":
+            blocks = list(iter_blocks([b"a", b"bbbbbb", b"", b"cc"], 4))
+            assert blocks == [b"abbb", b"bbbc", b"c"]
+
+    describe "gzip_blocks":
+        it "creates a gzip stream of the original data":
+            data = os.urandom(1000) * 50
+            members = list(gzip_blocks(BytesIO(data), block_size=4096, workers=3))
+            assert len(members) == 13
+            assert gzip.decompress(b"".join(members)) == data
+
+        it "works with an iterable of chunks":
+            chunks = [b"one", b"two" * 1000, b"three"]
+            members = list(gzip_blocks(iter(chunks), block_size=100))
+            assert gzip.decompress(b"".join(members)) == b"".join(chunks)
+
+        it "yields nothing for an empty file":
+            assert list(gzip_blocks(BytesIO(b""))) == []
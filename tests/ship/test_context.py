@@ -1,14 +1,23 @@
 # coding: spec
 
+import logging
+import os
 import tarfile
+import threading
+import time
+from contextlib import contextmanager
+from io import BytesIO
 from unittest import mock
 
 import pytest
-from delfick_project.norms import Meta
+from delfick_project.norms import Meta, sb
 
 from harpoon.option_spec import image_objs as objs
 from harpoon.option_spec.harpoon_specs import HarpoonSpec
-from harpoon.ship.context import ContextBuilder, ContextWrapper
+from harpoon.ship.context import ContextBuilder, ContextWrapper, extract_archive
+from harpoon.ship.context_cache import ContextCache, ExtractionCache
+from harpoon.ship.context_scans import ContextScans
+from harpoon.ship.walker import Walker
 from tests.helpers import HarpoonCase
 
 describe HarpoonCase, "Context Wrapper":
@@ -26,6 +35,10 @@ describe HarpoonCase, "Context Wrapper":
         tmpfile.name = name
         assert ContextWrapper(t, tmpfile).name is name
 
+    it "has no name if the tar is in memory":
+        t = mock.Mock(name="t")
+        assert ContextWrapper(t, BytesIO()).name is None
+
     describe "close":
         it "closes the tarfile and seeks to the beginning of the file":
             t = mock.Mock(name="t")
@@ -38,14 +51,53 @@ describe HarpoonCase, "Context Wrapper":
             t.close.assert_called_once_with()
             tmpfile.seek.assert_called_once_with(0)
 
+    describe "overlay":
+        it "puts the overlay after the members of the tar":
+            tmpfile = self.make_temp_file()
+            t = tarfile.open(tmpfile.name, "w")
+            t.add(self.make_temp_file("blah").name, "./one")
+            wrapper = ContextWrapper(t, tmpfile)
+
+            wrapper.overlay.add(self.make_temp_file("meh").name, "./two")
+            location = os.path.join(self.make_temp_dir(), "context.tar")
+            wrapper.save(location)
+            assert wrapper.size == os.stat(location).st_size
+            self.assertTarFileContent(location, {"./one": "blah", "./two": "meh"})
+
+        it "sends the tar and the Dockerfile in the overlay without making the overlay twice":
+            t = tarfile.open(mode="w", fileobj=BytesIO())
+            t.add(self.make_temp_file("blah").name, "./one")
+            wrapper = ContextWrapper(t, t.fileobj)
+
+            conf = HarpoonSpec().image_spec.normalise(
+                Meta({"_key_name_1": "awesome", "config_root": self.make_temp_dir()}, []),
+                {"commands": ["FROM ubuntu:14.04"]},
+            )
+            conf.add_docker_file_to_tarfile(conf.docker_file, wrapper.overlay)
+            wrapper.close()
+
+            write_to = mock.Mock(name="write_to", side_effect=wrapper.overlay.write_to)
+            with mock.patch.object(wrapper.overlay, "write_to", write_to):
+                size = wrapper.size
+                sent = b"".join(wrapper.fileobj)
+            write_to.assert_called_once_with(mock.ANY)
+
+            assert size == len(sent)
+            location = os.path.join(self.make_temp_dir(), "context.tar")
+            with open(location, "wb") as fle:
+                fle.write(sent)
+            self.assertTarFileContent(
+                location, {"./one": "blah", "./Dockerfile": "FROM ubuntu:14.04"}
+            )
+
     describe "clone_with_new_dockerfile":
-        it "copies over files from the old tar file into a new tarfile and returns a new wrapper":
+        it "adds the new dockerfile to a copy of the overlay without copying the tar":
             tmpfile = self.make_temp_file()
             old_tar = tarfile.open(tmpfile.name, "w")
             old_tar.add(self.make_temp_file("blah").name, "./one")
             old_tar.add(self.make_temp_file("meh").name, "./two")
-            old_tar.add(self.make_temp_file("Dockerfile_lines").name, "./Dockerfile")
             wrapper = ContextWrapper(old_tar, tmpfile)
+            wrapper.overlay.add(self.make_temp_file("Dockerfile_lines").name, "./Dockerfile")
 
             conf = HarpoonSpec().image_spec.normalise(
                 Meta({"_key_name_1": "awesome", "config_root": self.make_temp_dir()}, []),
@@ -54,17 +106,80 @@ describe HarpoonCase, "Context Wrapper":
             docker_file = conf.docker_file
 
             with wrapper.clone_with_new_dockerfile(conf, docker_file) as new_wrapper:
-                assert new_wrapper.t is not wrapper.t
-                assert new_wrapper.tmpfile != wrapper.tmpfile
-                new_wrapper.close()
+                size = os.stat(tmpfile.name).st_size
+                assert new_wrapper.tmpfile is wrapper.tmpfile
+                assert new_wrapper.overlay is not wrapper.overlay
+
+                new_location = os.path.join(self.make_temp_dir(), "new.tar")
+                new_wrapper.save(new_location)
                 self.assertTarFileContent(
-                    new_wrapper.t.name,
+                    new_location,
                     {"./one": "blah", "./two": "meh", "./Dockerfile": "FROM ubuntu:14.04"},
                 )
+
+                old_location = os.path.join(self.make_temp_dir(), "old.tar")
+                wrapper.save(old_location)
                 self.assertTarFileContent(
-                    wrapper.t.name,
+                    old_location,
                     {"./one": "blah", "./two": "meh", "./Dockerfile": "Dockerfile_lines"},
                 )
+                assert os.stat(tmpfile.name).st_size == size
+
+describe HarpoonCase, "extract_archive":
+
+    def archive_of(self, root, name, mode):
+        location = self.make_temp_file().name
+        with tarfile.open(location, mode) as tf:
+            tf.add(os.path.join(root, name), arcname=name)
+        with open(location, "rb") as fle:
+            data = fle.read()
+        return [data[i : i + 100] for i in range(0, len(data), 100)]
+
+    it "writes the contents of a single file":
+        root, _ = self.setup_directory({"one": "blah" * 100})
+        for mode in ("w:gz", "w"):
+            location = os.path.join(self.make_temp_dir(), "out")
+            with open(location, "wb") as fle:
+                extract_archive(self.archive_of(root, "one", mode), fle)
+            with open(location) as fle:
+                assert fle.read() == "blah" * 100
+
+    it "writes a tar of what's inside a folder":
+        root, files = self.setup_directory({"stuff": {"one": "1", "two": {"three": "3"}}})
+        os.symlink("one", os.path.join(files["stuff"]["/folder/"], "link"))
+        for mode in ("w:gz", "w"):
+            location = os.path.join(self.make_temp_dir(), "out.tar")
+            with open(location, "wb") as fle:
+                extract_archive(self.archive_of(root, "stuff", mode), fle)
+            self.assertTarFileContent(location, {"one": "1", "two/three": "3", "link": None})
+
+describe HarpoonCase, "extract_from_image":
+    it "gets the archive from a created container and caches it by image id":
+        root, _ = self.setup_directory({"one": "blah"})
+        location = self.make_temp_file().name
+        with tarfile.open(location, "w") as tf:
+            tf.add(os.path.join(root, "one"), arcname="one")
+        with open(location, "rb") as fle:
+            archive = fle.read()
+
+        docker_api = mock.Mock(name="docker_api")
+        docker_api.inspect_image.return_value = {"Id": "sha256:1234"}
+        docker_api.create_container.return_value = {"Id": "c1"}
+        docker_api.get_archive.side_effect = lambda *args: (iter([archive]), {})
+
+        harpoon = mock.Mock(name="harpoon")
+        harpoon.extraction_cache = ExtractionCache(self.make_temp_dir(), 1024 * 1024)
+        conf = mock.Mock(name="conf", image_name="blah", tag=sb.NotSpecified, harpoon=harpoon)
+        content = {"image": "blah", "conf": conf, "path": "/one", "docker_api": docker_api}
+
+        for _ in range(2):
+            with ContextBuilder().the_context(content) as fle:
+                assert fle.read() == b"blah"
+
+        docker_api.create_container.assert_called_once_with(image="blah", command=["yes"])
+        docker_api.get_archive.assert_called_once_with("c1", "/one")
+        docker_api.remove_container.assert_called_once_with("c1")
+        assert docker_api.start.mock_calls == []
 
 describe HarpoonCase, "Context builder":
 
@@ -124,6 +239,146 @@ describe HarpoonCase, "Context builder":
                         {"./one": M.three_val, "./two": M.two_val, "./four": M.four_val},
                     )
 
+        it "gets extra content at the same time but adds it in order", M:
+            folder, files = self.setup_directory({"one": M.one_val}, root=M.folder)
+            barrier = threading.Barrier(3, timeout=5)
+            original_the_context = ContextBuilder.the_context
+
+            @contextmanager
+            def the_context(s, content, **kwargs):
+                barrier.wait()
+                with original_the_context(s, content, **kwargs) as fle:
+                    yield fle
+
+            extra_context = [(M.three_val, "./c"), (M.four_val, "./a"), (M.five_val, "./b")]
+            with mock.patch.object(ContextBuilder, "the_context", the_context):
+                with ContextBuilder().make_context(M.ctx, extra_context=extra_context) as ctx:
+                    ctx.close()
+                    with tarfile.open(ctx.name) as tf:
+                        assert tf.getnames() == ["./one", "./c", "./a", "./b"]
+
+        it "makes small contexts in memory when given a memory_limit", M:
+            folder, files = self.setup_directory({"one": M.one_val}, root=M.folder)
+            extra_context = [(M.two_val, "./two")]
+
+            with ContextBuilder().make_context(
+                M.ctx, extra_context=extra_context, memory_limit=1024 * 1024
+            ) as ctx:
+                assert isinstance(ctx.tmpfile, BytesIO)
+                ctx.close()
+                sent = b"".join(ctx.fileobj)
+                with tarfile.open(fileobj=BytesIO(sent)) as tf:
+                    assert tf.extractfile("./one").read().decode() == M.one_val
+                    assert tf.extractfile("./two").read().decode() == M.two_val
+                    assert tf.getmember("./two").mode == 0o600
+                assert ctx.size == len(sent)
+
+                location = self.make_temp_file().name
+                ctx.save(location)
+                self.assertTarFileContent(location, {"./one": M.one_val, "./two": M.two_val})
+
+        it "uses a temporary file for contexts that may be bigger than the memory_limit", M:
+            folder, files = self.setup_directory({"one": M.one_val}, root=M.folder)
+
+            with ContextBuilder().make_context(M.ctx, memory_limit=10) as ctx:
+                assert not isinstance(ctx.tmpfile, BytesIO)
+
+            extra_context = [({"image": "blah"}, "./two")]
+            with mock.patch.object(ContextBuilder, "add_extra_context"):
+                with ContextBuilder().make_context(
+                    M.ctx, extra_context=extra_context, memory_limit=1024 * 1024
+                ) as ctx:
+                    assert not isinstance(ctx.tmpfile, BytesIO)
+
+        it "makes the same tar for the same files when deterministic", M:
+            folder, files = self.setup_directory(
+                {"one": M.one_val, "two": {"three": M.three_val}}, root=M.folder
+            )
+            os.chmod(files["one"]["/file/"], 0o700)
+
+            def make(stream):
+                location = os.path.join(self.make_temp_dir(), "context.tar")
+                with ContextBuilder().make_context(
+                    M.ctx,
+                    extra_context=[(M.four_val, "./four")],
+                    stream=stream,
+                    deterministic=True,
+                ) as ctx:
+                    info = tarfile.TarInfo("./Dockerfile")
+                    info.size = 4
+                    info.mtime = time.time()
+                    ctx.overlay.addfile(info, BytesIO(b"FROM"))
+                    ctx.save(location)
+                with open(location, "rb") as fle:
+                    return fle.read()
+
+            first = make(stream=False)
+            os.utime(files["one"]["/file/"], (1000, 1000))
+            assert make(stream=False) == first
+
+            streamed = make(stream=True)
+            os.utime(files["one"]["/file/"], (2000, 2000))
+            assert make(stream=True) == streamed
+
+            with tarfile.open(fileobj=BytesIO(first)) as tf:
+                assert tf.getnames() == ["./one", "./two/three", "./four", "./Dockerfile"]
+                for member in tf.getmembers():
+                    assert (member.mtime, member.uid, member.uname) == (0, 0, "")
+                assert tf.getmember("./one").mode == 0o755
+                assert tf.getmember("./four").mode == 0o644
+
+        it "reuses the files from the cache if they haven't changed", M:
+            folder, files = self.setup_directory(
+                {"one": M.one_val, "two": M.two_val}, root=M.folder
+            )
+            cache = ContextCache(self.make_temp_dir(), 1024 * 1024)
+
+            with ContextBuilder().make_context(M.ctx, cache=cache) as tmpfile:
+                tmpfile.close()
+                self.assertTarFileContent(tmpfile.name, {"./one": M.one_val, "./two": M.two_val})
+
+            original_add = tarfile.TarFile.add
+            with mock.patch.object(
+                tarfile.TarFile, "add", autospec=True, side_effect=original_add
+            ) as add:
+                with ContextBuilder().make_context(
+                    M.ctx, extra_context=[(M.three_val, "./three")], cache=cache
+                ) as tmpfile:
+                    tmpfile.close()
+                    self.assertTarFileContent(
+                        tmpfile.name,
+                        {"./one": M.one_val, "./two": M.two_val, "./three": M.three_val},
+                    )
+
+            assert add.mock_calls == []
+
+            with open(files["two"]["/file/"], "w") as fle:
+                fle.write(M.four_val)
+
+            with ContextBuilder().make_context(M.ctx, cache=cache) as tmpfile:
+                tmpfile.close()
+                self.assertTarFileContent(tmpfile.name, {"./one": M.one_val, "./two": M.four_val})
+
+        it "only creates the tar when a streamed context is read", M:
+            folder, files = self.setup_directory(
+                {"one": M.one_val, "two": M.two_val}, root=M.folder
+            )
+            location = os.path.join(self.make_temp_dir(), "context.tar")
+
+            with ContextBuilder().make_context(
+                M.ctx, extra_context=[(M.three_val, "./three")], stream=True
+            ) as ctx:
+                assert ctx.size is None
+                with open(files["two"]["/file/"], "w") as fle:
+                    fle.write(M.four_val)
+
+                ctx.save(location)
+                assert ctx.size == os.stat(location).st_size
+
+            self.assertTarFileContent(
+                location, {"./one": M.one_val, "./two": M.four_val, "./three": M.three_val}
+            )
+
     describe "find_files":
         it "returns all the files if not using git", M:
             _, files = self.setup_directory(
@@ -240,6 +495,147 @@ describe HarpoonCase, "Context builder":
             found_files = ContextBuilder().find_files(M.ctx, False)
             assert found_files == expected_files
 
+        it "doesn't look inside excluded folders", M:
+            _, files = self.setup_directory(
+                {
+                    "node_modules": {"one": M.one_val},
+                    "two": M.two_val,
+                    "three": {"four": M.four_val},
+                },
+                root=M.folder,
+            )
+
+            M.ctx.exclude = ["node_modules/**"]
+            prune = ContextBuilder().pruner(M.ctx)
+            assert prune("node_modules")
+            assert not prune("three")
+
+            M.ctx.include = ["node_modules/one"]
+            prune = ContextBuilder().pruner(M.ctx)
+            assert not prune("node_modules")
+
+        it "remembers the lstat of the files it finds", M:
+            _, files = self.setup_directory({"one": M.one_val}, root=M.folder)
+
+            builder = ContextBuilder()
+            assert builder.find_files(M.ctx, False) == [files["one"]["/file/"]]
+            assert builder.stats == {files["one"]["/file/"]: os.lstat(files["one"]["/file/"])}
+
+        it "keeps names that aren't ascii as they are", M:
+            self.setup_directory({"ünï.txt": M.one_val, "ïnü.txt": M.two_val}, root=M.folder)
+
+            builder = ContextBuilder()
+            found = [arcname for _, arcname in builder.find_files_for_tar(M.ctx, False)]
+            assert found == ["./ïnü.txt", "./ünï.txt"]
+
+            with builder.make_context(M.ctx) as tmpfile:
+                tmpfile.close()
+                self.assertTarFileContent(
+                    tmpfile.name, {"./ünï.txt": M.one_val, "./ïnü.txt": M.two_val}
+                )
+
+        it "uses the find command if there are find_options", M:
+            _, files = self.setup_directory(
+                {"one": M.one_val, "two": M.two_val, "three": {"four": M.four_val}},
+                root=M.folder,
+            )
+
+            M.ctx.find_options = "-not -name two"
+            found_files = ContextBuilder().find_files(M.ctx, False)
+            assert found_files == sorted([files["one"]["/file/"], files["three"]["four"]["/file/"]])
+
+        it "only looks for files once for contexts that share a scan", M:
+            _, files = self.setup_directory(
+                {"node_modules": {"one": M.one_val}, "two": M.two_val, "three": {"4": M.four_val}},
+                root=M.folder,
+            )
+
+            first = objs.Context(enabled=True, parent_dir=M.folder, exclude=["node_modules/**"])
+            second = objs.Context(enabled=True, parent_dir=M.folder, exclude=["three/**"])
+            other = objs.Context(enabled=True, parent_dir=files["three"]["/folder/"])
+
+            scans = ContextScans()
+            scans.share([first, second, other])
+            assert scans.shared(first)
+            assert not scans.shared(other)
+
+            original_walk = Walker.walk
+            with mock.patch.object(
+                Walker, "walk", autospec=True, side_effect=original_walk
+            ) as walk:
+                builder = ContextBuilder()
+                assert builder.find_files(first, False, scans=scans) == sorted(
+                    [files["two"]["/file/"], files["three"]["4"]["/file/"]]
+                )
+                assert builder.find_files(second, False, scans=scans) == sorted(
+                    [files["node_modules"]["one"]["/file/"], files["two"]["/file/"]]
+                )
+
+            assert len(walk.mock_calls) == 1
+            assert files["two"]["/file/"] in builder.stats
+
+        it "leaves out files from the .dockerignore without looking in ignored folders", M:
+            _, files = self.setup_directory(
+                {
+                    ".dockerignore": "node_modules\n*.md\n!README.md\n",
+                    "node_modules": {"a": {"b.js": M.one_val}},
+                    "README.md": M.two_val,
+                    "CHANGES.md": M.three_val,
+                    "src": {"a.py": M.four_val},
+                },
+                root=M.folder,
+            )
+
+            assert len(ContextBuilder().find_files(M.ctx, False)) == 5
+
+            M.ctx.use_dockerignore = True
+            pruned = []
+            original_prune = ContextBuilder.pruner
+
+            def pruner(s, context):
+                prune = original_prune(s, context)
+                return lambda relpath: pruned.append(relpath) or prune(relpath)
+
+            with mock.patch.object(ContextBuilder, "pruner", pruner):
+                found_files = ContextBuilder().find_files(M.ctx, False)
+
+            assert found_files == sorted(
+                [
+                    files[".dockerignore"]["/file/"],
+                    files["README.md"]["/file/"],
+                    files["src"]["a.py"]["/file/"],
+                ]
+            )
+            assert "node_modules" in pruned
+            assert "node_modules/a" not in pruned
+
+        it "only keeps files used by the Dockerfile when pruning", M:
+            _, files = self.setup_directory(
+                {"requirements.txt": M.one_val, "src": {"a.py": M.two_val}, "docs": M.three_val},
+                root=M.folder,
+            )
+            sources = ["requirements.txt", "./src/"]
+            expected = sorted([files["requirements.txt"]["/file/"], files["src"]["a.py"]["/file/"]])
+
+            assert len(ContextBuilder().find_files(M.ctx, False, sources=sources)) == 3
+
+            M.ctx.prune = "always"
+            assert ContextBuilder().find_files(M.ctx, False, sources=sources) == expected
+            assert len(ContextBuilder().find_files(M.ctx, False, sources=None)) == 3
+            assert len(ContextBuilder().find_files(M.ctx, False, sources=["."])) == 3
+
+        it "only reports what would be pruned in report mode", M, caplog:
+            _, files = self.setup_directory(
+                {"src": {"a.py": M.two_val}, "docs": "a" * 2000}, root=M.folder
+            )
+            M.ctx.prune = "report"
+
+            with caplog.at_level(logging.INFO, logger="harpoon.ship.context"):
+                found_files = ContextBuilder().find_files(M.ctx, True, sources=["src"])
+
+            assert len(found_files) == 2
+            assert "Would prune 1/2 files (2.0 kB)" in caplog.text
+
     describe "Finding submodule files":
         it "is able to find files in a submodule":
             with self.cloned_submodule_example() as first_repo:
@@ -305,6 +701,30 @@ describe HarpoonCase, "Context builder":
                     sort_output=True,
                 )
 
+        it "includes files under symlinked folders":
+            with self.cloned_repo_example() as root_folder:
+                ctxt = objs.Context(enabled=True, parent_dir=root_folder, use_gitignore=True)
+                os.symlink(os.path.join(root_folder, "three"), os.path.join(root_folder, "linked"))
+                assert ContextBuilder().find_notignored_git_files(ctxt, False) == (
+                    set(
+                        [
+                            ".gitignore",
+                            ".hidden",
+                            "one",
+                            "three/five",
+                            "three/four/seven",
+                            "three/four/six",
+                            "two",
+                            "three/.hidden2",
+                            "linked",
+                            "linked/five",
+                            "linked/four/seven",
+                            "linked/four/six",
+                            "linked/.hidden2",
+                        ]
+                    )
+                )
+
         it "returns valid files":
             with self.cloned_repo_example() as root_folder:
                 ctxt = objs.Context(enabled=True, parent_dir=root_folder, use_gitignore=True)
@@ -0,0 +1,104 @@
+# coding: spec
+
+import os
+import tarfile
+import tempfile
+
+import pytest
+
+from harpoon.option_spec import image_objs as objs
+from harpoon.ship.context_cache import ContextCache, manifest_for
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "ContextCache":
+
+    @pytest.fixture()
+    def M(self):
+        f = self.make_temp_dir()
+
+        class Mocks:
+            folder = f
+            ctx = objs.Context(enabled=True, parent_dir=f)
+            cache = ContextCache(os.path.join(self.make_temp_dir(), "contexts"), 1024 * 1024)
+
+        return Mocks
+
+    def make_tar(self, files):
+        tmpfile = tempfile.NamedTemporaryFile()
+        t = tarfile.open(mode="w", fileobj=tmpfile)
+        for path, arcname in files:
+            t.add(path, arcname=arcname)
+        return tmpfile, t
+
+    it "has a key that depends on the context options", M:
+        key = M.cache.key_for(M.ctx)
+        assert key == M.cache.key_for(objs.Context(enabled=True, parent_dir=M.folder))
+
+        M.ctx.exclude = ["one/**"]
+        assert M.cache.key_for(M.ctx) != key
+
+        changed = M.cache.key_for(M.ctx)
+        M.ctx.use_dockerignore = True
+        assert M.cache.key_for(M.ctx) != changed
+
+    it "has a key that depends on the Dockerfile sources when pruning", M:
+        key = M.cache.key_for(M.ctx, ["src"])
+        assert key == M.cache.key_for(M.ctx, ["other"])
+
+        M.ctx.prune = "always"
+        pruned = M.cache.key_for(M.ctx, ["src", "lib"])
+        assert pruned != key
+        assert pruned == M.cache.key_for(M.ctx, ["lib", "src"])
+        assert pruned != M.cache.key_for(M.ctx, ["src"])
+        assert M.cache.key_for(M.ctx, None) != pruned
+
+    it "restores what was stored if the manifest is the same", M:
+        _, files = self.setup_directory({"one": "1", "two": "2"}, root=M.folder)
+        found = [(files["one"]["/file/"], "./one"), (files["two"]["/file/"], "./two")]
+        manifest = manifest_for(found)
+
+        tmpfile, t = self.make_tar(found)
+        M.cache.store("blah", manifest, tmpfile, t.offset)
+        t.close()
+
+        with tempfile.NamedTemporaryFile() as restored:
+            assert M.cache.restore("blah", manifest, restored)
+            t = tarfile.open(mode="w", fileobj=restored)
+            t.add(self.make_temp_file("3").name, arcname="./three")
+            t.close()
+            restored.flush()
+            self.assertTarFileContent(restored.name, {"./one": "1", "./two": "2", "./three": "3"})
+
+    it "doesn't restore if the manifest has changed", M:
+        _, files = self.setup_directory({"one": "1", "two": "2"}, root=M.folder)
+        found = [(files["one"]["/file/"], "./one"), (files["two"]["/file/"], "./two")]
+
+        tmpfile, t = self.make_tar(found)
+        M.cache.store("blah", manifest_for(found), tmpfile, t.offset)
+
+        with open(files["two"]["/file/"], "w") as fle:
+            fle.write("twenty")
+
+        with tempfile.NamedTemporaryFile() as restored:
+            assert not M.cache.restore("blah", manifest_for(found), restored)
+            assert restored.tell() == 0
+
+    it "evicts the least recently used entries when it gets too big", M:
+        _, files = self.setup_directory({"one": "1" * 1000}, root=M.folder)
+        found = [(files["one"]["/file/"], "./one")]
+        manifest = manifest_for(found)
+
+        tmpfile, t = self.make_tar(found)
+        M.cache.max_size = t.offset * 2
+
+        M.cache.store("first", manifest, tmpfile, t.offset)
+        M.cache.store("second", manifest, tmpfile, t.offset)
+        os.utime(M.cache.locations("first")[1], (0, 0))
+        M.cache.store("third", manifest, tmpfile, t.offset)
+
+        assert sorted(os.listdir(M.cache.directory)) == [
+            "second.json",
+            "second.tar",
+            "third.json",
+            "third.tar",
+        ]
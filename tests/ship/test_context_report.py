@@ -0,0 +1,43 @@
+# coding: spec
+
+from harpoon.option_spec import image_objs as objs
+from harpoon.ship.context import ContextBuilder
+from harpoon.ship.context_report import ContextReport
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "ContextReport":
+    it "reports sizes, pattern matches and timings":
+        root, _ = self.setup_directory(
+            {
+                "big": "a" * 5000,
+                "src": {"one.py": "b" * 300, "deep": {"two.py": "c" * 200}},
+                "node_modules": {"thing.js": "d" * 100},
+                "small.pyc": "e",
+            }
+        )
+        context = objs.Context(
+            enabled=True,
+            parent_dir=root,
+            exclude=["node_modules/**", "*.pyc"],
+            include=["small.pyc"],
+        )
+
+        builder = ContextBuilder()
+        with builder.make_context(context) as ctx:
+            ctx.close()
+            report = ContextReport(context, builder, ctx.size, top=2)
+
+        assert report.largest_files() == [(5000, "big"), (300, "src/one.py")]
+        assert report.largest_folders() == [(500, "src"), (200, "src/deep")]
+        assert report.pattern_matches() == [
+            ("exclude", "node_modules/**", 0, 1),
+            ("exclude", "*.pyc", 1, 0),
+            ("include", "small.pyc", 1, 0),
+        ]
+        assert set(builder.timings) == set(["find", "filter", "tar"])
+
+        lines = list(report.lines())
+        assert "  files: 4" in lines
+        assert "  bytes in files: 5501 (5.5 kB)" in lines
+        assert "  exclude node_modules/**: 0 files, 1 folders not looked in" in lines
+        assert any(line.startswith("  tar ") for line in lines)
@@ -0,0 +1,56 @@
+# coding: spec
+
+from harpoon.ship.dockerignore import DockerIgnore
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "DockerIgnore":
+    it "ignores comments and empty lines":
+        dockerignore = DockerIgnore(["# node_modules", "", "   "])
+        assert not dockerignore
+        assert not dockerignore.matches("node_modules")
+
+    it "doesn't let * and ? match a /":
+        dockerignore = DockerIgnore(["*.pyc", "docs/?.md"])
+        assert dockerignore.matches("one.pyc")
+        assert not dockerignore.matches("src/one.pyc")
+        assert dockerignore.matches("docs/a.md")
+        assert not dockerignore.matches("docs/ab.md")
+
+    it "lets ** match any number of folders":
+        dockerignore = DockerIgnore(["**/*.pyc", "build/**"])
+        assert dockerignore.matches("one.pyc")
+        assert dockerignore.matches("src/deep/one.pyc")
+        assert dockerignore.matches("build/a/b/c")
+        assert not dockerignore.matches("src/one.py")
+
+    it "ignores everything inside a folder that is ignored":
+        dockerignore = DockerIgnore(["/node_modules/", "./.venv"])
+        assert dockerignore.matches("node_modules")
+        assert dockerignore.matches("node_modules/a/b.js")
+        assert dockerignore.matches(".venv/bin/python")
+        assert not dockerignore.matches("src/node_modules/a.js")
+
+    it "uses the last pattern that matches":
+        dockerignore = DockerIgnore(["*.md", "!README.md", "README*"])
+        assert dockerignore.matches("CHANGES.md")
+        assert dockerignore.matches("README.md")
+
+        dockerignore = DockerIgnore(["docs", "!docs/index.rst"])
+        assert dockerignore.matches("docs/other.rst")
+        assert not dockerignore.matches("docs/index.rst")
+
+    it "only says everything in a folder is ignored if nothing can be added back":
+        dockerignore = DockerIgnore(["node_modules", "docs", "!docs/index.rst", "src/*.pyc"])
+        assert dockerignore.ignores_everything_under("node_modules")
+        assert not dockerignore.ignores_everything_under("docs")
+        assert not dockerignore.ignores_everything_under("src")
+
+        dockerignore = DockerIgnore(["node_modules", "!*.md"])
+        assert not dockerignore.ignores_everything_under("node_modules")
+
+    it "can be read from a file":
+        location = self.make_temp_file("node_modules\n!node_modules/keep\n").name
+        dockerignore = DockerIgnore.from_file(location)
+        assert dockerignore.matches("node_modules/one")
+        assert not dockerignore.matches("node_modules/keep")
+        assert DockerIgnore.from_file("{0}.nope".format(location)) is None
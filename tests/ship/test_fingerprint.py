@@ -0,0 +1,135 @@
+# coding: spec
+
+import os
+import subprocess
+from unittest import mock
+
+from harpoon.option_spec import image_objs as objs
+from harpoon.ship import fingerprint
+from harpoon.ship.fingerprint import Fingerprinter, HashCache, git_object_ids
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "Fingerprinter":
+
+    def pairs_for(self, root, files):
+        return [(os.path.join(root, name), "./{0}".format(name)) for name in files]
+
+    it "only changes the digest when names, content or permissions change":
+        root, _ = self.setup_directory({"one": "1", "two": "2"})
+        pairs = self.pairs_for(root, ["one", "two"])
+        fingerprinter = Fingerprinter()
+
+        first = fingerprinter.digest(pairs)
+        assert fingerprinter.digest(list(reversed(pairs))) == first
+
+        os.utime(pairs[0][0], (1000, 1000))
+        assert fingerprinter.digest(pairs) == first
+
+        with open(pairs[0][0], "w") as fle:
+            fle.write("3")
+        changed = fingerprinter.digest(pairs)
+        assert changed != first
+
+        os.chmod(pairs[0][0], 0o600)
+        private = fingerprinter.digest(pairs)
+        assert private != changed
+
+        os.chmod(pairs[0][0], 0o644)
+        assert fingerprinter.digest(pairs) != private
+
+        os.chmod(pairs[0][0], 0o755)
+        assert fingerprinter.digest(pairs) != changed
+
+        assert fingerprinter.digest([(pairs[0][0], "./other")]) != fingerprinter.digest(pairs[:1])
+
+    it "only cares about the executable bit if the context is deterministic":
+        root, _ = self.setup_directory({"one": "1"})
+        pairs = self.pairs_for(root, ["one"])
+        fingerprinter = Fingerprinter()
+
+        os.chmod(pairs[0][0], 0o600)
+        first = fingerprinter.digest(pairs, deterministic=True)
+
+        os.chmod(pairs[0][0], 0o644)
+        assert fingerprinter.digest(pairs, deterministic=True) == first
+
+        os.chmod(pairs[0][0], 0o744)
+        assert fingerprinter.digest(pairs, deterministic=True) != first
+
+    it "remembers hashes by dev, inode, size and mtime":
+        root, _ = self.setup_directory({"one": "1", "two": "2"})
+        pairs = self.pairs_for(root, ["one", "two"])
+        cache = HashCache(os.path.join(self.make_temp_dir(), "cache", "hashes.sqlite"))
+
+        first = Fingerprinter(cache=cache).digest(pairs)
+
+        original_hash_files = fingerprint.hash_files
+        with mock.patch.object(fingerprint, "hash_files", side_effect=original_hash_files) as h:
+            fresh = HashCache(cache.location)
+            assert Fingerprinter(cache=fresh).digest(pairs) == first
+            h.assert_called_once_with([])
+
+            with open(pairs[1][0], "w") as fle:
+                fle.write("22")
+            assert Fingerprinter(cache=fresh).digest(pairs) != first
+            h.assert_called_with([pairs[1][0]])
+
+    it "hashes files in processes when there are many of them":
+        root, _ = self.setup_directory({str(i): str(i) for i in range(20)})
+        pairs = self.pairs_for(root, [str(i) for i in range(20)])
+
+        inline = Fingerprinter(workers=1).digest(pairs)
+        assert Fingerprinter(workers=2, min_files_for_pool=1).digest(pairs) == inline
+
+    it "doesn't fork to hash files because other threads may be holding locks":
+        assert fingerprint.pool_context().get_start_method() in ("forkserver", "spawn")
+
+    it "uses object IDs from git for files that are unchanged":
+        root, _ = self.setup_directory({"one": "1", "two": "2", "three": "3"})
+
+        def git(*args):
+            subprocess.check_output(["git", *args], cwd=root, stderr=subprocess.STDOUT)
+
+        git("init", "-q")
+        git("add", "one", "two")
+        with open(os.path.join(root, "two"), "w") as fle:
+            fle.write("22")
+
+        object_ids = git_object_ids(root)
+        assert list(object_ids) == ["one"]
+
+        git("add", "two")
+        git("update-index", "--assume-unchanged", "one")
+        git("update-index", "--skip-worktree", "two")
+        assert git_object_ids(root) == {}
+        git("update-index", "--no-assume-unchanged", "one")
+        git("update-index", "--no-skip-worktree", "two")
+        git("reset", "-q", "two")
+
+        pairs = self.pairs_for(root, ["one", "two", "three"])
+        hashes = Fingerprinter().hashes(pairs, git_dir=root)
+        assert hashes[pairs[0][0]][2] == "git:{0}".format(object_ids["one"])
+        assert hashes[pairs[1][0]][2].startswith("sha256:")
+        assert hashes[pairs[2][0]][2].startswith("sha256:")
+
+    it "returns no object IDs outside of git":
+        root, _ = self.setup_directory({"one": "1"})
+        with mock.patch.object(fingerprint, "command_output", return_value=([], 128)):
+            assert git_object_ids(root) == {}
+
+describe HarpoonCase, "Context digest":
+    it "digests the files that would be in the context":
+        root, files = self.setup_directory({"one": "1", "two": {"three": "3"}})
+        context = objs.Context(enabled=True, parent_dir=root, exclude=["two/**"])
+        fingerprinter = Fingerprinter()
+
+        first = context.digest(fingerprinter)
+        assert first == fingerprinter.digest([(files["one"]["/file/"], "./one")])
+
+        with open(files["two"]["three"]["/file/"], "w") as fle:
+            fle.write("4")
+        assert context.digest(fingerprinter) == first
+
+        with open(files["one"]["/file/"], "w") as fle:
+            fle.write("4")
+        assert context.digest(fingerprinter) != first
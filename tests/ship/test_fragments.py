@@ -0,0 +1,66 @@
+# coding: spec
+
+import os
+import tarfile
+from unittest import mock
+
+from harpoon.ship.context import normalise_tarinfo
+from harpoon.ship.fragments import FragmentStore
+from harpoon.ship.tar_writer import TarWriter
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "FragmentStore":
+
+    def make_tar(self, store, files, filter=None):
+        location = os.path.join(self.make_temp_dir(), "context.tar")
+        with open(location, "w+b") as fle:
+            t = tarfile.open(mode="w", fileobj=fle)
+            writer = TarWriter(t, filter=filter)
+            keys = [store.add(writer, path, arcname, os.lstat(path)) for path, arcname in files]
+            t.close()
+        return location, keys
+
+    it "makes the same tar as tarfile and reuses fragments for unchanged files":
+        root, files = self.setup_directory({"one": "1" * 1000, "two": {"three": "3"}})
+        os.symlink("one", os.path.join(root, "link"))
+        pairs = [
+            (files["one"]["/file/"], "./one"),
+            (files["two"]["three"]["/file/"], "./two/three"),
+            (os.path.join(root, "link"), "./link"),
+        ]
+
+        store = FragmentStore(self.make_temp_dir(), 1024 * 1024)
+        location, keys = self.make_tar(store, pairs, filter=normalise_tarinfo)
+        self.assertTarFileContent(
+            location, {"./one": "1" * 1000, "./two/three": "3", "./link": None}
+        )
+
+        expected = os.path.join(self.make_temp_dir(), "expected.tar")
+        with tarfile.open(expected, "w") as t:
+            for path, arcname in pairs:
+                t.add(path, arcname=arcname, filter=normalise_tarinfo)
+        with open(location, "rb") as fle, open(expected, "rb") as other:
+            assert fle.read() == other.read()
+
+        with open(files["two"]["three"]["/file/"], "w") as fle:
+            fle.write("changed")
+
+        original_store = store.store
+        with mock.patch.object(store, "store", side_effect=original_store) as stored:
+            location, new_keys = self.make_tar(store, pairs, filter=normalise_tarinfo)
+
+        assert len(stored.mock_calls) == 1
+        assert new_keys[0] == keys[0] and new_keys[1] != keys[1]
+        self.assertTarFileContent(
+            location, {"./one": "1" * 1000, "./two/three": "changed", "./link": None}
+        )
+
+    it "evicts the oldest fragments it isn't told to keep":
+        root, files = self.setup_directory({"one": "1" * 2000, "two": "2" * 2000})
+        store = FragmentStore(self.make_temp_dir(), 3000)
+        _, [first] = self.make_tar(store, [(files["one"]["/file/"], "./one")])
+        _, [second] = self.make_tar(store, [(files["two"]["/file/"], "./two")])
+
+        store.evict(keep=[second])
+        assert not os.path.exists(store.location(first))
+        assert os.path.exists(store.location(second))
@@ -0,0 +1,74 @@
+# coding: spec
+
+import fnmatch
+
+from harpoon.ship.matcher import GlobMatcher, literal_prefix
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "literal_prefix":
+    it "returns everything before the first wildcard":
+        assert literal_prefix("one/two/*.py") == "one/two/"
+        assert literal_prefix("one/t?o") == "one/t"
+        assert literal_prefix("[ab]/c") == ""
+        assert literal_prefix("one/two") == "one/two"
+
+describe HarpoonCase, "GlobMatcher":
+    it "matches the same as fnmatch":
+        globs = [
+            "*.pyc",
+            ".git/**",
+            "three/four",
+            "docs/*.rst",
+            "one/two/[ab]*",
+            "one/t?o/c",
+            "**/node_modules/**",
+        ]
+        paths = [
+            "blah.pyc",
+            "one/two/three.pyc",
+            ".git/objects/ab",
+            ".github/workflows/ci.yml",
+            "three/four",
+            "three/four/five",
+            "three/five",
+            "docs/index.rst",
+            "docs/api/index.rst",
+            "docs/index.md",
+            "one/two/apple",
+            "one/two/cherry",
+            "one/two/c",
+            "one/too/c",
+            "node_modules/thing",
+            "app/node_modules/thing/index.js",
+            "app/index.js",
+        ]
+
+        matcher = GlobMatcher(globs)
+        for path in paths:
+            expected = any(fnmatch.fnmatch(path, glob) for glob in globs)
+            assert matcher.matches(path) == expected, path
+
+    it "matches nothing if there are no globs":
+        matcher = GlobMatcher(None)
+        assert not matcher
+        assert not matcher.matches("one")
+        assert not matcher.matches_everything_under("one")
+        assert not matcher.may_match_under("one")
+
+    it "knows if everything under a folder matches":
+        matcher = GlobMatcher(["node_modules/**", "three/four", "*/build/*"])
+        assert matcher.matches_everything_under("node_modules")
+        assert matcher.matches_everything_under("node_modules/a")
+        assert matcher.matches_everything_under("app/build")
+        assert not matcher.matches_everything_under("three")
+        assert not matcher.matches_everything_under("three/four")
+        assert not matcher.matches_everything_under("app")
+
+    it "knows if anything under a folder may match":
+        matcher = GlobMatcher(["node_modules/one", "docs/*.rst"])
+        assert matcher.may_match_under("node_modules")
+        assert matcher.may_match_under("docs")
+        assert not matcher.may_match_under("app")
+        assert not matcher.may_match_under("node")
+
+        assert GlobMatcher(["*.rst"]).may_match_under("anything")
@@ -0,0 +1,167 @@
+# coding: spec
+
+import threading
+from io import StringIO
+from unittest import mock
+
+import pytest
+from delfick_project.errors_pytest import assertRaises
+
+from harpoon.errors import FailedImage
+from harpoon.ship.parallel import PrefixedOutput, make_in_parallel, pushing_in_background
+from harpoon.ship.runner import Runner
+from harpoon.ship.scheduler import Scheduler
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "PrefixedOutput":
+    it "writes whole lines with the prefix of the thread that wrote them":
+        buf = StringIO()
+        output = PrefixedOutput(buf)
+
+        output.write("no prefix\n")
+        with output.prefixed("[one] "):
+            output.write(b"hel")
+            output.write("lo\nDownloading 1%\rDownloading 100%\nunfinished")
+            assert buf.getvalue() == "no prefix\n[one] hello\n[one] Downloading 100%\n"
+        assert buf.getvalue().endswith("[one] unfinished\n")
+
+describe HarpoonCase, "make_in_parallel":
+
+    def make_scheduler(self, **deps):
+        images = {}
+        for name, depends_on in deps.items():
+            image = mock.Mock(name=name, spec=["name", "dependencies"])
+            image.name = name
+            image.dependencies.return_value = depends_on
+            images[name] = image
+        return Scheduler(images)
+
+    it "starts an image as soon as what it depends on is made":
+        scheduler = self.make_scheduler(one=[], two=[], three=["one"])
+        two_waiting = threading.Event()
+        three_made = threading.Event()
+        made = []
+        stdout = StringIO()
+        harpoon = mock.Mock(name="harpoon", stdout=stdout)
+
+        def make(image):
+            if image.name == "two":
+                # two can't finish until three, which needs one, is made
+                assert three_made.wait(timeout=5)
+            harpoon.stdout.write("made\n")
+            made.append(image.name)
+            if image.name == "three":
+                three_made.set()
+
+        make_in_parallel(harpoon, scheduler, make, 2)
+        assert made == ["one", "three", "two"]
+        assert scheduler.done
+        assert harpoon.stdout is stdout
+        assert "[three] made\n" in stdout.getvalue()
+
+    it "doesn't start more images after one fails":
+        scheduler = self.make_scheduler(one=[], two=[], three=[], four=["two"])
+        harpoon = mock.Mock(name="harpoon", stdout=StringIO())
+        made = []
+
+        class Failed(Exception):
+            pass
+
+        def make(image):
+            made.append(image.name)
+            if image.name == "four":
+                raise Failed()
+
+        with pytest.raises(Failed):
+            make_in_parallel(harpoon, scheduler, make, 1)
+        assert made == ["two", "four"]
+
+    it "doesn't ask to intervene in failed builds":
+        scheduler = self.make_scheduler(one=[], two=[])
+        harpoon = mock.Mock(
+            name="harpoon", stdout=StringIO(), interactive=True, no_intervention=False
+        )
+        conf = mock.Mock(name="conf", harpoon=harpoon)
+
+        class Failed(Exception):
+            pass
+
+        def make(image):
+            with Runner().intervention("container", conf):
+                raise Failed()
+
+        with mock.patch("builtins.input", side_effect=AssertionError("asked for input")):
+            with pytest.raises(Failed):
+                make_in_parallel(harpoon, scheduler, make, 2)
+
+        assert harpoon.no_intervention is False
+        assert "It would appear" not in harpoon.stdout.getvalue()
+
+describe HarpoonCase, "pushing_in_background":
+
+    def make_image(self, name):
+        image = mock.Mock(name=name, spec=["name"])
+        image.name = name
+        return image
+
+    it "pushes while more images are made and waits for them at the end":
+        stdout = StringIO()
+        harpoon = mock.Mock(name="harpoon", stdout=stdout)
+        pushing = threading.Event()
+        made_next = threading.Event()
+        pushed = []
+
+        def push(image):
+            pushing.set()
+            assert made_next.wait(timeout=5)
+            harpoon.stdout.write("pushed\n")
+            pushed.append(image.name)
+
+        with pushing_in_background(harpoon, push) as pusher:
+            pusher.push(self.make_image("one"))
+            assert pushing.wait(timeout=5)
+            made_next.set()
+
+        assert pushed == ["one"]
+        assert harpoon.stdout is stdout
+        assert stdout.getvalue() == "[push one] pushed\n"
+
+    it "doesn't let too many pushes wait":
+        harpoon = mock.Mock(name="harpoon", stdout=StringIO())
+        release = threading.Event()
+        handed_over = []
+
+        def push(image):
+            assert release.wait(timeout=5)
+
+        with pushing_in_background(harpoon, push, workers=1, max_pending=2) as pusher:
+
+            def hand_over():
+                for name in ("one", "two", "three"):
+                    pusher.push(self.make_image(name))
+                    handed_over.append(name)
+
+            thread = threading.Thread(target=hand_over)
+            thread.start()
+            thread.join(timeout=0.2)
+            assert handed_over == ["one", "two"]
+
+            release.set()
+            thread.join(timeout=5)
+            assert handed_over == ["one", "two", "three"]
+
+    it "reports the pushes that failed once they are all done":
+        harpoon = mock.Mock(name="harpoon", stdout=StringIO())
+        pushed = []
+
+        def push(image):
+            if image.name == "two":
+                raise ValueError("registry said no")
+            pushed.append(image.name)
+
+        with assertRaises(FailedImage, "Failed to push images", images=["two"]):
+            with pushing_in_background(harpoon, push) as pusher:
+                for name in ("one", "two", "three"):
+                    pusher.push(self.make_image(name))
+
+        assert pushed == ["one", "three"]
@@ -0,0 +1,86 @@
+# coding: spec
+
+import json
+import os
+from unittest import mock
+
+import pytest
+from delfick_project.errors_pytest import assertRaises
+
+from harpoon.errors import HarpoonError
+from harpoon.ship.scheduler import BuildTimes, Scheduler
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "BuildTimes":
+    it "keeps a moving average of durations and saves them":
+        with self.a_temp_dir() as directory:
+            location = os.path.join(directory, "cache", "build_times.json")
+            times = BuildTimes(location)
+            assert times.durations("make") == {}
+
+            times.record("make", "one", 10)
+            times.record("make", "one", 20)
+            with times.timed("pull", "two"):
+                pass
+            with pytest.raises(ValueError):
+                with times.timed("pull", "three"):
+                    raise ValueError("nope")
+            with times.timed("pull", "four") as timing:
+                timing["skipped"] = True
+            times.save()
+
+            with open(location) as fle:
+                saved = json.load(fle)
+            assert saved["make"] == {"one": 15}
+            assert list(saved["pull"]) == ["two"]
+            assert BuildTimes(location).durations("make") == {"one": 15}
+
+describe HarpoonCase, "Scheduler":
+
+    def make_images(self, **deps):
+        images = {}
+        for name, depends_on in deps.items():
+            image = mock.Mock(name=name, spec=["name", "dependencies"])
+            image.name = name
+            image.dependencies.return_value = depends_on
+            images[name] = image
+        return images
+
+    it "weights the longest path of work after each image by how long it took":
+        images = self.make_images(
+            base=[], quick=[], slow=["base"], app=["slow", "quick"], other=["base", "outside"]
+        )
+        durations = {"base": 2, "quick": 1, "slow": 10, "app": 3}
+        scheduler = Scheduler(images, durations=durations)
+
+        # other has no duration so it gets the average of the rest
+        assert scheduler.priorities == {
+            "app": 3,
+            "other": 4,
+            "slow": 13,
+            "quick": 4,
+            "base": 15,
+        }
+        assert scheduler.deps["other"] == set(["base"])
+
+    it "hands out images once their dependencies are finished":
+        images = self.make_images(base=[], quick=[], slow=["base"], app=["slow", "quick"])
+        scheduler = Scheduler(images, durations={"slow": 10})
+
+        assert scheduler.next_ready() == ("base", images["base"])
+        assert scheduler.next_ready() == ("quick", images["quick"])
+        assert scheduler.next_ready() is None
+
+        scheduler.finish("quick")
+        assert scheduler.next_ready() is None
+        scheduler.finish("base")
+        assert scheduler.next_ready() == ("slow", images["slow"])
+        scheduler.finish("slow")
+        assert [image.name for image in scheduler.in_order()] == ["app"]
+        assert scheduler.done
+
+    it "complains about cycles":
+        images = self.make_images(one=["two"], two=["three"], three=["one"])
+        chain = ["one", "two", "three", "one"]
+        with assertRaises(HarpoonError, "Found a cycle in the dependencies", chain=chain):
+            Scheduler(images)
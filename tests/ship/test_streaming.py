@@ -0,0 +1,51 @@
+# coding: spec
+
+import threading
+
+import pytest
+
+from harpoon.ship.streaming import ChunkReader, iter_written
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "iter_written":
+    it "yields what is written in chunks":
+
+        def write(fileobj):
+            for i in range(10):
+                fileobj.write(b"a" * 3)
+
+        chunks = list(iter_written(write, chunk_size=4, max_chunks=2))
+        assert b"".join(chunks) == b"a" * 30
+        assert all(len(chunk) >= 4 for chunk in chunks[:-1])
+
+    it "raises errors from the writer":
+
+        def write(fileobj):
+            fileobj.write(b"stuff")
+            raise ValueError("nope")
+
+        with pytest.raises(ValueError, match="nope"):
+            list(iter_written(write, chunk_size=1))
+
+    it "stops the writer when nothing is reading anymore":
+        finished = threading.Event()
+
+        def write(fileobj):
+            try:
+                while True:
+                    fileobj.write(b"a" * 10)
+            finally:
+                finished.set()
+
+        chunks = iter_written(write, chunk_size=10, max_chunks=1)
+        assert next(chunks) == b"a" * 10
+        chunks.close()
+        assert finished.wait(timeout=5)
+
+describe HarpoonCase, "ChunkReader":
+    it "reads across chunks":
+        reader = ChunkReader([b"one", b"", b"two", b"three"])
+        assert reader.read(2) == b"on"
+        assert reader.read(5) == b"etwot"
+        assert reader.read() == b"hree"
+        assert reader.read(10) == b""
@@ -0,0 +1,63 @@
+# coding: spec
+
+import os
+import tarfile
+from io import BytesIO
+from unittest import mock
+
+from harpoon.ship.context import normalise_tarinfo
+from harpoon.ship.tar_writer import TarWriter, copy_file_into
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "copy_file_into":
+    it "copies part of a file into the current position of another":
+        location = self.make_temp_file("0123456789").name
+        with open(os.path.join(self.make_temp_dir(), "out"), "w+b") as dst:
+            dst.write(b"ab")
+            assert copy_file_into(location, dst, 4, offset=3) == 4
+            dst.write(b"cd")
+            dst.seek(0)
+            assert dst.read() == b"ab3456cd"
+
+    it "falls back to copying in python":
+        location = self.make_temp_file("0123456789").name
+        with open(os.path.join(self.make_temp_dir(), "out"), "w+b") as dst:
+            with mock.patch("os.copy_file_range", side_effect=OSError("nope"), create=True):
+                assert copy_file_into(location, dst, 10) == 10
+            dst.seek(0)
+            assert dst.read() == b"0123456789"
+
+describe HarpoonCase, "TarWriter":
+
+    def make_tar(self, pairs, filter=None, fast=True):
+        with open(os.path.join(self.make_temp_dir(), "context.tar"), "w+b") as fle:
+            t = tarfile.open(mode="w", fileobj=fle)
+            writer = TarWriter(t, filter=filter)
+            for path, arcname in pairs:
+                if fast:
+                    writer.add(path, arcname, os.lstat(path))
+                else:
+                    t.add(path, arcname=arcname, filter=filter)
+            t.close()
+            fle.seek(0)
+            return fle.read()
+
+    it "makes the same tar as tarfile":
+        root, files = self.setup_directory({"one": "1" * 1000, "two": {"three": ""}})
+        os.symlink("one", os.path.join(root, "link"))
+        os.link(files["one"]["/file/"], os.path.join(root, "hardlink"))
+        pairs = [
+            (files["one"]["/file/"], "./one"),
+            (files["two"]["three"]["/file/"], "./two/three"),
+            (os.path.join(root, "link"), "./link"),
+            (os.path.join(root, "hardlink"), "./hardlink"),
+            (files["two"]["/folder/"], "./two"),
+        ]
+
+        for filter in (None, normalise_tarinfo):
+            made = self.make_tar(pairs, filter=filter)
+            assert made == self.make_tar(pairs, filter=filter, fast=False)
+
+        with tarfile.open(fileobj=BytesIO(made)) as tf:
+            hardlink = tf.getmember("./hardlink")
+            assert hardlink.islnk() and hardlink.linkname == "./one"
@@ -0,0 +1,53 @@
+# coding: spec
+
+import os
+
+from harpoon.ship.walker import Walker
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "Walker":
+    it "finds all the files and remembers their lstat":
+        root, files = self.setup_directory(
+            {"one": "1", "two": {"three": "3", "four": {"five": "5"}}, "empty": {}}
+        )
+
+        found, errors = Walker(root).walk()
+        assert errors == []
+        assert sorted(found) == ["one", "two/four/five", "two/three"]
+        assert found["two/three"] == os.lstat(files["two"]["three"]["/file/"])
+
+    it "follows symlinks to directories and includes symlinks to files":
+        root, files = self.setup_directory({"one": "1", "two": {"three": "3"}})
+        os.symlink(files["two"]["/folder/"], os.path.join(root, "linked"))
+        os.symlink(files["one"]["/file/"], os.path.join(root, "link_to_one"))
+        os.symlink(os.path.join(root, "nonexistent"), os.path.join(root, "broken"))
+
+        found, errors = Walker(root).walk()
+        assert errors == []
+        assert sorted(found) == ["broken", "link_to_one", "linked/three", "one", "two/three"]
+        assert found["link_to_one"] == os.lstat(os.path.join(root, "link_to_one"))
+
+    it "doesn't loop forever on symlink loops":
+        root, files = self.setup_directory({"one": {"two": {"three": "3"}}})
+        os.symlink(files["one"]["/folder/"], os.path.join(files["one"]["two"]["/folder/"], "loop"))
+        os.symlink(root, os.path.join(root, "root_loop"))
+
+        found, errors = Walker(root).walk()
+        assert errors == []
+        assert sorted(found) == ["one/two/three"]
+
+    it "doesn't look inside directories that are pruned":
+        root, files = self.setup_directory(
+            {"one": "1", "node_modules": {"a": {"b": "b"}}, "two": {"node_modules": {"c": "c"}}}
+        )
+
+        looked_at = []
+
+        def prune(relpath):
+            looked_at.append(relpath)
+            return relpath.endswith("node_modules")
+
+        found, errors = Walker(root, prune=prune).walk()
+        assert errors == []
+        assert sorted(found) == ["one"]
+        assert sorted(looked_at) == ["node_modules", "two", "two/node_modules"]
@@ -0,0 +1,125 @@
+# coding: spec
+
+import os
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from harpoon.option_spec import image_objs as objs
+from harpoon.ship.context import ContextBuilder
+from harpoon.ship.context_scans import ContextScans
+from harpoon.ship import watcher as watcher_module
+from harpoon.ship.watcher import ContextWatcher
+from tests.helpers import HarpoonCase
+
+describe HarpoonCase, "ContextWatcher":
+
+    def make_watcher(self, heirarchy, **options):
+        root, files = self.setup_directory(heirarchy)
+        context = objs.Context(enabled=True, parent_dir=root, **options)
+        watcher = ContextWatcher(context, interval=0.01, use_inotify=False)
+        watcher.start()
+        return root, files, watcher
+
+    def write(self, location, content):
+        with open(location, "w") as fle:
+            fle.write(content)
+        # Make sure the mtime changes even on filesystems with coarse timestamps
+        os.utime(location, ns=(time.time_ns(), time.time_ns() + 10_000_000))
+
+    it "finds the files in the context without looking in pruned folders":
+        root, files, watcher = self.make_watcher(
+            {"one": "1", "two": {"three": "3"}, "node_modules": {"four": "4"}},
+            exclude=["node_modules/**"],
+        )
+        assert sorted(watcher.found) == ["one", "two/three"]
+
+    it "finds what changed":
+        root, files, watcher = self.make_watcher({"one": "1", "two": {"three": "3"}})
+
+        assert watcher.changes(0) == set()
+
+        self.write(files["one"]["/file/"], "11")
+        os.remove(files["two"]["three"]["/file/"])
+        os.makedirs(os.path.join(root, "five"))
+        self.write(os.path.join(root, "five", "six"), "6")
+
+        assert watcher.changes(0) == set(["one", "two/three", "five/six"])
+        assert sorted(watcher.found) == ["five/six", "one"]
+
+    it "refreshes single paths and folders like it does for inotify events":
+        root, files, watcher = self.make_watcher({"one": "1", "two": {"three": "3", "four": "4"}})
+
+        self.write(files["one"]["/file/"], "11")
+        assert watcher.refresh("one") == set(["one"])
+        assert watcher.refresh("one") == set()
+
+        os.remove(files["two"]["three"]["/file/"])
+        os.remove(files["two"]["four"]["/file/"])
+        os.rmdir(files["two"]["/folder/"])
+        assert watcher.refresh("two") == set(["two/three", "two/four"])
+
+        os.makedirs(os.path.join(root, "five", "six"))
+        self.write(os.path.join(root, "five", "six", "seven"), "7")
+        assert watcher.refresh("five") == set(["five/six/seven"])
+        assert sorted(watcher.found) == ["five/six/seven", "one"]
+
+    it "looks at everything again when inotify says it lost events":
+        root, files, watcher = self.make_watcher({"one": "1", "two": {"three": "3"}})
+
+        self.write(files["one"]["/file/"], "11")
+        os.makedirs(os.path.join(root, "four"))
+        self.write(os.path.join(root, "four", "five"), "5")
+
+        fake_flags = SimpleNamespace(
+            MODIFY=0x2,
+            ATTRIB=0x4,
+            CLOSE_WRITE=0x8,
+            MOVED_FROM=0x40,
+            MOVED_TO=0x80,
+            CREATE=0x100,
+            DELETE=0x200,
+            Q_OVERFLOW=0x4000,
+            IGNORED=0x8000,
+            ISDIR=0x40000000,
+        )
+        overflow = SimpleNamespace(wd=-1, mask=fake_flags.Q_OVERFLOW, cookie=0, name="")
+
+        watcher.inotify = mock.Mock(name="inotify")
+        watcher.inotify.read.return_value = [overflow]
+        watcher.inotify.add_watch.side_effect = lambda path, mask: path
+
+        with mock.patch.object(watcher_module, "flags", fake_flags):
+            assert watcher.changes(0) == set(["one", "four/five"])
+
+        assert sorted(watcher.found) == ["four/five", "one", "two/three"]
+        assert sorted(watcher.watches.values()) == ["", "four", "two"]
+
+    it "waits for changes to stop before calling on_change":
+        root, files, watcher = self.make_watcher({"one": "1", "two": "2"})
+        calls = []
+
+        def changes(timeout):
+            remaining = writes.pop(0) if writes else []
+            for name in remaining:
+                self.write(files[name]["/file/"], name * 2)
+            return original_changes(timeout)
+
+        writes = [["one"], ["two"], [], ["one"], []]
+        original_changes = watcher.changes
+        watcher.changes = changes
+        watcher.watch(calls.append, debounce=0, until=lambda: len(calls) == 2)
+
+        assert calls == [set(["one", "two"]), set(["one"])]
+
+    it "gives a scan that a ContextBuilder can use":
+        root, files, watcher = self.make_watcher({"one": "1", "two": "2"})
+        self.write(os.path.join(root, "three"), "3")
+        watcher.changes(0)
+
+        scans = ContextScans()
+        scans.update(watcher.context, watcher.scan())
+        assert scans.shared(watcher.context)
+
+        found = ContextBuilder().find_files(watcher.context, False, scans=scans)
+        assert found == sorted(os.path.join(root, name) for name in ["one", "three", "two"])